@@ -0,0 +1,44 @@
+from typing import List, Optional
+from flask import session
+from sqlalchemy import select
+from app import db
+from db_models import Account, DEFAULT_ACCOUNT_ID
+
+def current_account_id() -> int:
+    """The account the request works in: the one picked in the navbar, else the default account"""
+    return session.get('account_id', DEFAULT_ACCOUNT_ID)
+
+def select_account(account_id: int):
+    """Make account_id the current account for the rest of the session"""
+    session['account_id'] = account_id
+
+def list_accounts() -> List[Account]:
+    return db.session.execute(select(Account).order_by(Account.id)).scalars().all()
+
+def account_ids() -> List[int]:
+    return db.session.execute(select(Account.id).order_by(Account.id)).scalars().all()
+
+def lock_account(account_id: int):
+    """Hold the account's row lock until the transaction ends, so writers of one account take
+    turns. SQLite needs none: a writer already holds the whole database."""
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return
+    db.session.execute(select(Account.id).where(Account.id == account_id).with_for_update())
+
+def get_account(account_id: int) -> Optional[Account]:
+    return db.session.get(Account, account_id)
+
+def get_account_by_name(name: str) -> Optional[Account]:
+    return db.session.execute(select(Account).where(Account.name == name)).scalar()
+
+def create_account(name: str) -> Account:
+    """Add an account and commit; account names are unique"""
+    name = name.strip()
+    if not name:
+        raise ValueError('Account name is required')
+    if get_account_by_name(name):
+        raise ValueError(f'Account {name} already exists')
+    account = Account(name=name)
+    db.session.add(account)
+    db.session.commit()
+    return account
@@ -0,0 +1,367 @@
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from datetime import date
+from collections import defaultdict
+from sqlalchemy import select, update, insert, delete, func, bindparam
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+import accounts
+from db_models import (Account, Trade, TradeAction, SymbolAggregate, OptionExpiryAggregate,
+                       DailySymbolAggregate, DailyAggregate, expiry_cutoff)
+from utils import calculate_portfolio_stats
+
+AGGREGATE_COLUMNS = [
+    'trade_count', 'stock_trades', 'options_trades', 'open_positions', 'closed_positions',
+    'total_invested', 'total_proceeds', 'options_premium_paid', 'options_premium_received',
+    'realized_pnl', 'total_fees', 'stock_quantity', 'stock_cost', 'stock_buy_quantity',
+    'buy_cost', 'sell_cost',
+]
+
+AGGREGATE_MODELS = [SymbolAggregate, OptionExpiryAggregate, DailySymbolAggregate, DailyAggregate]
+
+DAILY_COLUMNS = ['trade_count', 'cash_flow', 'realized_pnl', 'fees', 'exposure_change']
+
+# Running total column of DailySymbolAggregate and DailyAggregate for each daily change column
+CUMULATIVE_COLUMNS = {
+    'cash_flow': 'cum_cash_flow',
+    'realized_pnl': 'cum_realized_pnl',
+    'exposure_change': 'exposure',
+}
+
+def trade_deltas(trade: Trade) -> Dict[str, float]:
+    """Contribution of a single trade to its symbol's aggregate row"""
+    deltas = dict.fromkeys(AGGREGATE_COLUMNS, 0)
+    deltas['trade_count'] = 1
+
+    if trade.is_option:
+        deltas['options_trades'] = 1
+    else:
+        deltas['stock_trades'] = 1
+
+    if trade.is_closed:
+        deltas['closed_positions'] = 1
+        deltas['realized_pnl'] = trade.realized_pnl
+    else:
+        deltas['open_positions'] = 1
+
+    deltas['total_fees'] = trade.fees or 0
+
+    # Same debit/credit split as calculate_portfolio_stats
+    total_cost = trade.total_cost
+    trade_value = abs(total_cost)
+    if total_cost > 0:
+        deltas['total_invested'] = trade_value
+        if trade.is_option:
+            deltas['options_premium_paid'] = trade_value
+        else:
+            deltas['stock_cost'] = trade_value
+            deltas['stock_quantity'] = abs(trade.quantity)
+            deltas['stock_buy_quantity'] = abs(trade.quantity)
+    else:
+        deltas['total_proceeds'] = trade_value
+        if trade.is_option:
+            deltas['options_premium_received'] = trade_value
+        else:
+            deltas['stock_quantity'] = -abs(trade.quantity)
+
+    # Same action split as the portfolio positions table
+    if trade.action in [TradeAction.BUY_TO_OPEN, TradeAction.BUY_TO_CLOSE]:
+        deltas['buy_cost'] = total_cost
+    else:
+        deltas['sell_cost'] = total_cost
+
+    return deltas
+
+def daily_deltas(trade: Trade) -> Dict[date, Dict[str, float]]:
+    """Contribution of a single trade to the daily rollups, by day.
+
+    The trade counts on its own date; a close recorded on the row counts on
+    the closed date. Exposure is the cost of an opening trade until it is
+    closed, and closing trades reduce it by their own cost.
+    """
+    days = defaultdict(lambda: dict.fromkeys(DAILY_COLUMNS, 0))
+    total_cost = trade.total_cost
+    trade_value = abs(total_cost)
+    opening = trade.action in [TradeAction.BUY_TO_OPEN, TradeAction.SELL_TO_OPEN]
+
+    traded = days[trade.date]
+    traded['trade_count'] = 1
+    traded['cash_flow'] = -total_cost
+    traded['fees'] = trade.fees or 0
+    traded['exposure_change'] = trade_value if opening else -trade_value
+
+    if trade.is_closed:
+        closed = days[trade.closed_date or trade.date]
+        if trade.close_price is not None and trade.close_quantity:
+            realized_pnl = trade.realized_pnl
+            closed['realized_pnl'] += realized_pnl
+            # Closing proceeds or cost, backed out of Trade.realized_pnl
+            if trade.action == TradeAction.BUY_TO_OPEN:
+                closed['cash_flow'] += realized_pnl + trade_value
+            else:
+                closed['cash_flow'] += realized_pnl - trade_value
+        if opening:
+            closed_fraction = 1.0
+            if trade.close_quantity and trade.quantity:
+                closed_fraction = min(1.0, abs(trade.close_quantity) / abs(trade.quantity))
+            closed['exposure_change'] -= trade_value * closed_fraction
+
+    return days
+
+def _upsert_increment(table, key_names: Tuple[str, ...], names: List[str]):
+    """INSERT of a key and deltas that adds the deltas to the row instead when the key exists.
+
+    One statement (ON CONFLICT DO UPDATE, SQLite and Postgres), so two writers creating
+    the same row both land instead of one failing on the primary key.
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        stmt = postgresql.insert(table)
+    else:
+        stmt = sqlite.insert(table)
+    return stmt.on_conflict_do_update(index_elements=list(key_names),
+                                      set_={name: table.c[name] + stmt.excluded[name] for name in names})
+
+def _increment(model, key: Dict, deltas: Dict[str, float], sign: int):
+    """Add deltas to the row identified by key, creating the row if it doesn't exist"""
+    values = {name: sign * value for name, value in deltas.items() if value}
+    if not values:
+        return
+    stmt = _upsert_increment(model.__table__, tuple(key), list(values))
+    db.session.connection().execute(stmt, [dict(key, **values)])
+
+def _increment_many(model, key_names: Union[str, Tuple[str, ...]], rows: Dict):
+    """_increment for many rows at once: {key: deltas} applied with executemany.
+
+    key_names is a column name, or a tuple of names for a composite key whose
+    keys are then tuples in the same order.
+    """
+    if not rows:
+        return
+    composite = not isinstance(key_names, str)
+    key_names = key_names if composite else (key_names,)
+    names = list(next(iter(rows.values())))
+    params = [dict(deltas, **dict(zip(key_names, key if composite else (key,)))) for key, deltas in rows.items()]
+    # A Core statement, so a list of parameters runs as executemany rather than an ORM bulk insert
+    db.session.connection().execute(_upsert_increment(model.__table__, key_names, names), params)
+
+def _update_cumulative(model, key: Dict, from_day: date):
+    """Recompute the running totals of the daily rows matching key (an account's DailyAggregate
+    rows, or one symbol's DailySymbolAggregate rows) for from_day and every later day.
+
+    Reads the totals and writes them back, so the caller must hold the account lock
+    (accounts.lock_account) from before its first aggregate write.
+    """
+    table = model.__table__
+    match = [table.c[name] == value for name, value in key.items()]
+    change_columns = [table.c[name] for name in CUMULATIVE_COLUMNS]
+    total_columns = [table.c[name] for name in CUMULATIVE_COLUMNS.values()]
+
+    previous = db.session.execute(select(*total_columns)
+                                  .where(*match, table.c.day < from_day)
+                                  .order_by(table.c.day.desc())
+                                  .limit(1)).first()
+    running = list(previous) if previous else [0.0] * len(total_columns)
+
+    params = []
+    for day, *changes in db.session.execute(select(table.c.day, *change_columns)
+                                            .where(*match, table.c.day >= from_day)
+                                            .order_by(table.c.day)):
+        running = [total + change for total, change in zip(running, changes)]
+        params.append(dict(zip([f'_{column.name}' for column in total_columns], running), _day=day))
+
+    if params:
+        stmt = (update(table)
+                .where(*match, table.c.day == bindparam('_day'))
+                .values({column.name: bindparam(f'_{column.name}') for column in total_columns}))
+        db.session.connection().execute(stmt, params)
+
+def _first_days(days: Iterable[Tuple]) -> Dict[Tuple, date]:
+    """Earliest day per key among keys ending with the day, such as (account_id, day)
+    or (account_id, symbol, day)"""
+    first = {}
+    for *key, day in days:
+        key = tuple(key)
+        if key not in first or day < first[key]:
+            first[key] = day
+    return first
+
+def apply_trade(trade: Trade, sign: int = 1):
+    """Add a trade to its account's aggregates (sign=-1 removes it). Does not commit."""
+    accounts.lock_account(trade.account_id)
+    account = {'account_id': trade.account_id}
+    _increment(SymbolAggregate, dict(account, symbol=trade.symbol), trade_deltas(trade), sign)
+
+    if trade.is_option and trade.expiration_date:
+        _increment(OptionExpiryAggregate, dict(account, expiration_date=trade.expiration_date),
+                   {'options_count': 1}, sign)
+
+    days = daily_deltas(trade)
+    for day, deltas in days.items():
+        _increment(DailySymbolAggregate, dict(account, symbol=trade.symbol, day=day), deltas, sign)
+        _increment(DailyAggregate, dict(account, day=day), deltas, sign)
+    _update_cumulative(DailySymbolAggregate, dict(account, symbol=trade.symbol), min(days))
+    _update_cumulative(DailyAggregate, account, min(days))
+
+class _Sums:
+    """Summed deltas of many trades for every aggregate table, times sign; keys start with the account id"""
+
+    def __init__(self, trades: Iterable[Trade], sign: int = 1):
+        self.symbols = defaultdict(lambda: dict.fromkeys(AGGREGATE_COLUMNS, 0))
+        self.expiries = defaultdict(int)
+        self.symbol_days = defaultdict(lambda: dict.fromkeys(DAILY_COLUMNS, 0))
+        self.days = defaultdict(lambda: dict.fromkeys(DAILY_COLUMNS, 0))
+        self.count = 0
+        for trade in trades:
+            account_id = trade.account_id
+            row = self.symbols[(account_id, trade.symbol)]
+            for name, value in trade_deltas(trade).items():
+                row[name] += sign * value
+            if trade.is_option and trade.expiration_date:
+                self.expiries[(account_id, trade.expiration_date)] += sign
+            for day, deltas in daily_deltas(trade).items():
+                symbol_day = self.symbol_days[(account_id, trade.symbol, day)]
+                portfolio_day = self.days[(account_id, day)]
+                for name, value in deltas.items():
+                    symbol_day[name] += sign * value
+                    portfolio_day[name] += sign * value
+            self.count += 1
+
+def _update_all_cumulative(sums: _Sums):
+    """Recompute the running totals from each account's and each symbol's first changed day"""
+    for (account_id, symbol), first_day in _first_days(sums.symbol_days).items():
+        _update_cumulative(DailySymbolAggregate, {'account_id': account_id, 'symbol': symbol}, first_day)
+    for (account_id,), first_day in _first_days(sums.days).items():
+        _update_cumulative(DailyAggregate, {'account_id': account_id}, first_day)
+
+def apply_trades(trades: Iterable[Trade], sign: int = 1):
+    """Add many trades with one update per account, symbol, day and expiration date
+    (sign=-1 removes them). Does not commit."""
+    sums = _Sums(trades, sign)
+    # In id order, so two writers spanning the same accounts can't deadlock
+    for (account_id,) in sorted(_first_days(sums.days)):
+        accounts.lock_account(account_id)
+    _increment_many(SymbolAggregate, ('account_id', 'symbol'), sums.symbols)
+    _increment_many(OptionExpiryAggregate, ('account_id', 'expiration_date'),
+                    {key: {'options_count': count} for key, count in sums.expiries.items()})
+    _increment_many(DailySymbolAggregate, ('account_id', 'symbol', 'day'), sums.symbol_days)
+    _increment_many(DailyAggregate, ('account_id', 'day'), sums.days)
+    _update_all_cumulative(sums)
+
+def revert_trade(trade: Trade):
+    """Remove a trade's current values from the aggregates. Does not commit."""
+    apply_trade(trade, sign=-1)
+
+def rebuild_aggregates(batch_size: int = 1000, account_id: Optional[int] = None) -> int:
+    """Recompute the aggregate rows of one account, or of every account, from the trades
+    table and commit; returns the trade count"""
+    stmt = select(Trade).execution_options(yield_per=batch_size)
+    if account_id is not None:
+        accounts.lock_account(account_id)
+        stmt = stmt.where(Trade.account_id == account_id)
+    else:
+        for locked_id in db.session.scalars(select(Account.id).order_by(Account.id)).all():
+            accounts.lock_account(locked_id)
+    sums = _Sums(db.session.execute(stmt).scalars())
+
+    for model in AGGREGATE_MODELS:
+        if account_id is not None:
+            db.session.execute(delete(model).where(model.account_id == account_id))
+        else:
+            db.session.execute(delete(model))
+    if sums.symbols:
+        db.session.execute(insert(SymbolAggregate),
+                           [dict(values, account_id=account_id, symbol=symbol)
+                            for (account_id, symbol), values in sums.symbols.items()])
+    if sums.expiries:
+        db.session.execute(insert(OptionExpiryAggregate),
+                           [{'account_id': account_id, 'expiration_date': exp, 'options_count': n}
+                            for (account_id, exp), n in sums.expiries.items()])
+    if sums.symbol_days:
+        db.session.execute(insert(DailySymbolAggregate),
+                           [dict(values, account_id=account_id, symbol=symbol, day=day)
+                            for (account_id, symbol, day), values in sums.symbol_days.items()])
+    if sums.days:
+        db.session.execute(insert(DailyAggregate),
+                           [dict(values, account_id=account_id, day=day)
+                            for (account_id, day), values in sums.days.items()])
+        _update_all_cumulative(sums)
+    db.session.commit()
+    return sums.count
+
+def needs_rebuild(changes: List[str]) -> bool:
+    """True if a schema.migrate run created an aggregate table or added a column to one,
+    which start out empty or zero even when the database already has trades"""
+    tables = {model.__tablename__ for model in AGGREGATE_MODELS}
+    for change in changes:
+        action, _, target = change.rpartition(' ')
+        if action in ('create table', 'add column') and target.split('.')[0] in tables:
+            return True
+    return False
+
+def load_symbol_aggregates(account_id: int) -> List[SymbolAggregate]:
+    """All of an account's symbols that currently have trades"""
+    return (SymbolAggregate.query
+            .filter(SymbolAggregate.account_id == account_id, SymbolAggregate.trade_count > 0)
+            .order_by(SymbolAggregate.symbol)
+            .all())
+
+def count_expired_options(account_id: int, expired_before: date = None) -> int:
+    """An account's options whose expiration date has passed, summed per expiration date"""
+    expired_before = expired_before or expiry_cutoff()
+    return db.session.query(func.coalesce(func.sum(OptionExpiryAggregate.options_count), 0)) \
+        .filter(OptionExpiryAggregate.account_id == account_id,
+                OptionExpiryAggregate.expiration_date < expired_before) \
+        .scalar()
+
+def portfolio_stats_from_aggregates(rows: List[SymbolAggregate], account_id: int) -> Dict:
+    """Build the calculate_portfolio_stats dict from an account's aggregate rows.
+
+    Stock avg_cost is the average price of all shares bought, and options_positions
+    is left empty because the aggregates don't keep per-trade lists.
+    """
+    stats = calculate_portfolio_stats([])
+    symbol_pnl = []
+
+    for row in rows:
+        for name in ['stock_trades', 'options_trades', 'open_positions', 'closed_positions',
+                     'total_invested', 'total_proceeds', 'options_premium_paid',
+                     'options_premium_received', 'realized_pnl', 'total_fees']:
+            stats[name] += getattr(row, name)
+        stats['total_trades'] += row.trade_count
+
+        if row.stock_trades:
+            stats['stock_positions'][row.symbol] = {
+                'quantity': row.stock_quantity,
+                'avg_cost': row.avg_cost,
+                'total_cost': row.stock_cost,
+            }
+        symbol_pnl.append((row.symbol, row.net_pnl))
+
+    if stats['options_trades']:
+        stats['expired_options'] = count_expired_options(account_id)
+        stats['active_options'] = stats['options_trades'] - stats['expired_options']
+
+    stats['net_pnl'] = stats['total_proceeds'] - stats['total_invested']
+
+    symbol_pnl.sort(key=lambda x: x[1], reverse=True)
+    if symbol_pnl:
+        stats['top_performers'] = symbol_pnl[:5]
+        stats['worst_performers'] = symbol_pnl[-5:]
+
+    return stats
+
+def positions_from_aggregates(rows: List[SymbolAggregate]) -> Dict:
+    """Per-symbol summary rows for the portfolio positions table"""
+    return {
+        row.symbol: {
+            'symbol': row.symbol,
+            'stock_trades': row.stock_trades,
+            'options_trades': row.options_trades,
+            'total_cost': row.buy_cost,
+            'total_proceeds': row.sell_cost,
+        }
+        for row in rows
+    }
+
+def load_portfolio_stats(account_id: int) -> Dict:
+    """An account's portfolio statistics read from the aggregate tables"""
+    return portfolio_stats_from_aggregates(load_symbol_aggregates(account_id), account_id)
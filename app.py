@@ -1,39 +1,133 @@
 import os
 import logging
+import tempfile
+from typing import Optional
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
-
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+import sqlite_storage
 
 class Base(DeclarativeBase):
     pass
 
 db = SQLAlchemy(model_class=Base)
 
-# Create the app
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
-
-# Configure the database
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL") or "sqlite:///trades.db"
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-# Initialize the app with the extension
-db.init_app(app)
-
-# Import models and routes after db setup
-from db_models import *
-from routes import *
-
-with app.app_context():
-    db.create_all()
-
-if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+def load_config(app: Flask):
+    """Settings from the environment"""
+    # Configure the database
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL") or "sqlite:///trades.db"
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+    }
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+    # SQLite file databases: WAL and the pragmas below on every connection, write requests take
+    # the write lock when they begin, and PRAGMA optimize runs every SQLITE_OPTIMIZE_INTERVAL
+    # seconds (0 disables). SQLITE_TUNED=0 leaves SQLite at its defaults.
+    app.config["SQLITE_TUNED"] = os.environ.get("SQLITE_TUNED", "1") == "1"
+    app.config["SQLITE_JOURNAL_MODE"] = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+    app.config["SQLITE_SYNCHRONOUS"] = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+    app.config["SQLITE_BUSY_TIMEOUT"] = int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000))  # milliseconds
+    app.config["SQLITE_CACHE_SIZE"] = int(os.environ.get("SQLITE_CACHE_SIZE", -65536))  # negative: KiB
+    app.config["SQLITE_MMAP_SIZE"] = int(os.environ.get("SQLITE_MMAP_SIZE", 268435456))  # bytes
+    app.config["SQLITE_TEMP_STORE"] = os.environ.get("SQLITE_TEMP_STORE", "MEMORY")
+    app.config["SQLITE_POOL_SIZE"] = int(os.environ.get("SQLITE_POOL_SIZE", 5))
+    app.config["SQLITE_POOL_OVERFLOW"] = int(os.environ.get("SQLITE_POOL_OVERFLOW", 10))
+    app.config["SQLITE_OPTIMIZE_INTERVAL"] = int(os.environ.get("SQLITE_OPTIMIZE_INTERVAL", 3600))
+
+    # Where the trade pages read and write trades: "sql" (the database) or "memory" (indexed, not persisted)
+    app.config["TRADE_STORE"] = os.environ.get("TRADE_STORE", "sql")
+
+    # Portfolio statistics: "aggregates" (incremental tables), "sql" (GROUP BY in the database), "numpy" or "python" (full recompute)
+    app.config["PORTFOLIO_STATS_ENGINE"] = os.environ.get("PORTFOLIO_STATS_ENGINE", "aggregates")
+
+    # Entries in the in-process cache of computed stats, keyed on the data version (0 disables)
+    app.config["RESPONSE_CACHE_SIZE"] = int(os.environ.get("RESPONSE_CACHE_SIZE", 128))
+    # Rendered dashboard rows kept in each worker, about 1.6 KB of HTML each (0 disables)
+    app.config["ROW_CACHE_SIZE"] = int(os.environ.get("ROW_CACHE_SIZE", 10000))
+
+    # Dashboard trade table
+    app.config["TRADES_PAGE_SIZE"] = int(os.environ.get("TRADES_PAGE_SIZE", 50))
+    app.config["TRADES_MAX_PAGE_SIZE"] = 500
+    app.config["STREAM_TRADE_TABLE"] = os.environ.get("STREAM_TRADE_TABLE") == "1"
+
+    # Live dashboard (/stream): each open dashboard holds a connection and checks its account's
+    # data version every STREAM_POLL_INTERVAL seconds, so it needs gunicorn gthread (or gevent)
+    # workers. Streams end after STREAM_MAX_SECONDS and the browser reconnects where it left off.
+    app.config["LIVE_DASHBOARD"] = os.environ.get("LIVE_DASHBOARD") == "1"
+    app.config["STREAM_POLL_INTERVAL"] = float(os.environ.get("STREAM_POLL_INTERVAL", 1.0))
+    app.config["STREAM_MAX_SECONDS"] = float(os.environ.get("STREAM_MAX_SECONDS", 300))
+    app.config["STREAM_HEARTBEAT_SECONDS"] = float(os.environ.get("STREAM_HEARTBEAT_SECONDS", 15))
+
+    # Broker statement import: rows per executemany/commit
+    app.config["IMPORT_BATCH_SIZE"] = int(os.environ.get("IMPORT_BATCH_SIZE", 5000))
+    # Trades one bulk API request (/api/trades/bulk/...) may create, close, edit or delete
+    app.config["BULK_MAX_TRADES"] = int(os.environ.get("BULK_MAX_TRADES", 10000))
+
+    # Open options are marked to the underlying prices in PRICE_FILE (CSV or Parquet with symbol,
+    # price and optional volatility columns) on the portfolio page; unset disables valuation
+    app.config["PRICE_FILE"] = os.environ.get("PRICE_FILE", "")
+    app.config["RISK_FREE_RATE"] = float(os.environ.get("RISK_FREE_RATE", 0.04))
+    app.config["DEFAULT_VOLATILITY"] = float(os.environ.get("DEFAULT_VOLATILITY", 0.30))  # where the file has none
+
+    # End-of-day closes for marking stock positions, loaded with `flask load-prices`; unset disables
+    app.config["PRICE_HISTORY_DIR"] = os.environ.get("PRICE_HISTORY_DIR", "")
+
+    # Close expired option positions at zero value every EXPIRY_SWEEP_INTERVAL seconds in a
+    # background thread of each web worker, started by its first request (0 disables;
+    # `flask sweep-expired` does it from cron)
+    app.config["EXPIRY_SWEEP_INTERVAL"] = int(os.environ.get("EXPIRY_SWEEP_INTERVAL", 0))
+
+    # Background jobs (jobs.py): each web worker runs the jobs it submits on JOB_WORKERS threads.
+    # With 0 they only queue, for `flask run-jobs` processes, which keeps heavy jobs off the web
+    # workers' CPU; those check for new jobs every JOB_POLL_INTERVAL seconds. Uploaded files
+    # wait in JOB_FILES_DIR (shared by the web and job processes) until their job finishes.
+    app.config["JOB_WORKERS"] = int(os.environ.get("JOB_WORKERS", 1))
+    app.config["JOB_POLL_INTERVAL"] = float(os.environ.get("JOB_POLL_INTERVAL", 1.0))
+    app.config["JOB_FILES_DIR"] = os.environ.get("JOB_FILES_DIR") or os.path.join(tempfile.gettempdir(), "tradingtracker-jobs")
+
+    # Trade journal (journal.py): after this many events since an account's last snapshot a
+    # journal_snapshot job is queued, so a point-in-time rebuild replays at most about this many
+    app.config["JOURNAL_SNAPSHOT_INTERVAL"] = int(os.environ.get("JOURNAL_SNAPSHOT_INTERVAL", 1000))
+
+    # Request metrics at /metrics; requests slower than SLOW_REQUEST_SECONDS are logged (0 disables)
+    app.config["METRICS_ENABLED"] = os.environ.get("METRICS_ENABLED", "1") == "1"
+    app.config["SLOW_REQUEST_SECONDS"] = float(os.environ.get("SLOW_REQUEST_SECONDS", 0))
+
+def create_app(config: Optional[dict] = None) -> Flask:
+    """Create the app; config overrides the environment settings.
+
+    Nothing here connects to the database. The schema is created and updated
+    by `flask migrate`.
+    """
+    # Configure logging
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+
+    # Create the app
+    app = Flask(__name__)
+    app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+
+    load_config(app)
+    app.config.update(config or {})
+    if app.config["SQLITE_TUNED"] and sqlite_storage.is_sqlite_file(app.config["SQLALCHEMY_DATABASE_URI"]):
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = sqlite_storage.engine_options(app.config)
+
+    # Initialize the app with the extension
+    db.init_app(app)
+    sqlite_storage.init_app(app, db)
+
+    # Models, views and commands are imported when the first app is created, not with this module
+    import db_models  # noqa: F401 (registers the models on db.Model)
+    import routes
+    import commands
+    import expiry
+    import metrics
+    app.register_blueprint(routes.bp)
+    app.register_blueprint(commands.bp)
+    metrics.init_app(app, db.Model)
+    expiry.init_app(app)
+
+    return app
@@ -0,0 +1,167 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+from datetime import date, datetime, timezone
+from itertools import islice
+from typing import Dict, List
+from benchmarks.run import parse_size
+
+SMALL_ACCOUNT = 'bench-small'
+DEFAULT_LARGE_SIZES = ['10k', '100k', '1m']
+
+def database_path(data_dir: str, small: int, large: int, seed: int, as_of: date) -> str:
+    """SQLite file for one pair of account sizes, so later runs reuse it"""
+    return os.path.join(data_dir, f'accounts-{small}-{large}-seed{seed}-{as_of.isoformat()}.db')
+
+def _copy_database(source: str, target: str):
+    """Copy a SQLite file, WAL included, through the backup API"""
+    source_connection = sqlite3.connect(source)
+    target_connection = sqlite3.connect(target)
+    try:
+        source_connection.backup(target_connection)
+    finally:
+        source_connection.close()
+        target_connection.close()
+
+def _create_app(database: str, stats_engine: str):
+    from app import create_app
+    config = {'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + database, 'TRADE_STORE': 'sql', 'WTF_CSRF_ENABLED': False}
+    if stats_engine:
+        config['PORTFOLIO_STATS_ENGINE'] = stats_engine
+    return create_app(config)
+
+def prepare(database: str, small: int, large: int, seed: int, as_of: date, stats_engine: str) -> Dict:
+    """Fill the small account and grow the default (large) account to large trades.
+
+    Generated trades are the same prefix for every size, so a copy of a smaller
+    data set grown to this size matches one built from scratch.
+    """
+    from app import db
+    from db_models import DEFAULT_ACCOUNT_ID
+    from benchmarks import data
+    from benchmarks.generator import generate_trades
+    import accounts
+
+    app = _create_app(database, stats_engine)
+    logging.getLogger().setLevel(logging.WARNING)
+    with app.app_context():
+        data.migrate()
+        account = accounts.get_account_by_name(SMALL_ACCOUNT) or accounts.create_account(SMALL_ACCOUNT)
+        if data.trade_count(account.id) == 0:
+            # Another seed, so the small account trades its own mix of symbols
+            data.load_trades(small, seed + 1, as_of, account.id)
+        existing = data.trade_count(DEFAULT_ACCOUNT_ID)
+        if existing > large:
+            raise SystemExit(f'{database} already has {existing} trades in the large account, expected {large}')
+        data.insert_trades(islice(generate_trades(large, seed, as_of), existing, large), DEFAULT_ACCOUNT_ID)
+        small_id = account.id
+        db.session.remove()
+        db.engine.dispose()
+    return {'small_account_id': small_id}
+
+def measure(database: str, small_account_id: int, repeat: int, stats_engine: str) -> Dict[str, Dict]:
+    """Cold and cached page views for each account; the stats cache is cleared before cold ones"""
+    from sqlalchemy import func, select
+    from app import db
+    from db_models import Trade, DEFAULT_ACCOUNT_ID
+    from benchmarks import scenarios
+
+    app = _create_app(database, stats_engine)
+    logging.getLogger().setLevel(logging.WARNING)
+    results = {}
+    for label, account_id in [('small', small_account_id), ('large', DEFAULT_ACCOUNT_ID)]:
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['account_id'] = account_id
+        with app.app_context():
+            top_symbol = db.session.execute(select(Trade.symbol)
+                                            .where(Trade.account_id == account_id)
+                                            .group_by(Trade.symbol)
+                                            .order_by(func.count().desc())
+                                            .limit(1)).scalar()
+        pages = {
+            'index': '/',
+            'index.symbol': f'/?symbol={top_symbol}&symbol_match=exact',
+            'portfolio': '/portfolio',
+            'timeseries': '/api/timeseries',
+        }
+        for name, url in pages.items():
+            def run(client=client, url=url):
+                scenarios._check(client.get(url), 200)
+            for variant, before_each in [('cold', lambda: scenarios._clear_cache(app)), ('cached', None)]:
+                scenario = scenarios.Scenario(f'{label}.{name}.{variant}', run, before_each=before_each)
+                results[scenario.name] = scenarios.time_scenario(scenario, repeat)
+    with app.app_context():
+        db.engine.dispose()
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Page latency of a small account while another account in the same database grows")
+    parser.add_argument('--small', default='1000', help='Trades in the small account')
+    parser.add_argument('--large', action='append',
+                        help=f'Trades in the large account (repeatable; default {", ".join(DEFAULT_LARGE_SIZES)})')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--as-of', help='Last trade date, YYYY-MM-DD (default today)')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed repetitions per scenario')
+    parser.add_argument('--stats-engine', help='PORTFOLIO_STATS_ENGINE for the pages (default: the app default)')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'tradingtracker-bench'),
+                        help='Where generated SQLite databases are kept and reused')
+    parser.add_argument('--output', '-o', help='Write the JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+    as_of = date.fromisoformat(args.as_of) if args.as_of else date.today()
+    small = parse_size(args.small)
+    sizes = sorted({parse_size(size) for size in args.large or DEFAULT_LARGE_SIZES})
+    os.makedirs(args.data_dir, exist_ok=True)
+
+    runs: List[Dict] = []
+    previous = None
+    for large in sizes:
+        database = os.path.abspath(database_path(args.data_dir, small, large, args.seed, as_of))
+        if not os.path.exists(database) and previous:
+            # Grow a copy of the last size rather than generating the large account again
+            _copy_database(previous, database)
+        prepared = prepare(database, small, large, args.seed, as_of, args.stats_engine)
+        results = measure(database, prepared['small_account_id'], args.repeat, args.stats_engine)
+        runs.append({'small_trades': small, 'large_trades': large, 'scenarios': results})
+        previous = database
+        for name, timing in results.items():
+            print(f'{large:>9} {name:<32} median {timing["median"] * 1000:10.2f} ms', file=sys.stderr)
+
+    # The small account's pages should cost the same whatever the size of the large one
+    first, last = runs[0]['scenarios'], runs[-1]['scenarios']
+    growth = {name: last[name]['median'] / first[name]['median']
+              for name in first if name.startswith('small.') and first[name]['median']}
+    print(f'small account, {sizes[0]} -> {sizes[-1]} large trades:', file=sys.stderr)
+    for name, ratio in growth.items():
+        print(f'    {name:<32} x{ratio:.2f}', file=sys.stderr)
+
+    report = json.dumps({
+        'meta': {
+            'small_trades': small,
+            'large_trades': sizes,
+            'seed': args.seed,
+            'as_of': as_of.isoformat(),
+            'repeat': args.repeat,
+            'stats_engine': args.stats_engine,
+            'sqlite': sqlite3.sqlite_version,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+        },
+        'runs': runs,
+        'small_account_growth': growth,
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List
+from benchmarks.run import parse_size
+
+STORES = ['sql', 'memory']
+
+def _create_app(store: str, database: str, count: int):
+    from app import create_app
+    return create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + database, 'TRADE_STORE': store,
+                       'JOB_WORKERS': 0, 'EXPIRY_SWEEP_INTERVAL': 0, 'BULK_MAX_TRADES': count})
+
+def bulk_trades(count: int, seed: int, as_of: date) -> List[Dict]:
+    """count open trades as bulk create JSON, stocks and options over the year before as_of"""
+    rng = random.Random(seed)
+    trades = []
+    for _ in range(count):
+        trade = {'symbol': rng.choice(['AAPL', 'MSFT', 'SPY', 'QQQ', 'TSLA', 'NVDA']),
+                 'trade_type': rng.choice(['stock', 'call', 'put']),
+                 'action': rng.choice(['buy_to_open', 'sell_to_open']),
+                 'quantity': rng.randint(1, 20),
+                 'price': round(rng.uniform(0.5, 500), 2),
+                 'date': (as_of - timedelta(days=rng.randint(0, 365))).isoformat()}
+        if trade['trade_type'] != 'stock':
+            trade['strike_price'] = round(rng.uniform(50, 600), 0)
+            trade['expiration_date'] = (as_of + timedelta(days=rng.randint(1, 120))).isoformat()
+        trades.append(trade)
+    return trades
+
+def measure(store: str, count: int, seed: int, as_of: date, repeat: int) -> Dict[str, Dict]:
+    """Each bulk endpoint over count trades, through the test client; closes are timed with
+    every trade given the same close (one UPDATE per id chunk) and with a price per trade
+    (an executemany)"""
+    from benchmarks import data, scenarios
+
+    database = tempfile.mktemp(prefix='tradingtracker-bulk-', suffix='.db')
+    app = _create_app(store, database, count)
+    logging.getLogger().setLevel(logging.WARNING)
+    client = app.test_client()
+    with app.app_context():
+        data.migrate()
+    trades = bulk_trades(count, seed, as_of)
+    closed_date = as_of.isoformat()
+    ids = []
+
+    def post(url, body, status=200):
+        response = client.post(url, json=body)
+        scenarios._check(response, status)
+        return response
+
+    def create():
+        ids[:] = post('/api/trades/bulk/create', {'trades': trades}, 201).get_json()['ids']
+
+    def reopen():
+        post('/api/trades/bulk/edit', {'ids': ids, 'is_closed': False})
+
+    def close_same():
+        post('/api/trades/bulk/close', {'ids': ids, 'closed_date': closed_date, 'close_price': 1.0})
+
+    def close_each():
+        post('/api/trades/bulk/close', {'closed_date': closed_date,
+                                        'trades': [{'id': trade_id, 'close_price': round(1 + i / 100, 2)}
+                                                   for i, trade_id in enumerate(ids)]})
+
+    def delete():
+        post('/api/trades/bulk/delete', {'ids': ids})
+
+    results = {}
+    try:
+        for scenario in [scenarios.Scenario('create', create, before_each=lambda: ids and delete()),
+                         scenarios.Scenario('close.same', close_same, before_each=reopen),
+                         scenarios.Scenario('close.each', close_each, before_each=reopen),
+                         scenarios.Scenario('delete', delete, before_each=create)]:
+            timing = scenarios.time_scenario(scenario, repeat)
+            results[scenario.name] = dict(timing, rows_per_second=count / timing['median'])
+    finally:
+        with app.app_context():
+            from app import db
+            db.engine.dispose()
+        if os.path.exists(database):
+            os.remove(database)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk trade API throughput: create, close and delete in one request')
+    parser.add_argument('--size', default='10k', help='Trades per request (10k or a number)')
+    parser.add_argument('--store', action='append', choices=STORES,
+                        help=f'Trade store (repeatable; default {", ".join(STORES)})')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--as-of', help='Close date and end of the trade history, YYYY-MM-DD (default today)')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed repetitions per scenario')
+    parser.add_argument('--output', '-o', help='Write the JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+    as_of = date.fromisoformat(args.as_of) if args.as_of else date.today()
+    count = parse_size(args.size)
+
+    runs = {}
+    for store in args.store or STORES:
+        runs[store] = measure(store, count, args.seed, as_of, args.repeat)
+        for name, timing in runs[store].items():
+            print(f'{store:<7} {name:<11} median {timing["median"] * 1000:10.2f} ms '
+                  f'{timing["rows_per_second"]:10.0f} rows/s', file=sys.stderr)
+
+    report = json.dumps({
+        'meta': {
+            'trades': count,
+            'seed': args.seed,
+            'as_of': as_of.isoformat(),
+            'repeat': args.repeat,
+            'sqlite': sqlite3.sqlite_version,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+        },
+        'stores': runs,
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import argparse
+import json
+import sys
+from typing import Dict, List, Tuple
+
+def _runs_by_size(path: str) -> Dict[str, Dict]:
+    with open(path) as f:
+        return {run['meta']['size']: run for run in json.load(f)['runs']}
+
+def compare(baseline: Dict[str, Dict], current: Dict[str, Dict], metric: str = 'median',
+            threshold: float = 0.2) -> List[Tuple[str, str, float, float, float, bool]]:
+    """(size, scenario, baseline, current, ratio, regressed) for scenarios in both runs"""
+    rows = []
+    for size, run in current.items():
+        if size not in baseline:
+            continue
+        before = baseline[size]['scenarios']
+        for name, timing in run['scenarios'].items():
+            if name not in before:
+                continue
+            old, new = before[name][metric], timing[metric]
+            ratio = new / old if old else float('inf')
+            rows.append((size, name, old, new, ratio, ratio > 1 + threshold))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--metric', default='median', choices=['min', 'median', 'mean', 'p95', 'max'])
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Slowdown ratio above which a scenario counts as a regression (0.2 = 20%%)')
+    args = parser.parse_args(argv)
+
+    rows = compare(_runs_by_size(args.baseline), _runs_by_size(args.current), args.metric, args.threshold)
+    for size, name, old, new, ratio, regressed in rows:
+        print(f'{size:>6} {name:<40} {old * 1000:10.2f} ms -> {new * 1000:10.2f} ms  '
+              f'x{ratio:5.2f}{"  REGRESSION" if regressed else ""}')
+
+    regressions = sum(row[-1] for row in rows)
+    if regressions:
+        print(f'{regressions} of {len(rows)} scenarios regressed by more than {args.threshold:.0%}')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
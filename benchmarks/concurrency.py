@@ -0,0 +1,209 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timezone
+from benchmarks.run import parse_size, database_path
+
+MODES = ['tuned', 'default']
+
+# Dashboard, filtered dashboard, portfolio, a JSON endpoint and a long streamed export, read in turn.
+# The export keeps a read open for its whole length, which is what blocks commits without WAL.
+READ_URLS = ['/', '/?trade_type=call', '/portfolio', '/api/timeseries', '/export.csv']
+
+def _import_app(database: str, mode: str):
+    """Create the app for one worker process, as a gunicorn worker would"""
+    os.environ['DATABASE_URL'] = 'sqlite:///' + database
+    os.environ['SQLITE_TUNED'] = '1' if mode == 'tuned' else '0'
+    os.environ['TRADE_STORE'] = 'sql'
+    from app import create_app
+    app = create_app({'WTF_CSRF_ENABLED': False})
+    # Failures are counted, not logged
+    logging.getLogger().setLevel(logging.CRITICAL)
+    return app
+
+def _timed(results, request, *ok_statuses):
+    started = time.perf_counter()
+    try:
+        response = request()
+        response.get_data()
+        response.close()
+        ok = response.status_code in ok_statuses
+    except Exception:
+        ok = False
+    results['latencies' if ok else 'errors'].append(time.perf_counter() - started)
+
+def reader(database: str, mode: str, start, duration: float, queue):
+    client = _import_app(database, mode).test_client()
+    results = {'latencies': [], 'errors': []}
+    start.wait()
+    deadline = time.perf_counter() + duration
+    i = 0
+    while time.perf_counter() < deadline:
+        url = READ_URLS[i % len(READ_URLS)]
+        _timed(results, lambda: client.get(url), 200)
+        i += 1
+    queue.put(('read', results))
+
+def writer(database: str, mode: str, start, duration: float, queue, as_of: date, number: int):
+    app = _import_app(database, mode)
+    from sqlalchemy import func, select
+    from app import db
+    from db_models import Trade
+    client = app.test_client()
+    # Each writer edits and deletes only the trades it added
+    symbol = f'CONC{number}'
+    form = {
+        'symbol': symbol,
+        'trade_type': 'stock',
+        'action': 'buy_to_open',
+        'quantity': '10',
+        'price': '25.50',
+        'date': as_of.isoformat(),
+        'fees': '1.00',
+    }
+    results = {'latencies': [], 'errors': []}
+    start.wait()
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        # A failed add leaves nothing to edit or delete, so the edit and delete are skipped
+        before = len(results['latencies'])
+        _timed(results, lambda: client.post('/add_trade', data=form), 302)
+        if len(results['latencies']) == before:
+            continue
+        with app.app_context():
+            trade_id = db.session.execute(select(func.max(Trade.id)).where(Trade.symbol == symbol)).scalar()
+            db.session.remove()
+        _timed(results, lambda: client.post(f'/edit_trade/{trade_id}', data=dict(form, price='26.00')), 302)
+        _timed(results, lambda: client.post(f'/delete_trade/{trade_id}'), 302)
+    queue.put(('write', results))
+
+def prepare(database: str, count: int, seed: int, as_of: date):
+    """Generate the data set once, with the app's defaults"""
+    app = _import_app(database, 'tuned')
+    from benchmarks import data
+    with app.app_context():
+        data.migrate()
+        if data.trade_count() == 0:
+            data.load_trades(count, seed, as_of)
+
+def _summary(samples, duration: float) -> dict:
+    latencies = sorted(samples['latencies'])
+    summary = {
+        'count': len(latencies),
+        'per_second': len(latencies) / duration,
+        'errors': len(samples['errors']),
+    }
+    if latencies:
+        summary.update(median=statistics.median(latencies),
+                       p95=latencies[min(len(latencies) - 1, int(round(0.95 * (len(latencies) - 1))))],
+                       max=latencies[-1])
+    return summary
+
+def run_mode(source: str, work_dir: str, mode: str, args, as_of: date) -> dict:
+    """Readers and a writer, each in its own process, against a fresh copy of the data set"""
+    database = os.path.join(work_dir, f'concurrency-{mode}.db')
+    for suffix in ['', '-wal', '-shm']:
+        if os.path.exists(database + suffix):
+            os.remove(database + suffix)
+    shutil.copyfile(source, database)
+    # The journal mode is stored in the file, so the untuned copy is put back to SQLite's default
+    if mode == 'default':
+        connection = sqlite3.connect(database)
+        connection.execute('PRAGMA journal_mode = DELETE')
+        connection.close()
+
+    context = multiprocessing.get_context('spawn')
+    start = context.Event()
+    queue = context.Queue()
+    processes = [context.Process(target=reader, args=(database, mode, start, args.duration, queue))
+                 for _ in range(args.readers)]
+    if args.writers:
+        processes += [context.Process(target=writer, args=(database, mode, start, args.duration, queue, as_of, number))
+                      for number in range(args.writers)]
+    for process in processes:
+        process.start()
+    # Give every worker time to import the app before the clock starts
+    time.sleep(args.warmup)
+    start.set()
+
+    samples = {'read': {'latencies': [], 'errors': []}, 'write': {'latencies': [], 'errors': []}}
+    for _ in processes:
+        kind, results = queue.get()
+        for key in ['latencies', 'errors']:
+            samples[kind][key].extend(results[key])
+    for process in processes:
+        process.join()
+
+    return {'reads': _summary(samples['read'], args.duration),
+            'writes': _summary(samples['write'], args.duration)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Read throughput on SQLite while writes are happening')
+    parser.add_argument('--size', default='10k', help='10k, 100k, 1m or a number of trades')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--as-of', help='Last trade date, YYYY-MM-DD (default today)')
+    parser.add_argument('--mode', dest='modes', action='append', choices=MODES,
+                        help='tuned (WAL and pragmas) or default (SQLITE_TUNED=0); repeatable, default both')
+    parser.add_argument('--readers', type=int, default=4, help='Reader processes')
+    parser.add_argument('--writers', type=int, default=1, help='Writer processes (add, edit, delete in a loop)')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run each mode')
+    parser.add_argument('--warmup', type=float, default=10.0, help='Seconds allowed for workers to start')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'tradingtracker-bench'),
+                        help='Where generated SQLite databases are kept and reused')
+    parser.add_argument('--output', '-o', help='Write the JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+    modes = args.modes or MODES
+    as_of = date.fromisoformat(args.as_of) if args.as_of else date.today()
+    count = parse_size(args.size)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    source = os.path.abspath(database_path(args.data_dir, count, args.seed, as_of))
+    context = multiprocessing.get_context('spawn')
+    setup = context.Process(target=prepare, args=(source, count, args.seed, as_of))
+    setup.start()
+    setup.join()
+    if setup.exitcode:
+        raise SystemExit(f'Preparing {source} failed')
+
+    results = {}
+    for mode in modes:
+        results[mode] = run_mode(source, args.data_dir, mode, args, as_of)
+        reads, writes = results[mode]['reads'], results[mode]['writes']
+        print(f'{mode:>8} reads {reads["per_second"]:8.1f}/s p95 {reads.get("p95", 0) * 1000:8.1f} ms '
+              f'errors {reads["errors"]:4}   writes {writes["per_second"]:6.1f}/s '
+              f'p95 {writes.get("p95", 0) * 1000:8.1f} ms errors {writes["errors"]:4}', file=sys.stderr)
+
+    report = json.dumps({
+        'meta': {
+            'size': args.size,
+            'trades': count,
+            'seed': args.seed,
+            'as_of': as_of.isoformat(),
+            'readers': args.readers,
+            'writers': args.writers,
+            'duration': args.duration,
+            'sqlite': sqlite3.sqlite_version,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+        },
+        'modes': results,
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+if __name__ == '__main__':
+    main()
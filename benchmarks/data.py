@@ -0,0 +1,56 @@
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import insert, func, select
+from app import db
+from db_models import Trade, DEFAULT_ACCOUNT_ID
+from benchmarks.generator import generate_trades
+import aggregates
+import cache
+import journal
+import schema
+
+def migrate():
+    """Bring the schema up to date, filling aggregate tables and columns (and the journal's
+    baseline) added to a database that has trades"""
+    with db.engine.begin() as connection:
+        changes = schema.migrate(connection, db.metadata)
+    if aggregates.needs_rebuild(changes) and trade_count():
+        aggregates.rebuild_aggregates()
+    if journal.needs_baseline(changes):
+        journal.take_baselines()
+
+def _insert_batch(batch: List[Dict], account_id: int):
+    """Insert generated trades the way the CSV importer does, aggregates and journal included"""
+    ids = db.session.connection().execute(
+        insert(Trade.__table__).returning(Trade.__table__.c.id, sort_by_parameter_order=True), batch).scalars().all()
+    aggregates.apply_trades(Trade(**values) for values in batch)
+    journal.record(account_id, journal.CREATED, zip(ids, batch))
+    cache.bump_data_version(account_id)
+    db.session.commit()
+
+def insert_trades(trades: Iterable[Dict], account_id: int = DEFAULT_ACCOUNT_ID, batch_size: int = 5000) -> int:
+    """Insert generated trade values into an account; returns the number inserted"""
+    batch = []
+    count = 0
+    for values in trades:
+        batch.append(dict(values, account_id=account_id))
+        if len(batch) >= batch_size:
+            _insert_batch(batch, account_id)
+            count += len(batch)
+            batch = []
+    if batch:
+        _insert_batch(batch, account_id)
+        count += len(batch)
+    return count
+
+def load_trades(count: int, seed: int, as_of: date, account_id: int = DEFAULT_ACCOUNT_ID,
+                batch_size: int = 5000) -> int:
+    """Fill an empty account with generated trades; returns the number inserted"""
+    return insert_trades(generate_trades(count, seed, as_of), account_id, batch_size)
+
+def trade_count(account_id: Optional[int] = None) -> int:
+    """Trades in one account, or in all of them"""
+    stmt = select(func.count(Trade.id))
+    if account_id is not None:
+        stmt = stmt.where(Trade.account_id == account_id)
+    return db.session.execute(stmt).scalar()
@@ -0,0 +1,89 @@
+import random
+from itertools import accumulate
+from datetime import date, timedelta
+from typing import Dict, Iterator, List, Optional
+from db_models import TradeType, TradeAction
+from utils import signed_quantity
+
+# Share of each trade type and, per type, of each action
+TRADE_TYPE_WEIGHTS = {TradeType.STOCK: 0.6, TradeType.CALL: 0.25, TradeType.PUT: 0.15}
+ACTION_WEIGHTS = {
+    TradeType.STOCK: {TradeAction.BUY_TO_OPEN: 0.5, TradeAction.SELL_TO_CLOSE: 0.35,
+                      TradeAction.SELL_TO_OPEN: 0.1, TradeAction.BUY_TO_CLOSE: 0.05},
+    TradeType.CALL: {TradeAction.BUY_TO_OPEN: 0.35, TradeAction.SELL_TO_OPEN: 0.3,
+                     TradeAction.SELL_TO_CLOSE: 0.2, TradeAction.BUY_TO_CLOSE: 0.15},
+    TradeType.PUT: {TradeAction.BUY_TO_OPEN: 0.3, TradeAction.SELL_TO_OPEN: 0.35,
+                    TradeAction.SELL_TO_CLOSE: 0.15, TradeAction.BUY_TO_CLOSE: 0.2},
+}
+CLOSED_SHARE = 0.4
+HISTORY_DAYS = 5 * 365
+SYMBOL_COUNT = 500
+
+def _symbols(rng: random.Random) -> List[str]:
+    symbols = set()
+    while len(symbols) < SYMBOL_COUNT:
+        symbols.add(''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(rng.randint(1, 4))))
+    return sorted(symbols)
+
+def generate_trades(count: int, seed: int = 0, as_of: Optional[date] = None) -> Iterator[Dict]:
+    """Trade column values for count synthetic trades, the same for the same seed and as_of.
+
+    Trades fall in the five years up to as_of (default today), with a few
+    heavily traded symbols and a long tail. Options expire up to 90 days after
+    the trade, so older ones are expired and recent ones are still active.
+    """
+    rng = random.Random(seed)
+    as_of = as_of or date.today()
+    first_day = as_of - timedelta(days=HISTORY_DAYS)
+
+    symbols = _symbols(rng)
+    # Zipf-like popularity: symbol n is traded about 1/n as often as the first
+    symbol_weights = list(accumulate(1 / (n + 1) for n in range(len(symbols))))
+    trade_types = list(TRADE_TYPE_WEIGHTS)
+    type_weights = list(accumulate(TRADE_TYPE_WEIGHTS.values()))
+    action_weights = {trade_type: (list(actions), list(accumulate(actions.values())))
+                      for trade_type, actions in ACTION_WEIGHTS.items()}
+
+    for _ in range(count):
+        trade_type = rng.choices(trade_types, cum_weights=type_weights)[0]
+        actions, weights = action_weights[trade_type]
+        action = rng.choices(actions, cum_weights=weights)[0]
+        is_option = trade_type != TradeType.STOCK
+        trade_date = first_day + timedelta(days=rng.randrange(HISTORY_DAYS + 1))
+
+        if is_option:
+            quantity = rng.randint(1, 20)
+            price = round(rng.lognormvariate(0.5, 1.0), 2) or 0.01
+        else:
+            quantity = rng.choice([1, 5, 10, 25, 50, 100, 200, 500])
+            price = round(rng.lognormvariate(4.0, 0.8), 2) or 0.01
+
+        values = {
+            'symbol': rng.choices(symbols, cum_weights=symbol_weights)[0],
+            'trade_type': trade_type,
+            'action': action,
+            'quantity': signed_quantity(trade_type.value, action.value, quantity),
+            'price': price,
+            'date': trade_date,
+            'fees': round(0.65 * quantity, 2) if is_option else rng.choice([0.0, 0.0, 1.0]),
+            'is_closed': False,
+            'closed_date': None,
+            'close_price': None,
+            'close_quantity': None,
+            'notes': '',
+            'strike_price': None,
+            'expiration_date': None,
+            'premium': None,
+        }
+        if is_option:
+            values['strike_price'] = round(price * rng.uniform(20, 60), 0)
+            values['expiration_date'] = trade_date + timedelta(days=rng.randint(0, 90))
+            values['premium'] = price
+
+        if rng.random() < CLOSED_SHARE:
+            closed_date = min(as_of, trade_date + timedelta(days=rng.randint(0, 60)))
+            values.update(is_closed=True,
+                          closed_date=closed_date,
+                          close_price=round(price * rng.uniform(0.5, 1.6), 2),
+                          close_quantity=rng.randint(1, quantity))
+        yield values
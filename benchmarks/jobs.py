@@ -0,0 +1,178 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timezone
+from benchmarks.run import parse_size, database_path
+from benchmarks.concurrency import READ_URLS, prepare, _summary, _timed
+
+# none: no jobs; thread: jobs run on a thread inside one of the web worker processes;
+# process: jobs run in a separate `flask run-jobs` process at a lower priority
+MODES = ['none', 'thread', 'process']
+
+def _import_app(database: str):
+    """Create the app for one worker process; jobs only queue, each mode runs them itself"""
+    os.environ['DATABASE_URL'] = 'sqlite:///' + database
+    os.environ['TRADE_STORE'] = 'sql'
+    os.environ['JOB_WORKERS'] = '0'
+    from app import create_app
+    app = create_app({'WTF_CSRF_ENABLED': False})
+    logging.getLogger().setLevel(logging.CRITICAL)
+    return app
+
+def reader(database: str, start, duration: float, queue, run_jobs: bool):
+    app = _import_app(database)
+    client = app.test_client()
+    if run_jobs:
+        # As a JOB_WORKERS thread would: the jobs share this process with its page views
+        import jobs
+        threading.Thread(target=jobs.work, args=(app, 0.05), daemon=True).start()
+    results = {'latencies': [], 'errors': []}
+    start.wait()
+    deadline = time.perf_counter() + duration
+    i = 0
+    while time.perf_counter() < deadline:
+        url = READ_URLS[i % len(READ_URLS)]
+        _timed(results, lambda: client.get(url), 200)
+        i += 1
+    queue.put(results)
+
+def job_runner(database: str, start, nice: int):
+    """`flask run-jobs --nice` in its own process"""
+    app = _import_app(database)
+    import jobs
+    if nice:
+        os.nice(nice)
+    start.wait()
+    jobs.work(app, 0.05)
+
+def queue_jobs(database: str, count: int, engine: str):
+    """Queue more full portfolio recomputes than can finish, so a job is always running"""
+    app = _import_app(database)
+    from app import db
+    from db_models import Job, DEFAULT_ACCOUNT_ID
+    with app.app_context():
+        db.session.add_all([Job(account_id=DEFAULT_ACCOUNT_ID, kind='portfolio_stats', params={'engine': engine})
+                            for _ in range(count)])
+        db.session.commit()
+
+def finished_jobs(database: str) -> int:
+    connection = sqlite3.connect(database)
+    try:
+        return connection.execute("SELECT count(*) FROM jobs WHERE status = 'SUCCEEDED'").fetchone()[0]
+    finally:
+        connection.close()
+
+def run_mode(source: str, work_dir: str, mode: str, args) -> dict:
+    """Readers, plus jobs run the mode's way, against a fresh copy of the data set"""
+    database = os.path.join(work_dir, f'jobs-{mode}.db')
+    for suffix in ['', '-wal', '-shm']:
+        if os.path.exists(database + suffix):
+            os.remove(database + suffix)
+    shutil.copyfile(source, database)
+
+    context = multiprocessing.get_context('spawn')
+    if mode != 'none':
+        setup = context.Process(target=queue_jobs, args=(database, args.jobs, args.engine))
+        setup.start()
+        setup.join()
+    start = context.Event()
+    queue = context.Queue()
+    readers = [context.Process(target=reader,
+                               args=(database, start, args.duration, queue, mode == 'thread' and number == 0))
+               for number in range(args.readers)]
+    runner = None
+    if mode == 'process':
+        runner = context.Process(target=job_runner, args=(database, start, args.nice), daemon=True)
+        runner.start()
+    for process in readers:
+        process.start()
+    # Give every worker time to import the app before the clock starts
+    time.sleep(args.warmup)
+    start.set()
+
+    samples = {'latencies': [], 'errors': []}
+    for _ in readers:
+        results = queue.get()
+        for key in ['latencies', 'errors']:
+            samples[key].extend(results[key])
+    for process in readers:
+        process.join()
+    if runner:
+        runner.terminate()
+        runner.join()
+    return {'reads': _summary(samples, args.duration), 'jobs_finished': finished_jobs(database)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Page throughput while background jobs run')
+    parser.add_argument('--size', default='10k', help='10k, 100k, 1m or a number of trades')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--as-of', help='Last trade date, YYYY-MM-DD (default today)')
+    parser.add_argument('--mode', dest='modes', action='append', choices=MODES,
+                        help='none, thread or process; repeatable, default all three')
+    parser.add_argument('--readers', type=int, default=2, help='Web worker processes reading pages')
+    parser.add_argument('--jobs', type=int, default=200, help='Jobs queued before each run')
+    parser.add_argument('--engine', default='python', help='Stats engine the queued portfolio_stats jobs use')
+    parser.add_argument('--nice', type=int, default=10, help='Priority increment of the job process')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run each mode')
+    parser.add_argument('--warmup', type=float, default=10.0, help='Seconds allowed for workers to start')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'tradingtracker-bench'),
+                        help='Where generated SQLite databases are kept and reused')
+    parser.add_argument('--output', '-o', help='Write the JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+    modes = args.modes or MODES
+    as_of = date.fromisoformat(args.as_of) if args.as_of else date.today()
+    count = parse_size(args.size)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    source = os.path.abspath(database_path(args.data_dir, count, args.seed, as_of))
+    context = multiprocessing.get_context('spawn')
+    setup = context.Process(target=prepare, args=(source, count, args.seed, as_of))
+    setup.start()
+    setup.join()
+    if setup.exitcode:
+        raise SystemExit(f'Preparing {source} failed')
+
+    results = {}
+    for mode in modes:
+        results[mode] = run_mode(source, args.data_dir, mode, args)
+        reads = results[mode]['reads']
+        print(f'{mode:>8} reads {reads["per_second"]:8.1f}/s median {reads.get("median", 0) * 1000:8.1f} ms '
+              f'p95 {reads.get("p95", 0) * 1000:8.1f} ms errors {reads["errors"]:4}   '
+              f'jobs finished {results[mode]["jobs_finished"]:4}', file=sys.stderr)
+
+    report = json.dumps({
+        'meta': {
+            'size': args.size,
+            'trades': count,
+            'seed': args.seed,
+            'as_of': as_of.isoformat(),
+            'readers': args.readers,
+            'jobs': args.jobs,
+            'engine': args.engine,
+            'nice': args.nice,
+            'duration': args.duration,
+            'sqlite': sqlite3.sqlite_version,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+        },
+        'modes': results,
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+if __name__ == '__main__':
+    main()
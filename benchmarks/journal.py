@@ -0,0 +1,138 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+from datetime import date, datetime, timezone
+from typing import Dict
+from benchmarks.run import parse_size
+
+DEFAULT_EVENTS = ['10k', '100k']
+
+def database_path(data_dir: str, trades: int, events: int, interval: int, seed: int, as_of: date) -> str:
+    """SQLite file for one history; interval 0 means no snapshots"""
+    return os.path.join(data_dir, f'journal-{trades}-{events}-every{interval}-seed{seed}-{as_of.isoformat()}.db')
+
+def _create_app(database: str):
+    from app import create_app
+    return create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + database, 'TRADE_STORE': 'sql', 'JOB_WORKERS': 0})
+
+def prepare(database: str, trades: int, events: int, interval: int, seed: int, as_of: date):
+    """A fixed set of trades edited until the journal holds events events, with a snapshot
+    every interval events, so the history grows while the portfolio does not"""
+    from sqlalchemy import bindparam, update
+    from app import db
+    from db_models import Trade, DEFAULT_ACCOUNT_ID
+    from benchmarks import data
+    import journal
+
+    app = _create_app(database)
+    logging.getLogger().setLevel(logging.WARNING)
+    with app.app_context():
+        data.migrate()
+        if data.trade_count(DEFAULT_ACCOUNT_ID):
+            return
+        data.load_trades(trades, seed, as_of)
+        ids = db.session.execute(db.select(Trade.id)).scalars().all()
+        rng = random.Random(seed)
+        stmt = (update(Trade.__table__)
+                .where(Trade.__table__.c.id == bindparam('trade_id'))
+                .values(price=bindparam('new_price')))
+        written = trades
+        batch_size = interval or 1000
+        while written < events:
+            count = min(batch_size, events - written)
+            edits = [(trade_id, {'price': round(rng.uniform(1, 500), 2)}) for trade_id in rng.choices(ids, k=count)]
+            db.session.execute(stmt, [{'trade_id': trade_id, 'new_price': values['price']} for trade_id, values in edits])
+            journal.record(DEFAULT_ACCOUNT_ID, journal.UPDATED, edits)
+            db.session.commit()
+            written += count
+            if interval:
+                journal.take_snapshot(DEFAULT_ACCOUNT_ID)
+        db.session.remove()
+        db.engine.dispose()
+
+def measure(database: str, repeat: int) -> Dict[str, Dict]:
+    """Rebuild the portfolio as it is now and as it was halfway through the history"""
+    from sqlalchemy import func, select
+    from app import db
+    from db_models import TradeEvent, DEFAULT_ACCOUNT_ID
+    from benchmarks import scenarios
+    import journal
+
+    app = _create_app(database)
+    logging.getLogger().setLevel(logging.WARNING)
+    results = {}
+    with app.app_context():
+        count = db.session.execute(select(func.count(TradeEvent.id))).scalar()
+        middle = db.session.execute(select(TradeEvent.created_at).order_by(TradeEvent.id)
+                                    .offset(count // 2).limit(1)).scalar()
+        for name, at in [('latest', datetime.utcnow()), ('middle', middle)]:
+            replayed = []
+
+            def run(at=at, replayed=replayed):
+                replayed.append(journal.portfolio_at(DEFAULT_ACCOUNT_ID, at).events_replayed)
+                db.session.rollback()
+            results[name] = dict(scenarios.time_scenario(scenarios.Scenario(name, run), repeat),
+                                 events_replayed=replayed[-1])
+        db.engine.dispose()
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Point-in-time portfolio rebuilds as the trade journal grows')
+    parser.add_argument('--trades', default='1000', help='Trades in the portfolio')
+    parser.add_argument('--events', action='append',
+                        help=f'Journal events in the history (repeatable; default {", ".join(DEFAULT_EVENTS)})')
+    parser.add_argument('--interval', type=int, default=1000, help='Events between snapshots')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--as-of', help='Last trade date, YYYY-MM-DD (default today)')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed repetitions per scenario')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'tradingtracker-bench'),
+                        help='Where generated SQLite databases are kept and reused')
+    parser.add_argument('--output', '-o', help='Write the JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+    as_of = date.fromisoformat(args.as_of) if args.as_of else date.today()
+    trades = parse_size(args.trades)
+    sizes = sorted({parse_size(size) for size in args.events or DEFAULT_EVENTS})
+    os.makedirs(args.data_dir, exist_ok=True)
+
+    runs = []
+    for events in sizes:
+        run = {'events': events, 'modes': {}}
+        # Replaying the whole journal, against starting from the latest snapshot
+        for mode, interval in [('replay', 0), ('snapshots', args.interval)]:
+            database = os.path.abspath(database_path(args.data_dir, trades, events, interval, args.seed, as_of))
+            prepare(database, trades, events, interval, args.seed, as_of)
+            run['modes'][mode] = measure(database, args.repeat)
+            for name, timing in run['modes'][mode].items():
+                print(f'{events:>9} {mode:<10} {name:<7} median {timing["median"] * 1000:10.2f} ms '
+                      f'replayed {timing["events_replayed"]:>8}', file=sys.stderr)
+        runs.append(run)
+
+    report = json.dumps({
+        'meta': {
+            'trades': trades,
+            'events': sizes,
+            'interval': args.interval,
+            'seed': args.seed,
+            'as_of': as_of.isoformat(),
+            'repeat': args.repeat,
+            'sqlite': sqlite3.sqlite_version,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+        },
+        'runs': runs,
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import json
+import logging
+import platform
+import sys
+from datetime import date, datetime, timezone
+from typing import Dict
+from benchmarks.run import parse_size
+
+# uncached: ROW_CACHE_SIZE=0; cold: the row cache is emptied before every view; cached: every row is in it
+VARIANTS = ['uncached', 'cold', 'cached']
+
+def _create_app(rows: int, count: int):
+    from app import create_app
+    return create_app({'TRADE_STORE': 'memory', 'WTF_CSRF_ENABLED': False,
+                       'ROW_CACHE_SIZE': rows, 'TRADES_MAX_PAGE_SIZE': count})
+
+def measure(count: int, seed: int, as_of: date, repeat: int) -> Dict[str, Dict]:
+    """Dashboard views of one count-row page, and the template render alone, for each variant.
+
+    The memory store keeps the database out of the timings; the page's stats are
+    computed once, before the clock starts.
+    """
+    from flask import render_template
+    from forms import FilterForm
+    from benchmarks import scenarios
+    from benchmarks.generator import generate_trades
+    from db_models import DEFAULT_ACCOUNT_ID
+    import cache
+    import trade_store
+
+    results = {}
+    for variant in VARIANTS:
+        app = _create_app(0 if variant == 'uncached' else count, count)
+        logging.getLogger().setLevel(logging.WARNING)
+        client = app.test_client()
+        url = f'/?per_page={count}'
+        with app.app_context():
+            store = trade_store.get_trade_store()
+            for values in generate_trades(count, seed, as_of):
+                store.add(DEFAULT_ACCOUNT_ID, values)
+        # Fills the stats cache, and the row cache for the cached variant
+        scenarios._check(client.get(url), 200)
+
+        def clear_rows(app=app):
+            with app.app_context():
+                cache.get_row_cache().clear()
+        before_each = clear_rows if variant == 'cold' else None
+
+        def view(client=client, url=url):
+            scenarios._check(client.get(url), 200)
+
+        def render(app=app, url=url):
+            with app.test_request_context(url):
+                store = trade_store.get_trade_store()
+                filter_form = FilterForm()
+                trades = list(store.page(DEFAULT_ACCOUNT_ID, filter_form, count))
+                stats = cache.cached('portfolio_stats', lambda: store.portfolio_stats(DEFAULT_ACCOUNT_ID),
+                                     app.config['PORTFOLIO_STATS_ENGINE'])
+                render_template('index.html', trades=trades, filter_form=filter_form,
+                                portfolio_stats=stats, page_args={})
+
+        for name, run in [('page', view), ('render', render)]:
+            scenario = scenarios.Scenario(f'{name}.{variant}', run, before_each=before_each)
+            results[scenario.name] = scenarios.time_scenario(scenario, repeat)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Dashboard render time of a large trade page, with and without the row cache')
+    parser.add_argument('--size', default='10k', help='Trades on the page (10k or a number)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--as-of', help='Last trade date, YYYY-MM-DD (default today)')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed repetitions per scenario')
+    parser.add_argument('--output', '-o', help='Write the JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+    as_of = date.fromisoformat(args.as_of) if args.as_of else date.today()
+    count = parse_size(args.size)
+
+    results = measure(count, args.seed, as_of, args.repeat)
+    for name, timing in results.items():
+        print(f'{name:<18} median {timing["median"] * 1000:10.2f} ms', file=sys.stderr)
+    speedup = {name: results[f'{name}.uncached']['median'] / results[f'{name}.cached']['median']
+               for name in ['page', 'render']}
+    for name, ratio in speedup.items():
+        print(f'{name:<18} cached x{ratio:.2f} faster', file=sys.stderr)
+
+    report = json.dumps({
+        'meta': {
+            'trades': count,
+            'seed': args.seed,
+            'as_of': as_of.isoformat(),
+            'repeat': args.repeat,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+        },
+        'scenarios': results,
+        'speedup': speedup,
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+if __name__ == '__main__':
+    main()
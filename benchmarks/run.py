@@ -0,0 +1,138 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timezone
+
+SCENARIO_GROUPS = ['stats', 'routes', 'writes']
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+def parse_size(size: str) -> int:
+    """'10k', '100k', '1m' or a plain number of trades"""
+    return SIZES[size.lower()] if size.lower() in SIZES else int(size)
+
+def database_path(data_dir: str, count: int, seed: int, as_of: date) -> str:
+    """SQLite file for one data set, so later runs with the same parameters reuse it"""
+    return os.path.join(data_dir, f'trades-{count}-seed{seed}-{as_of.isoformat()}.db')
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip() or None
+    except OSError:
+        return None
+
+def run_size(args) -> dict:
+    """Benchmark one data set size in this process"""
+    count = parse_size(args.size)
+    as_of = date.fromisoformat(args.as_of) if args.as_of else date.today()
+    os.makedirs(args.data_dir, exist_ok=True)
+    os.environ['TRADE_STORE'] = 'sql'
+    # create_app reads its configuration from the environment, so it is set first
+    if not args.database_url:
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(database_path(args.data_dir, count, args.seed, as_of))
+    else:
+        os.environ['DATABASE_URL'] = args.database_url
+
+    from app import create_app, db
+    from benchmarks import data, scenarios
+    from db_models import DEFAULT_ACCOUNT_ID
+    app = create_app({'WTF_CSRF_ENABLED': False})
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with app.app_context():
+        data.migrate()
+        existing = data.trade_count()
+        started = time.perf_counter()
+        if existing == 0:
+            data.load_trades(count, args.seed, as_of)
+        elif existing != count:
+            raise SystemExit(f'{os.environ["DATABASE_URL"]} already has {existing} trades, expected {count}')
+        setup_seconds = time.perf_counter() - started
+        dialect = db.engine.dialect.name
+        # Timings are only comparable while the dashboard filters go through their indexes
+        import queries
+        missed = [check.query_string for check in queries.check_dashboard_plans(DEFAULT_ACCOUNT_ID) if not check.ok]
+        if missed:
+            raise SystemExit(f'Dashboard queries miss their index (see flask check-query-plans): '
+                             f'{", ".join("/?" + query_string for query_string in missed)}')
+
+    client = app.test_client()
+    groups = {
+        'stats': lambda: scenarios.stats_scenarios(app),
+        'routes': lambda: scenarios.route_scenarios(client, as_of),
+        'writes': lambda: scenarios.write_scenarios(client, as_of),
+    }
+    results = {}
+    for group in args.groups:
+        for scenario in groups[group]():
+            results[scenario.name] = scenarios.time_scenario(scenario, args.repeat)
+            print(f'{args.size:>6} {scenario.name:<40} median {results[scenario.name]["median"] * 1000:10.2f} ms',
+                  file=sys.stderr)
+
+    return {
+        'meta': {
+            'size': args.size,
+            'trades': count,
+            'seed': args.seed,
+            'as_of': as_of.isoformat(),
+            'repeat': args.repeat,
+            'database': dialect,
+            'setup_seconds': setup_seconds,
+            'data_reused': existing != 0,
+            'stats_engine': app.config['PORTFOLIO_STATS_ENGINE'],
+            'metrics_enabled': app.config['METRICS_ENABLED'],
+            'query_plans': 'ok',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'commit': _git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+        },
+        'scenarios': results,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark stats and routes on synthetic trades')
+    parser.add_argument('--size', action='append', help='10k, 100k, 1m or a number of trades (repeatable)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--as-of', help='Last trade date, YYYY-MM-DD (default today)')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed repetitions per scenario')
+    parser.add_argument('--group', dest='groups', action='append', choices=SCENARIO_GROUPS,
+                        help='Scenario group to run (repeatable; default all)')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'tradingtracker-bench'),
+                        help='Where generated SQLite databases are kept and reused')
+    parser.add_argument('--database-url', help='Use this database instead of a generated SQLite file')
+    parser.add_argument('--output', '-o', help='Write the JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+    args.sizes = args.size or ['10k']
+    args.groups = args.groups or SCENARIO_GROUPS
+    args.as_of = args.as_of or date.today().isoformat()
+
+    if len(args.sizes) == 1:
+        args.size = args.sizes[0]
+        runs = [run_size(args)]
+    else:
+        # One process per size: each reads its DATABASE_URL from the environment
+        runs = []
+        for size in args.sizes:
+            command = [sys.executable, '-m', 'benchmarks.run', '--size', size, '--seed', str(args.seed),
+                       '--as-of', args.as_of, '--repeat', str(args.repeat), '--data-dir', args.data_dir]
+            for group in args.groups:
+                command += ['--group', group]
+            output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+            runs.extend(json.loads(output)['runs'])
+
+    report = json.dumps({'runs': runs}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import statistics
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional
+from sqlalchemy import func, select
+from app import db
+from db_models import Trade, DEFAULT_ACCOUNT_ID
+from utils import calculate_portfolio_stats
+import cache
+import stats_engines
+
+@dataclass
+class Scenario:
+    name: str
+    run: Callable[[], None]
+    # Called before every repetition, outside the timing
+    before_each: Optional[Callable[[], None]] = None
+
+def _check(response, *statuses):
+    if response.status_code not in statuses:
+        raise RuntimeError(f'{response.request.path} returned {response.status_code}')
+    # Read the whole body, so streamed pages are timed to the last byte, then finish the request
+    response.get_data()
+    response.close()
+
+def time_scenario(scenario: Scenario, repeat: int) -> Dict:
+    """Run a scenario repeat times; timings in seconds"""
+    timings = []
+    for _ in range(repeat):
+        if scenario.before_each:
+            scenario.before_each()
+        started = time.perf_counter()
+        scenario.run()
+        timings.append(time.perf_counter() - started)
+
+    timings.sort()
+    return {
+        'repeat': repeat,
+        'min': timings[0],
+        'median': statistics.median(timings),
+        'mean': statistics.fmean(timings),
+        'p95': timings[min(len(timings) - 1, int(round(0.95 * (len(timings) - 1))))],
+        'max': timings[-1],
+    }
+
+def _clear_cache(app):
+    with app.app_context():
+        cache.get_cache().clear()
+
+def stats_scenarios(app) -> List[Scenario]:
+    """Portfolio statistics: the per-trade loop and each stats engine"""
+    with app.app_context():
+        # Loaded once; only the computation is timed
+        trades = Trade.query.order_by(Trade.id).all()
+        db.session.expunge_all()
+
+    def engine(name):
+        def run():
+            with app.app_context():
+                stats_engines.load_portfolio_stats(DEFAULT_ACCOUNT_ID, name)
+        return run
+
+    return [Scenario('stats.calculate_portfolio_stats', lambda: calculate_portfolio_stats(trades))] + \
+        [Scenario(f'stats.engine.{name}', engine(name)) for name in stats_engines.STATS_ENGINES
+         if name != 'python']
+
+def route_scenarios(client, as_of: date) -> List[Scenario]:
+    """Page views through the test client; 'cold' clears the stats cache first"""
+    app = client.application
+    with app.app_context():
+        top_symbol = db.session.execute(select(Trade.symbol)
+                                        .group_by(Trade.symbol)
+                                        .order_by(func.count().desc())
+                                        .limit(1)).scalar()
+
+    year_start = (as_of - timedelta(days=365)).isoformat()
+    pages = {
+        'index': '/',
+        'index.symbol': f'/?symbol={top_symbol}&symbol_match=exact',
+        'index.symbol_prefix': f'/?symbol={(top_symbol or "A")[:1]}&symbol_match=prefix',
+        'index.type_date': f'/?trade_type=call&date_from={year_start}&date_to={as_of.isoformat()}',
+        'index.stream': '/?stream=1',
+        'portfolio': '/portfolio',
+    }
+
+    scenarios = []
+    for name, url in pages.items():
+        def run(url=url):
+            _check(client.get(url), 200)
+        scenarios.append(Scenario(f'routes.{name}.cold', run, before_each=lambda: _clear_cache(app)))
+        scenarios.append(Scenario(f'routes.{name}.cached', run))
+    return scenarios
+
+def write_scenarios(client, as_of: date) -> List[Scenario]:
+    """Add, then edit, then delete the same trades, leaving the data as it was"""
+    app = client.application
+    added = []
+    form = {
+        'symbol': 'BENCH',
+        'trade_type': 'call',
+        'action': 'buy_to_open',
+        'quantity': '2',
+        'price': '1.25',
+        'date': as_of.isoformat(),
+        'strike_price': '100',
+        'expiration_date': (as_of + timedelta(days=30)).isoformat(),
+        'fees': '1.30',
+    }
+
+    def add():
+        _check(client.post('/add_trade', data=form), 302)
+        with app.app_context():
+            added.append(db.session.execute(select(func.max(Trade.id))).scalar())
+
+    def edit():
+        trade_id = added[len(added) - 1 - edit.done % len(added)]
+        edit.done += 1
+        _check(client.post(f'/edit_trade/{trade_id}', data=dict(form, price='1.50')), 302)
+    edit.done = 0
+
+    def delete():
+        _check(client.post(f'/delete_trade/{added.pop()}'), 302)
+
+    return [Scenario('routes.add_trade', add),
+            Scenario('routes.edit_trade', edit),
+            Scenario('routes.delete_trade', delete)]
@@ -0,0 +1,126 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timezone
+from benchmarks.run import parse_size, database_path
+from benchmarks.concurrency import prepare
+
+PHASES = ['import', 'create_app', 'first_response', 'cold_start', 'process']
+
+def child(url: str):
+    """Time one cold start in this process and print it as JSON"""
+    started = time.perf_counter()
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from sqlalchemy.pool import Pool
+    counts = {'statements': 0, 'connections': 0}
+
+    def counter(name):
+        def listener(*args):
+            counts[name] += 1
+        return listener
+    event.listen(Engine, 'before_cursor_execute', counter('statements'))
+    event.listen(Pool, 'connect', counter('connections'))
+
+    from app import create_app
+    imported = time.perf_counter()
+    app = create_app()
+    created = time.perf_counter()
+    boot = dict(counts)
+
+    response = app.test_client().get(url)
+    response.get_data()
+    response.close()
+    responded = time.perf_counter()
+    if response.status_code != 200:
+        raise SystemExit(f'{url} returned {response.status_code}')
+
+    print(json.dumps({
+        'import': imported - started,
+        'create_app': created - imported,
+        'first_response': responded - created,
+        'cold_start': responded - started,
+        'boot_statements': boot['statements'],
+        'boot_connections': boot['connections'],
+        'first_response_statements': counts['statements'] - boot['statements'],
+    }))
+
+def run_once(database: str, url: str) -> dict:
+    """One fresh interpreter; 'process' includes the interpreter's own startup"""
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + database, TRADE_STORE='sql', LOG_LEVEL='WARNING')
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.startup', '--child', '--url', url],
+                            check=True, stdout=subprocess.PIPE, text=True, env=env).stdout
+    process_seconds = time.perf_counter() - started
+    result = json.loads(output)
+    result['process'] = process_seconds
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Cold-start time of a worker: import, create_app and first response')
+    parser.add_argument('--size', default='10k', help='10k, 100k, 1m or a number of trades')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--as-of', help='Last trade date, YYYY-MM-DD (default today)')
+    parser.add_argument('--url', default='/', help='Page requested first')
+    parser.add_argument('--repeat', type=int, default=5, help='Fresh processes to start')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'tradingtracker-bench'),
+                        help='Where generated SQLite databases are kept and reused')
+    parser.add_argument('--output', '-o', help='Write the JSON results here instead of stdout')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        child(args.url)
+        return
+
+    as_of = date.fromisoformat(args.as_of) if args.as_of else date.today()
+    count = parse_size(args.size)
+    os.makedirs(args.data_dir, exist_ok=True)
+    database = os.path.abspath(database_path(args.data_dir, count, args.seed, as_of))
+    context = multiprocessing.get_context('spawn')
+    setup = context.Process(target=prepare, args=(database, count, args.seed, as_of))
+    setup.start()
+    setup.join()
+    if setup.exitcode:
+        raise SystemExit(f'Preparing {database} failed')
+
+    runs = [run_once(database, args.url) for _ in range(args.repeat)]
+    summary = {phase: statistics.median(run[phase] for run in runs) for phase in PHASES}
+    # Any SQL before the first request means boot is touching the database again
+    summary['boot_statements'] = max(run['boot_statements'] for run in runs)
+    summary['boot_connections'] = max(run['boot_connections'] for run in runs)
+    summary['first_response_statements'] = max(run['first_response_statements'] for run in runs)
+    for phase in PHASES:
+        print(f'{phase:>16} median {summary[phase] * 1000:8.1f} ms', file=sys.stderr)
+    print(f'{"boot SQL":>16} {summary["boot_statements"]} statements, '
+          f'{summary["boot_connections"]} connections', file=sys.stderr)
+
+    report = json.dumps({
+        'meta': {
+            'size': args.size,
+            'trades': count,
+            'seed': args.seed,
+            'as_of': as_of.isoformat(),
+            'url': args.url,
+            'repeat': args.repeat,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+        },
+        'median': summary,
+        'runs': runs,
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+from typing import Dict, List, Tuple
+from db_models import Trade
+from forms import TradeApiForm
+from importer import REQUIRED_COLUMNS, OPTIONAL_COLUMNS, normalize_row, form_errors
+from utils import trade_values_from_form
+import journal
+
+# The fields of a trade in a bulk request, as in a broker statement row
+TRADE_FIELDS = REQUIRED_COLUMNS + OPTIONAL_COLUMNS
+CLOSE_FIELDS = ['closed_date', 'close_price', 'close_quantity']
+
+# {"index": position in the request, "error": message}, and "id" for existing trades
+Errors = List[Dict]
+
+def _check_fields(item: Dict, fields: List[str], where: str):
+    unknown = sorted(name for name in item if name not in fields)
+    if unknown:
+        raise ValueError(f"{where}: unknown fields {', '.join(unknown)}")
+
+def _list(data: Dict, key: str, max_trades: int) -> List:
+    items = data.get(key)
+    if not isinstance(items, list) or not items:
+        raise ValueError(f'{key} must be a non-empty list')
+    if len(items) > max_trades:
+        raise ValueError(f'at most {max_trades} trades per request')
+    return items
+
+def _check_ids(ids: List):
+    # bool is an int too, but true is never a trade id
+    if any(type(trade_id) is not int for trade_id in ids):
+        raise ValueError('trade ids must be integers')
+    if len(set(ids)) != len(ids):
+        raise ValueError('trade ids must not repeat')
+
+def _validate(form: TradeApiForm, item: Dict):
+    """The trade column values of a JSON trade, or None if it fails the TradeForm rules"""
+    # JSON values as the strings a form posts, normalized as an imported row
+    form.process(formdata=normalize_row({name: '' if item.get(name) is None else str(item[name])
+                                         for name in TRADE_FIELDS}))
+    return trade_values_from_form(form) if form.validate() else None
+
+def parse_creates(data: Dict, max_trades: int) -> Tuple[List[Dict], Errors]:
+    """Trade values for a bulk create, {"trades": [{field: value, ...}, ...]}, and the errors
+    of the trades that fail validation"""
+    items = _list(data, 'trades', max_trades)
+    form = TradeApiForm(formdata=None)
+    values, errors = [], []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f'trades[{index}] must be an object')
+        _check_fields(item, TRADE_FIELDS, f'trades[{index}]')
+        trade_values = _validate(form, item)
+        if trade_values is None:
+            errors.append({'index': index, 'error': form_errors(form)})
+        else:
+            values.append(trade_values)
+    return values, errors
+
+def parse_ids(data: Dict, max_trades: int) -> List[int]:
+    """Trade ids of a bulk delete, {"ids": [...]}"""
+    ids = _list(data, 'ids', max_trades)
+    _check_ids(ids)
+    return ids
+
+def parse_changes(data: Dict, fields: List[str], max_trades: int) -> List[Tuple[int, Dict]]:
+    """(trade id, fields to change) for a bulk close or edit.
+
+    {"ids": [...], field: value, ...} gives every trade the same values;
+    {"trades": [{"id": ..., field: value, ...}, ...]} gives each its own, with
+    fields given beside the list applying to trades that leave them out.
+    """
+    shared = {name: value for name, value in data.items() if name not in ('ids', 'trades')}
+    _check_fields(shared, fields, 'request')
+    if 'ids' in data:
+        items = [{'id': trade_id} for trade_id in parse_ids(data, max_trades)]
+    else:
+        items = _list(data, 'trades', max_trades)
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                raise ValueError(f'trades[{index}] must be an object')
+            _check_fields(item, fields + ['id'], f'trades[{index}]')
+        _check_ids([item.get('id') for item in items])
+    return [(item['id'], dict(shared, **{name: value for name, value in item.items() if name != 'id'}))
+            for item in items]
+
+def validate_changes(trades: List[Trade], changes: List[Dict], close: bool) -> Tuple[List[Tuple[Trade, Dict]], Errors]:
+    """(trade, changed column values) for the trades a bulk close or edit changes, and the
+    errors of those that fail validation.
+
+    Each trade is validated as it would be after the change, as the edit form does;
+    a close sets is_closed and defaults close_quantity to the whole position.
+    """
+    form = TradeApiForm(formdata=None)
+    edits, errors = [], []
+    for index, (trade, changed) in enumerate(zip(trades, changes)):
+        item = journal.encode_values(journal.trade_values(trade))
+        if close:
+            item.update(is_closed=True, close_quantity=abs(trade.quantity))
+        item.update(changed)
+        # A trade held since before its option expired can still be closed or annotated;
+        # only a new expiration date has to be in the future
+        form.require_future_expiration = 'expiration_date' in changed
+        values = _validate(form, item)
+        if values is None:
+            errors.append({'index': index, 'id': trade.id, 'error': form_errors(form)})
+            continue
+        values = {name: value for name, value in values.items() if getattr(trade, name) != value}
+        if values:
+            edits.append((trade, values))
+    return edits, errors
@@ -0,0 +1,122 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Callable, Hashable, Iterable, Optional
+from flask import current_app, g, get_template_attribute, request, session
+from markupsafe import Markup
+from sqlalchemy import update, insert
+from app import db
+from db_models import DataVersion
+import accounts
+import trade_store
+
+class LRUCache:
+    """Thread-safe least-recently-used cache with a fixed number of entries"""
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key: Hashable, value: Any):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+def get_data_version() -> int:
+    """Current data version of the request's account, read once per request"""
+    if 'data_version' not in g:
+        g.data_version = trade_store.get_trade_store().data_version(accounts.current_account_id())
+    return g.data_version
+
+def reload_data_version() -> int:
+    """Read the data version again, for a request that outlives writes (the dashboard stream)"""
+    g.pop('data_version', None)
+    return get_data_version()
+
+def bump_data_version(account_id: int):
+    """Invalidate an account's cached pages and stats. Call in the same transaction as the
+    write; does not commit."""
+    result = db.session.execute(update(DataVersion).where(DataVersion.id == account_id)
+                                .values(version=DataVersion.version + 1)
+                                .execution_options(synchronize_session=False))
+    if result.rowcount == 0:
+        db.session.execute(insert(DataVersion).values(id=account_id, version=1))
+    g.pop('data_version', None)
+
+def get_cache() -> LRUCache:
+    """The app's LRU cache, sized by RESPONSE_CACHE_SIZE"""
+    if 'lru_cache' not in current_app.extensions:
+        current_app.extensions['lru_cache'] = LRUCache(current_app.config['RESPONSE_CACHE_SIZE'])
+    return current_app.extensions['lru_cache']
+
+def cached(name: str, compute: Callable[[], Any], *args: Hashable) -> Any:
+    """compute(), cached under the account and its data version, today's date (options expire) and args"""
+    key = (accounts.current_account_id(), get_data_version(), date.today(), name, args)
+    cache = get_cache()
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value)
+    return value
+
+def get_row_cache() -> LRUCache:
+    """The app's cache of rendered dashboard rows, sized by ROW_CACHE_SIZE"""
+    if 'row_cache' not in current_app.extensions:
+        current_app.extensions['row_cache'] = LRUCache(current_app.config['ROW_CACHE_SIZE'])
+    return current_app.extensions['row_cache']
+
+def trade_row(trade) -> Markup:
+    """A trade's dashboard row (_trade_row.html), rendered once and reused until the trade changes.
+
+    Entries are keyed on the trade id and checked against its updated_at and today's
+    date (the row marks expired options), so edits made by another worker are seen too.
+    """
+    stamp = (trade.updated_at or trade.created_at, date.today())
+    rows = get_row_cache()
+    entry = rows.get(trade.id)
+    if entry is not None and entry[0] == stamp:
+        return entry[1]
+    html = get_template_attribute('_trade_row.html', 'trade_row')(trade)
+    rows.set(trade.id, (stamp, html))
+    return html
+
+def forget_trade_rows(trade_ids: Iterable[int]):
+    """Drop edited or deleted trades' rendered rows"""
+    rows = get_row_cache()
+    for trade_id in trade_ids:
+        rows.discard(trade_id)
+
+def page_etag(*extra: Hashable) -> Optional[str]:
+    """ETag for a page that only depends on the account's trade data, its URL and extra.
+
+    None while flash messages are waiting, so they are never hidden behind a 304.
+    """
+    if '_flashes' in session:
+        return None
+    page = f'{request.full_path}|{extra!r}' if extra else request.full_path
+    url = hashlib.sha1(page.encode()).hexdigest()[:16]
+    return f'{accounts.current_account_id()}-{get_data_version()}-{date.today().isoformat()}-{url}'
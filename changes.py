@@ -0,0 +1,39 @@
+from typing import List, Optional
+from sqlalchemy import delete, func, insert, select
+from app import db
+from db_models import TradeChange
+
+ADDED = 'added'
+UPDATED = 'updated'
+DELETED = 'deleted'
+# Many trades changed at once (an import batch, the expiry sweep): dashboards reload their table
+RESET = 'reset'
+
+# Changes kept for dashboards that reconnect; one that is further behind reloads instead
+CHANGE_BACKLOG = 10000
+PRUNE_EVERY = 1000
+
+def record_change(account_id: int, change: str, trade_id: Optional[int] = None):
+    """Log a write for the dashboard stream. Call in the same transaction as the write; does
+    not commit."""
+    change_id = db.session.execute(insert(TradeChange).values(account_id=account_id, change=change,
+                                                              trade_id=trade_id)).inserted_primary_key[0]
+    if change_id % PRUNE_EVERY == 0:
+        db.session.execute(delete(TradeChange).where(TradeChange.id <= change_id - CHANGE_BACKLOG))
+
+def last_change_id(account_id: int) -> int:
+    """Id of the account's latest change, 0 if there is none"""
+    return db.session.execute(select(func.max(TradeChange.id))
+                              .where(TradeChange.account_id == account_id)).scalar() or 0
+
+def changes_since(account_id: int, after_id: int, limit: int = 1000) -> Optional[List[TradeChange]]:
+    """The account's changes after after_id, oldest first; None if some may have been pruned
+    (or there are more than limit), in which case the dashboard reloads"""
+    newest = db.session.execute(select(func.max(TradeChange.id))).scalar() or 0
+    if after_id < newest - CHANGE_BACKLOG:
+        return None
+    rows = db.session.execute(select(TradeChange)
+                              .where(TradeChange.account_id == account_id, TradeChange.id > after_id)
+                              .order_by(TradeChange.id)
+                              .limit(limit + 1)).scalars().all()
+    return rows if len(rows) <= limit else None
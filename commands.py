@@ -0,0 +1,225 @@
+import click
+import os
+import time
+from flask import Blueprint, current_app
+from sqlalchemy import func, select
+from app import db
+from db_models import Trade, SymbolAggregate, DEFAULT_ACCOUNT_ID, expiry_cutoff
+import accounts
+import aggregates
+import cache
+import expiry
+import importer
+import jobs
+import journal
+import lots
+import queries
+import schema
+import sqlite_storage
+
+bp = Blueprint('commands', __name__, cli_group=None)
+
+account_option = click.option('--account', 'account', default=None,
+                              help='Account name or id (default: the default account)')
+
+def _account_id(account) -> int:
+    """Id of the account named (or numbered) by an --account option"""
+    if account is None:
+        return DEFAULT_ACCOUNT_ID
+    found = accounts.get_account(int(account)) if account.isdigit() else accounts.get_account_by_name(account)
+    if found is None:
+        raise click.ClickException(f'No account {account}; create it with `flask create-account`')
+    return found.id
+
+@bp.cli.command('migrate')
+@click.option('--dry-run', is_flag=True, help='List the changes without making them')
+def migrate_command(dry_run):
+    """Create the tables, columns and indexes the database is missing"""
+    # Commands that read and then write take the SQLite write lock up front, as write
+    # requests do, so a concurrent writer makes them wait rather than fail
+    sqlite_storage.writes_ahead()
+    try:
+        with db.engine.begin() as connection:
+            changes = schema.migrate(connection, db.metadata, dry_run=dry_run)
+    except schema.MigrationError as e:
+        raise click.ClickException(str(e))
+    for change in changes:
+        click.echo(change)
+    if not changes:
+        click.echo('Schema is up to date')
+    elif dry_run:
+        click.echo(f'{len(changes)} changes pending')
+    elif aggregates.needs_rebuild(changes) and db.session.execute(select(Trade.id).limit(1)).first():
+        # New aggregate tables and columns start empty or zero; fill them from the trades already there
+        count = aggregates.rebuild_aggregates()
+        for account_id in accounts.account_ids():
+            cache.bump_data_version(account_id)
+        db.session.commit()
+        click.echo(f'Rebuilt aggregates from {count} trades')
+    if not dry_run and journal.needs_baseline(changes):
+        # The journal starts now; snapshot the trades already there so it can rebuild from them
+        count = journal.take_baselines()
+        click.echo(f'Took baseline journal snapshots of {count} trades')
+
+@bp.cli.command('create-account')
+@click.argument('name')
+def create_account_command(name):
+    """Add an account; trades and stats are kept separately for each account"""
+    sqlite_storage.writes_ahead()
+    try:
+        account = accounts.create_account(name)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Created account {account.id}: {account.name}')
+
+@bp.cli.command('list-accounts')
+def list_accounts_command():
+    """List the accounts and their trade counts"""
+    counts = dict(db.session.execute(select(SymbolAggregate.account_id, func.sum(SymbolAggregate.trade_count))
+                                     .group_by(SymbolAggregate.account_id)).all())
+    for account in accounts.list_accounts():
+        click.echo(f'{account.id:>6} {account.name:<32} {counts.get(account.id) or 0:>10} trades')
+
+@bp.cli.command('rebuild-aggregates')
+def rebuild_aggregates_command():
+    """Recompute the portfolio aggregate tables from the trades table"""
+    sqlite_storage.writes_ahead()
+    count = aggregates.rebuild_aggregates()
+    for account_id in accounts.account_ids():
+        cache.bump_data_version(account_id)
+    db.session.commit()
+    click.echo(f'Rebuilt aggregates from {count} trades')
+
+@bp.cli.command('snapshot-journal')
+@account_option
+def snapshot_journal_command(account):
+    """Snapshot an account's trades now, so point-in-time rebuilds after this replay from here"""
+    snapshot = journal.take_snapshot(_account_id(account))
+    click.echo(f'Snapshot of {snapshot.trade_count} trades up to journal event {snapshot.last_event_id}')
+
+@bp.cli.command('optimize-db')
+def optimize_db_command():
+    """Refresh SQLite query planner statistics and checkpoint the WAL (e.g. nightly from cron)"""
+    if db.engine.dialect.name != 'sqlite':
+        click.echo(f'{db.engine.dialect.name} database: nothing to do')
+        return
+    started = time.perf_counter()
+    connection = db.engine.raw_connection()
+    try:
+        busy, wal_pages, checkpointed = sqlite_storage.analyze(connection.driver_connection)
+    finally:
+        connection.close()
+    click.echo(f'Analyzed in {time.perf_counter() - started:.2f}s; '
+               f'WAL checkpoint: {checkpointed} of {wal_pages} pages{" (busy)" if busy else ""}')
+
+@bp.cli.command('check-query-plans')
+@click.option('--verbose', is_flag=True, help='Print the full plan for every query')
+@account_option
+def check_query_plans_command(verbose, account):
+    """Fail if any dashboard filter combination scans the trades table or misses its index"""
+    failures = 0
+    for check in queries.check_dashboard_plans(_account_id(account)):
+        failures += not check.ok
+        click.echo(f"{'ok  ' if check.ok else 'FAIL'} /?{check.query_string}  (expects {' or '.join(check.indexes)})")
+        if verbose or not check.ok:
+            for line in check.plan:
+                click.echo(f'        {line}')
+    if failures:
+        raise click.ClickException(f'{failures} dashboard queries scan the trades table or miss their index')
+
+@bp.cli.command('import-trades')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', type=int, default=None, help='Rows per insert batch and commit')
+@account_option
+def import_trades_command(path, batch_size, account):
+    """Import trades from a broker statement CSV"""
+    sqlite_storage.writes_ahead()
+    account_id = _account_id(account)
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        try:
+            result = importer.import_trades_csv(f, account_id,
+                                                batch_size=batch_size or current_app.config['IMPORT_BATCH_SIZE'])
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    for line, message in result.errors:
+        click.echo(f'line {line}: {message}', err=True)
+    if result.errors_truncated:
+        click.echo(f'... {result.failed - len(result.errors)} more errors not shown', err=True)
+    click.echo(f'Imported {result.imported} trades, {result.failed} rows failed')
+
+@bp.cli.command('sweep-expired')
+@click.option('--as-of', type=click.DateTime(['%Y-%m-%d']), default=None,
+              help='Close options that expired before this date (default: everything expired by now)')
+@click.option('--dry-run', is_flag=True, help='Count the expired open options without closing them')
+def sweep_expired_command(as_of, dry_run):
+    """Close expired option positions at zero value (e.g. daily from cron)"""
+    if dry_run:
+        count = 0
+        for account_id in accounts.account_ids():
+            stmt = expiry.expired_open_options(account_id, expiry_cutoff(as_of))
+            count += db.session.execute(select(func.count()).select_from(stmt.order_by(None).subquery())).scalar()
+        click.echo(f'{count} expired options to close')
+        return
+    sqlite_storage.writes_ahead()
+    started = time.perf_counter()
+    closed = expiry.sweep_expired_options(as_of)
+    click.echo(f'Closed {len(closed)} expired options in {time.perf_counter() - started:.2f}s')
+
+@bp.cli.command('run-jobs')
+@click.option('--once', is_flag=True, help='Exit when no jobs are queued instead of waiting for more')
+@click.option('--nice', type=int, default=10, help='Lower this process\'s CPU priority by this much (0 keeps it)')
+def run_jobs_command(once, nice):
+    """Run queued background jobs one at a time (alongside web workers with JOB_WORKERS=0)"""
+    # Page views in web workers on the same host get the CPU first; run more processes for more jobs at once
+    if nice:
+        os.nice(nice)
+    count = jobs.work(current_app._get_current_object(), current_app.config['JOB_POLL_INTERVAL'], once=once)
+    click.echo(f'Ran {count} jobs')
+
+@bp.cli.command('load-prices')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--replace', is_flag=True, help='Drop the existing history instead of merging into it')
+def load_prices_command(path, replace):
+    """Load end-of-day closes (symbol,date,close CSV) into the PRICE_HISTORY_DIR store"""
+    directory = current_app.config['PRICE_HISTORY_DIR']
+    if not directory:
+        raise click.ClickException('Set PRICE_HISTORY_DIR to the directory for the price history')
+    # NumPy is only imported for price commands
+    import price_history
+    started = time.perf_counter()
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        try:
+            history = price_history.load_price_csv(directory, f, replace=replace)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    click.echo(f'{len(history)} closes for {len(history.offsets)} symbols in {directory} '
+               f'({time.perf_counter() - started:.2f}s)')
+
+@bp.cli.command('match-lots')
+@click.option('--method', type=click.Choice(lots.MATCH_METHODS), default='fifo', help='Lot matching order')
+@click.option('--symbol', default=None, help='Only match this symbol')
+@click.option('--show-lots', is_flag=True, help='List every open lot')
+@click.option('--lots', 'selected', multiple=True, metavar='CLOSE:LOT[,LOT...]',
+              help='Lots (opening trade ids) a closing trade takes first (repeatable)')
+@account_option
+def match_lots_command(method, symbol, show_lots, selected, account):
+    """Match closing executions against open lots and report realized P&L"""
+    account_id = _account_id(account)
+    started = time.perf_counter()
+    try:
+        book = lots.build_lot_book(account_id, method, symbol, keep_matches=False,
+                                   selections=lots.parse_selections(selected))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    elapsed = time.perf_counter() - started
+
+    open_lots = book.open_lots()
+    if show_lots:
+        for lot in open_lots:
+            contract = ' '.join(str(part) for part in lot.contract if part is not None)
+            side = 'long' if lot.side == lots.LONG else 'short'
+            click.echo(f'{lot.lot_id:>8} {contract:<32} {side:<5} {lot.quantity:>8} @ {lot.open_price:.2f}  {lot.open_date}')
+    for trade_id, quantity in book.unmatched:
+        click.echo(f'trade {trade_id}: {quantity} units closed with no open lot', err=True)
+    click.echo(f'{book.executions} executions matched {method.upper()} in {elapsed:.2f}s: '
+               f'{len(open_lots)} open lots, realized P&L {book.total_realized_pnl:,.2f}')
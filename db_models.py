@@ -1,8 +1,20 @@
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from typing import Optional
 from app import db
-from sqlalchemy import Enum as SqlEnum
+from sqlalchemy import Enum as SqlEnum, DDL, event, and_, case, func
+from sqlalchemy.ext.hybrid import hybrid_property
 import enum
 
+# Trades that predate accounts, and requests that haven't picked one, are in this account
+DEFAULT_ACCOUNT_ID = 1
+
+def expiry_cutoff(now: Optional[datetime] = None) -> date:
+    """Options expiring before this date are expired: an option expires once now is past
+    midnight of its expiration date"""
+    now = now or datetime.now()
+    midnight = datetime.combine(now.date(), datetime.min.time())
+    return now.date() + timedelta(days=1) if now > midnight else now.date()
+
 class TradeType(enum.Enum):
     STOCK = "stock"
     CALL = "call"
@@ -14,10 +26,52 @@ class TradeAction(enum.Enum):
     SELL_TO_OPEN = "sell_to_open"
     SELL_TO_CLOSE = "sell_to_close"
 
+class JobStatus(enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+# A job in one of these states won't change again
+FINISHED_JOB_STATUSES = [JobStatus.SUCCEEDED, JobStatus.FAILED, JobStatus.CANCELLED]
+
+class Account(db.Model):
+    """A separate portfolio; every trade, aggregate row and data version belongs to one"""
+    __tablename__ = 'accounts'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), nullable=False, unique=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Account {self.id} {self.name}>'
+
+# Existing trades are moved into the default account, so it is there from the start
+event.listen(
+    Account.__table__, 'after_create',
+    DDL(f"INSERT INTO accounts (id, name) VALUES ({DEFAULT_ACCOUNT_ID}, 'Default')"),
+)
+
 class Trade(db.Model):
     __tablename__ = 'trades'
+    # Every index starts with account_id, so an account's queries read only its own rows
+    __table_args__ = (
+        # Dashboard sort order and keyset cursor, alone and behind each filter
+        db.Index('ix_trades_account_date_id', 'account_id', 'date', 'id'),
+        db.Index('ix_trades_account_symbol_date_id', 'account_id', 'symbol', 'date', 'id'),
+        db.Index('ix_trades_account_type_date_id', 'account_id', 'trade_type', 'date', 'id'),
+        db.Index('ix_trades_account_action_date_id', 'account_id', 'action', 'date', 'id'),
+        # Open/expired option lookups
+        db.Index('ix_trades_account_closed_expiration', 'account_id', 'is_closed', 'expiration_date'),
+        # Substring symbol search; Postgres only (needs pg_trgm)
+        db.Index('ix_trades_symbol_trgm', 'symbol',
+                 postgresql_using='gin',
+                 postgresql_ops={'symbol': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('accounts.id'), nullable=False, default=DEFAULT_ACCOUNT_ID)
     symbol = db.Column(db.String(10), nullable=False)
     trade_type = db.Column(SqlEnum(TradeType), nullable=False)
     action = db.Column(SqlEnum(TradeAction), nullable=False)
@@ -38,15 +92,21 @@ class Trade(db.Model):
     close_quantity = db.Column(db.Integer, nullable=True)
     notes = db.Column(db.Text, default="")
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Set by every UPDATE, including set-based ones; the dashboard's row cache is keyed on it
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     def __repr__(self):
         return f'<Trade {self.action.value} {self.quantity} {self.symbol} {self.trade_type.value}>'
     
-    @property
+    @hybrid_property
     def is_option(self) -> bool:
         return self.trade_type in [TradeType.CALL, TradeType.PUT]
     
-    @property
+    @is_option.expression
+    def is_option(cls):
+        return cls.trade_type.in_([TradeType.CALL, TradeType.PUT])
+    
+    @hybrid_property
     def total_cost(self) -> float:
         """Calculate total cost/proceeds of the trade including fees"""
         if self.is_option:
@@ -67,10 +127,25 @@ class Trade(db.Model):
         # Add fees to the total cost (fees are always a cost)
         return base_cost + (self.fees or 0)
     
-    @property
+    @total_cost.expression
+    def total_cost(cls):
+        # Same operations in the same order as above, so SQL and Python round alike
+        is_sell = cls.action.in_([TradeAction.SELL_TO_OPEN, TradeAction.SELL_TO_CLOSE])
+        option_cost = cls.price * func.abs(cls.quantity) * 100
+        stock_cost = cls.price * func.abs(cls.quantity)
+        base_cost = case(
+            (and_(cls.is_option, is_sell), -option_cost),
+            (cls.is_option, option_cost),
+            (is_sell, -stock_cost),
+            else_=stock_cost,
+        )
+        return base_cost + func.coalesce(cls.fees, 0.0)
+    
+    @hybrid_property
     def realized_pnl(self) -> float:
         """Calculate realized P&L for closed positions only"""
-        if not self.is_closed or not self.close_price or not self.close_quantity:
+        # A close price of 0 is a close (an option that expired worthless)
+        if not self.is_closed or self.close_price is None or not self.close_quantity:
             return 0.0
         
         # Calculate opening cost
@@ -97,19 +172,35 @@ class Trade(db.Model):
                 closing_cost = self.close_price * abs(self.close_quantity)
                 return abs(opening_cost) - closing_cost
     
+    @realized_pnl.expression
+    def realized_pnl(cls):
+        # A NULL close price or a NULL or zero close quantity counts as not closed, as above
+        has_close = and_(cls.is_closed == True,  # noqa: E712
+                         cls.close_price.isnot(None),
+                         func.coalesce(cls.close_quantity, 0) != 0)
+        opening_value = func.abs(cls.total_cost)
+        close_value = case(
+            (cls.is_option, cls.close_price * func.abs(cls.close_quantity) * 100),
+            else_=cls.close_price * func.abs(cls.close_quantity),
+        )
+        return case(
+            (and_(has_close, cls.action == TradeAction.BUY_TO_OPEN), close_value - opening_value),
+            (has_close, opening_value - close_value),
+            else_=0.0,
+        )
+    
     @property
     def is_expired(self) -> bool:
         """Check if option is expired"""
         if not self.is_option or not self.expiration_date:
             return False
-        # Convert expiration_date to datetime for comparison
-        exp_datetime = datetime.combine(self.expiration_date, datetime.min.time())
-        return datetime.now() > exp_datetime
+        return self.expiration_date < expiry_cutoff()
     
     def to_dict(self) -> dict:
         """Convert trade to dictionary for JSON serialization"""
         return {
             'id': self.id,
+            'account_id': self.account_id,
             'symbol': self.symbol,
             'trade_type': self.trade_type.value,
             'action': self.action.value,
@@ -119,8 +210,256 @@ class Trade(db.Model):
             'strike_price': self.strike_price,
             'expiration_date': self.expiration_date.isoformat() if self.expiration_date else None,
             'premium': self.premium,
+            'fees': self.fees,
+            'is_closed': self.is_closed,
+            'closed_date': self.closed_date.isoformat() if self.closed_date else None,
+            'close_price': self.close_price,
+            'close_quantity': self.close_quantity,
             'notes': self.notes,
-            'created_at': self.created_at.isoformat(),
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
             'total_cost': self.total_cost,
+            'realized_pnl': self.realized_pnl,
             'is_expired': self.is_expired
-        }
\ No newline at end of file
+        }
+
+# On the index rather than the table, so adding the index to an existing table creates it too
+event.listen(
+    next(index for index in Trade.__table__.indexes if index.name == 'ix_trades_symbol_trgm'), 'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'),
+)
+
+
+class SymbolAggregate(db.Model):
+    """Per-account, per-symbol running totals, kept in step with the trades table by aggregates.py"""
+    __tablename__ = 'account_symbol_aggregates'
+    
+    # Account first, so an account's rows are one primary key range
+    account_id = db.Column(db.Integer, primary_key=True)
+    symbol = db.Column(db.String(10), primary_key=True)
+    trade_count = db.Column(db.Integer, nullable=False, default=0)
+    stock_trades = db.Column(db.Integer, nullable=False, default=0)
+    options_trades = db.Column(db.Integer, nullable=False, default=0)
+    open_positions = db.Column(db.Integer, nullable=False, default=0)
+    closed_positions = db.Column(db.Integer, nullable=False, default=0)
+    
+    # Debits/credits split by the sign of Trade.total_cost
+    total_invested = db.Column(db.Float, nullable=False, default=0.0)
+    total_proceeds = db.Column(db.Float, nullable=False, default=0.0)
+    options_premium_paid = db.Column(db.Float, nullable=False, default=0.0)
+    options_premium_received = db.Column(db.Float, nullable=False, default=0.0)
+    realized_pnl = db.Column(db.Float, nullable=False, default=0.0)
+    total_fees = db.Column(db.Float, nullable=False, default=0.0)
+    
+    # Stock position
+    stock_quantity = db.Column(db.Integer, nullable=False, default=0)
+    stock_cost = db.Column(db.Float, nullable=False, default=0.0)
+    stock_buy_quantity = db.Column(db.Integer, nullable=False, default=0)
+    
+    # Totals split by action, as shown on the portfolio page
+    buy_cost = db.Column(db.Float, nullable=False, default=0.0)
+    sell_cost = db.Column(db.Float, nullable=False, default=0.0)
+    
+    def __repr__(self):
+        return f'<SymbolAggregate {self.account_id} {self.symbol} {self.trade_count} trades>'
+    
+    @property
+    def avg_cost(self) -> float:
+        """Average purchase price of the stock bought in this symbol"""
+        if not self.stock_buy_quantity:
+            return 0.0
+        return self.stock_cost / self.stock_buy_quantity
+    
+    @property
+    def net_pnl(self) -> float:
+        return self.total_proceeds - self.total_invested
+
+
+class OptionExpiryAggregate(db.Model):
+    """Number of option trades per account and expiration date, used to split expired/active options"""
+    __tablename__ = 'account_option_expiry_aggregates'
+    
+    account_id = db.Column(db.Integer, primary_key=True)
+    expiration_date = db.Column(db.Date, primary_key=True)
+    options_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<OptionExpiryAggregate {self.account_id} {self.expiration_date} {self.options_count}>'
+
+
+class DailySymbolAggregate(db.Model):
+    """Per-symbol, per-day changes in cash flow, realized P&L and open exposure of an account,
+    plus the symbol's running totals up to and including the day"""
+    __tablename__ = 'account_daily_symbol_aggregates'
+
+    # Account and symbol first, so one symbol's date range is a primary key range scan
+    account_id = db.Column(db.Integer, primary_key=True)
+    symbol = db.Column(db.String(10), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    trade_count = db.Column(db.Integer, nullable=False, default=0)
+    # Credits positive, debits negative; includes closes recorded on the opening row
+    cash_flow = db.Column(db.Float, nullable=False, default=0.0)
+    realized_pnl = db.Column(db.Float, nullable=False, default=0.0)
+    fees = db.Column(db.Float, nullable=False, default=0.0)
+    # Cost of positions opened minus positions closed
+    exposure_change = db.Column(db.Float, nullable=False, default=0.0)
+
+    # Running totals, recomputed from the changed day onward by aggregates.py
+    cum_cash_flow = db.Column(db.Float, nullable=False, default=0.0)
+    cum_realized_pnl = db.Column(db.Float, nullable=False, default=0.0)
+    exposure = db.Column(db.Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f'<DailySymbolAggregate {self.account_id} {self.symbol} {self.day}>'
+
+
+class DailyAggregate(db.Model):
+    """Whole-account daily changes plus running totals up to and including the day"""
+    __tablename__ = 'account_daily_aggregates'
+
+    account_id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    trade_count = db.Column(db.Integer, nullable=False, default=0)
+    cash_flow = db.Column(db.Float, nullable=False, default=0.0)
+    realized_pnl = db.Column(db.Float, nullable=False, default=0.0)
+    fees = db.Column(db.Float, nullable=False, default=0.0)
+    exposure_change = db.Column(db.Float, nullable=False, default=0.0)
+
+    # Running totals, recomputed from the changed day onward by aggregates.py
+    cum_cash_flow = db.Column(db.Float, nullable=False, default=0.0)
+    cum_realized_pnl = db.Column(db.Float, nullable=False, default=0.0)
+    exposure = db.Column(db.Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f'<DailyAggregate {self.account_id} {self.day}>'
+
+
+class TradeChange(db.Model):
+    """One write to an account's trades, for the dashboard stream (live.py); old rows are pruned"""
+    __tablename__ = 'trade_changes'
+    __table_args__ = (
+        # An account's changes after the last one a dashboard has seen
+        db.Index('ix_trade_changes_account_id', 'account_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('accounts.id'), nullable=False)
+    # added, updated or deleted, or reset when many trades changed at once
+    change = db.Column(db.String(16), nullable=False)
+    trade_id = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<TradeChange {self.id} {self.change} {self.trade_id}>'
+
+
+class TradeEvent(db.Model):
+    """One write to a trade, kept forever: the journal that past portfolios are rebuilt from (journal.py)"""
+    __tablename__ = 'trade_events'
+    __table_args__ = (
+        # The events of an account after a snapshot
+        db.Index('ix_trade_events_account_id', 'account_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('accounts.id'), nullable=False)
+    trade_id = db.Column(db.Integer, nullable=False)
+    # created (every journal column), updated (the columns that changed) or deleted (none)
+    kind = db.Column(db.String(16), nullable=False)
+    data = db.Column(db.JSON, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<TradeEvent {self.id} {self.kind} {self.trade_id}>'
+
+
+class PortfolioSnapshot(db.Model):
+    """An account's trades as of one journal event, compressed; replay starts from the latest one"""
+    __tablename__ = 'portfolio_snapshots'
+    __table_args__ = (
+        # The latest snapshot of an account taken before a point in time
+        db.Index('ix_portfolio_snapshots_account_taken', 'account_id', 'taken_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('accounts.id'), nullable=False)
+    # The snapshot holds every event up to this one
+    last_event_id = db.Column(db.Integer, nullable=False)
+    taken_at = db.Column(db.DateTime, nullable=False)
+    trade_count = db.Column(db.Integer, nullable=False)
+    # Taken when the journal was added to a database with trades; the account's history starts here
+    baseline = db.Column(db.Boolean, nullable=False, default=False)
+    state = db.Column(db.LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return f'<PortfolioSnapshot {self.account_id} @{self.last_event_id}>'
+
+
+class DataVersion(db.Model):
+    """Counter bumped by every write to an account's trades, used for caching; one row per account"""
+    __tablename__ = 'data_version'
+    
+    # The account id, so a write to one account leaves the others' cached pages valid
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<DataVersion {self.version}>'
+
+
+class Job(db.Model):
+    """A background job run by jobs.py; the row is kept after it finishes so the result can be read"""
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        # The oldest queued job, for `flask run-jobs`
+        db.Index('ix_jobs_status_id', 'status', 'id'),
+        # An account's recent jobs
+        db.Index('ix_jobs_account_id', 'account_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('accounts.id'), nullable=False)
+    kind = db.Column(db.String(32), nullable=False)
+    status = db.Column(SqlEnum(JobStatus), nullable=False, default=JobStatus.QUEUED)
+    params = db.Column(db.JSON, nullable=True)
+    result = db.Column(db.JSON, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+
+    # Progress as reported by the job: done of total units (total may be unknown) and a message
+    progress_done = db.Column(db.Integer, nullable=False, default=0)
+    progress_total = db.Column(db.Integer, nullable=True)
+    message = db.Column(db.String(255), nullable=True)
+    # Set by a cancel while the job runs; the job stops at its next progress report
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status.value}>'
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in FINISHED_JOB_STATUSES
+
+    def to_dict(self) -> dict:
+        """Convert job to dictionary for JSON serialization"""
+        return {
+            'id': self.id,
+            'account_id': self.account_id,
+            'kind': self.kind,
+            'status': self.status.value,
+            'params': self.params,
+            'result': self.result,
+            'error': self.error,
+            'progress_done': self.progress_done,
+            'progress_total': self.progress_total,
+            'message': self.message,
+            'cancel_requested': self.cancel_requested,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
@@ -0,0 +1,133 @@
+import logging
+import threading
+import time
+from datetime import date, datetime
+from typing import Dict, List, Optional
+from flask import Flask
+from sqlalchemy import Select, func, select, update
+from sqlalchemy.orm.attributes import set_committed_value
+from app import db
+from db_models import Trade, TradeAction, expiry_cutoff
+import accounts
+import aggregates
+import cache
+import changes
+import jobs
+import journal
+import sqlite_storage
+
+logger = logging.getLogger(__name__)
+
+# Only one sweeper thread per process, however many requests arrive at once
+_sweeper_lock = threading.Lock()
+
+# Only an opening trade holds a contract; a closing trade's row has nothing left to expire
+OPENING_ACTIONS = [TradeAction.BUY_TO_OPEN, TradeAction.SELL_TO_OPEN]
+
+def is_sweepable(trade: Trade, expired_before: date) -> bool:
+    """An open option position that expired before expired_before"""
+    return (trade.is_option and not trade.is_closed and trade.action in OPENING_ACTIONS
+            and trade.expiration_date is not None and trade.expiration_date < expired_before)
+
+def close_values(trade: Trade) -> Dict:
+    """The close recorded for an option that expired: worthless, on its expiration date"""
+    return {
+        'is_closed': True,
+        'closed_date': trade.expiration_date,
+        'close_price': 0.0,
+        'close_quantity': abs(trade.quantity),
+    }
+
+def expired_open_options(account_id: int, expired_before: date) -> Select:
+    """An account's open option positions that expired before expired_before, found
+    with a range scan of ix_trades_account_closed_expiration"""
+    return (select(Trade)
+            .where(Trade.account_id == account_id,
+                   Trade.is_closed == False,  # noqa: E712
+                   Trade.expiration_date < expired_before,
+                   Trade.is_option,
+                   Trade.action.in_(OPENING_ACTIONS))
+            .order_by(Trade.expiration_date, Trade.id))
+
+def sweep_expired_options(now: Optional[datetime] = None, batch_size: int = 1000) -> List[Trade]:
+    """Close every account's expired open options at zero value in one transaction and
+    commit; returns the trades closed"""
+    expired_before = expiry_cutoff(now)
+    trades = [trade for account_id in accounts.account_ids()
+              for trade in db.session.execute(expired_open_options(account_id, expired_before)).scalars()]
+    if not trades:
+        db.session.rollback()
+        return []
+
+    # is_closed in the WHERE clause catches a sweep in another process that got there first
+    closed = 0
+    for start in range(0, len(trades), batch_size):
+        ids = [trade.id for trade in trades[start:start + batch_size]]
+        stmt = (update(Trade)
+                .where(Trade.id.in_(ids), Trade.is_closed == False)  # noqa: E712
+                .values(is_closed=True, closed_date=Trade.expiration_date, close_price=0.0,
+                        close_quantity=func.abs(Trade.quantity))
+                .execution_options(synchronize_session=False))
+        closed += db.session.execute(stmt).rowcount
+    if closed != len(trades):
+        db.session.rollback()
+        logger.info('Expired options were closed by another sweep')
+        return []
+
+    # The loaded trades still hold the old values, which come out of the aggregates first
+    aggregates.apply_trades(trades, sign=-1)
+    for trade in trades:
+        for name, value in close_values(trade).items():
+            set_committed_value(trade, name, value)
+    aggregates.apply_trades(trades)
+    account_ids = sorted({trade.account_id for trade in trades})
+    for account_id in account_ids:
+        changes.record_change(account_id, changes.RESET)
+        journal.record(account_id, journal.UPDATED, [(trade.id, close_values(trade))
+                                                     for trade in trades if trade.account_id == account_id])
+        cache.bump_data_version(account_id)
+    db.session.commit()
+    for account_id in account_ids:
+        jobs.queue_snapshot_if_due(account_id)
+    return trades
+
+def _sweep_periodically(app: Flask, interval: int):
+    # Imported here because trade_store imports this module
+    from trade_store import get_trade_store
+    while True:
+        try:
+            with app.app_context():
+                # The sweep reads the expired options before updating them, so it takes the
+                # SQLite write lock up front and waits for other writers instead of failing
+                sqlite_storage.writes_ahead()
+                closed = get_trade_store().sweep_expired()
+            if closed:
+                logger.info(f'Closed {len(closed)} expired options')
+        except Exception as e:
+            logger.warning(f'Expiry sweep failed: {e}')
+        time.sleep(interval)
+
+def _start_sweeper(app: Flask, interval: int):
+    with _sweeper_lock:
+        if 'expiry_sweeper' in app.extensions:
+            return
+        thread = threading.Thread(target=_sweep_periodically, args=(app, interval),
+                                  name='expiry-sweeper', daemon=True)
+        app.extensions['expiry_sweeper'] = thread
+        thread.start()
+
+def init_app(app: Flask):
+    """Sweep in a daemon thread every EXPIRY_SWEEP_INTERVAL seconds (0 disables).
+
+    The thread starts with the first request a process serves (so after gunicorn
+    forks), never for `flask` commands such as migrate; cron can run
+    `flask sweep-expired` instead.
+    """
+    interval = app.config['EXPIRY_SWEEP_INTERVAL']
+    if not interval:
+        return
+
+    @app.before_request
+    def start_expiry_sweeper():
+        if 'expiry_sweeper' not in app.extensions:
+            _start_sweeper(app, interval)
@@ -0,0 +1,50 @@
+import csv
+import io
+import json
+from typing import Iterable, Iterator
+from db_models import Trade
+
+# to_dict keys, in column order; the first columns are the ones the importer reads
+EXPORT_COLUMNS = [
+    'symbol', 'trade_type', 'action', 'quantity', 'price', 'date', 'strike_price', 'expiration_date',
+    'fees', 'is_closed', 'closed_date', 'close_price', 'close_quantity', 'notes',
+    'id', 'premium', 'created_at', 'updated_at', 'total_cost', 'realized_pnl', 'is_expired',
+]
+
+# Bytes of output collected before a chunk is sent
+CHUNK_SIZE = 64 * 1024
+
+def iter_trades(query, batch_size: int = 1000) -> Iterator[Trade]:
+    """Trades in dashboard order, fetched batch_size rows at a time (a server-side cursor on Postgres)"""
+    return query.order_by(Trade.date.desc(), Trade.id.desc()).yield_per(batch_size)
+
+def generate_csv(trades: Iterable[Trade]) -> Iterator[str]:
+    """CSV export of trades, yielded in chunks of about CHUNK_SIZE"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, extrasaction='ignore')
+    writer.writeheader()
+
+    for trade in trades:
+        writer.writerow(trade.to_dict())
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+def generate_ndjson(trades: Iterable[Trade]) -> Iterator[str]:
+    """Newline-delimited JSON export of trades, one trade per line"""
+    lines = []
+    size = 0
+    for trade in trades:
+        line = json.dumps(trade.to_dict()) + '\n'
+        lines.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(lines)
+            lines = []
+            size = 0
+
+    if lines:
+        yield ''.join(lines)
@@ -1,4 +1,5 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, SelectField, IntegerField, FloatField, DateField, TextAreaField, SubmitField, BooleanField
 from wtforms.validators import DataRequired, NumberRange, Optional, Length
 from datetime import datetime
@@ -24,11 +25,15 @@ class TradeForm(FlaskForm):
     fees = FloatField('Fees', validators=[Optional(), NumberRange(min=0.0)], default=0.0)
     is_closed = BooleanField('Position Closed', default=False)
     closed_date = DateField('Closed Date', validators=[Optional()])
-    close_price = FloatField('Close Price', validators=[Optional(), NumberRange(min=0.01)])
+    # Zero is a real close: the expiry sweep closes expired options at 0
+    close_price = FloatField('Close Price', validators=[Optional(), NumberRange(min=0.0)])
     close_quantity = IntegerField('Close Quantity', validators=[Optional(), NumberRange(min=1)])
     notes = TextAreaField('Notes', validators=[Optional(), Length(max=500)])
     submit = SubmitField('Save Trade')
     
+    # Imported history is allowed to have expired options
+    require_future_expiration = True
+    
     def validate(self, extra_validators=None):
         """Custom validation for options fields"""
         if not super().validate(extra_validators):
@@ -45,7 +50,8 @@ class TradeForm(FlaskForm):
 
             
             # Check expiration date is in the future
-            if self.expiration_date.data and self.expiration_date.data < datetime.now().date():
+            if (self.require_future_expiration and self.expiration_date.data
+                    and self.expiration_date.data < datetime.now().date()):
                 self.expiration_date.errors.append('Expiration date must be in the future')
                 return False
         
@@ -54,7 +60,7 @@ class TradeForm(FlaskForm):
             if not self.closed_date.data:
                 self.closed_date.errors.append('Close date is required for closed positions')
                 return False
-            if not self.close_price.data:
+            if self.close_price.data is None:
                 self.close_price.errors.append('Close price is required for closed positions')
                 return False
             if not self.close_quantity.data:
@@ -63,7 +69,28 @@ class TradeForm(FlaskForm):
         
         return True
 
+class TradeImportForm(TradeForm):
+    """TradeForm rules applied to one row of an imported broker statement"""
+    class Meta:
+        csrf = False
+    
+    require_future_expiration = False
+
+class TradeApiForm(TradeForm):
+    """TradeForm rules applied to one trade of a JSON bulk request"""
+    class Meta:
+        csrf = False
+
+class ImportForm(FlaskForm):
+    file = FileField('Broker Statement (CSV)', validators=[FileRequired(), FileAllowed(['csv'], 'CSV files only')])
+    background = BooleanField('Import in the background')
+    submit = SubmitField('Import Trades')
+
 class FilterForm(FlaskForm):
+    class Meta:
+        # Submitted with GET from the dashboard, so there is no CSRF token
+        csrf = False
+    
     trade_type = SelectField('Trade Type', 
                            choices=[('all', 'All Types'), ('stock', 'Stock'), ('call', 'Call Option'), ('put', 'Put Option')],
                            default='all')
@@ -72,6 +99,10 @@ class FilterForm(FlaskForm):
                                 ('sell_to_open', 'Sell to Open'), ('sell_to_close', 'Sell to Close')],
                         default='all')
     symbol = StringField('Symbol', validators=[Optional(), Length(max=10)])
+    # Contains by default, as the filter always matched; prefix and exact can use the symbol index
+    symbol_match = SelectField('Symbol Match',
+                               choices=[('contains', 'Contains'), ('prefix', 'Starts with'), ('exact', 'Exact')],
+                               default='contains')
     date_from = DateField('From Date', validators=[Optional()])
     date_to = DateField('To Date', validators=[Optional()])
     
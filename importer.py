@@ -0,0 +1,107 @@
+import csv
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import insert
+from werkzeug.datastructures import MultiDict
+from app import db
+from db_models import Trade
+from forms import TradeImportForm
+from utils import trade_values_from_form
+import aggregates
+import cache
+import changes
+import journal
+import trade_store
+
+REQUIRED_COLUMNS = ['symbol', 'trade_type', 'action', 'quantity', 'price', 'date']
+OPTIONAL_COLUMNS = ['strike_price', 'expiration_date', 'fees', 'is_closed', 'closed_date',
+                    'close_price', 'close_quantity', 'notes']
+TRUE_VALUES = {'1', 'true', 'yes', 'y'}
+
+# Only the first errors are kept, so a bad file can't grow the report without bound
+MAX_REPORTED_ERRORS = 1000
+
+@dataclass
+class ImportResult:
+    imported: int = 0
+    failed: int = 0
+    errors: List[Tuple[int, str]] = field(default_factory=list)
+
+    def add_error(self, line: int, message: str):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    @property
+    def errors_truncated(self) -> bool:
+        return self.failed > len(self.errors)
+
+def normalize_row(row: Dict) -> MultiDict:
+    """CSV row as form data: trimmed, lower-case enums, unsigned quantity, is_closed as a checkbox value"""
+    data = {name: (row.get(name) or '').strip() for name in REQUIRED_COLUMNS + OPTIONAL_COLUMNS}
+    data['trade_type'] = data['trade_type'].lower()
+    data['action'] = data['action'].lower()
+    data['is_closed'] = 'y' if data['is_closed'].lower() in TRUE_VALUES else ''
+    # The sign comes from the action, as in the Add Trade form; statements (and our export) may sign sells
+    data['quantity'] = data['quantity'].lstrip('-')
+    return MultiDict(data)
+
+def form_errors(form: TradeImportForm) -> str:
+    return '; '.join(f'{name}: {message}' for name, messages in form.errors.items() for message in messages)
+
+def insert_trades(account_id: int, batch: List[Dict]) -> List[int]:
+    """Insert trade values into an account and update the aggregates, change log, journal and
+    data version; returns the new ids in order. Does not commit."""
+    rows = [dict(values, account_id=account_id) for values in batch]
+    # Core insert on the session's connection, without ORM bulk bookkeeping; the new ids come
+    # back in parameter order for the journal
+    ids = db.session.connection().execute(
+        insert(Trade.__table__).returning(Trade.__table__.c.id, sort_by_parameter_order=True), rows).scalars().all()
+    aggregates.apply_trades(Trade(**values) for values in rows)
+    changes.record_change(account_id, changes.RESET)
+    journal.record(account_id, journal.CREATED, zip(ids, rows))
+    cache.bump_data_version(account_id)
+    return ids
+
+def _insert_batch(batch: List[Dict], account_id: int, result: ImportResult):
+    """Add one batch through the app's trade store, in a transaction of its own"""
+    trade_store.get_trade_store().bulk_add(account_id, batch)
+    result.imported += len(batch)
+
+def import_trades_csv(lines: Iterable[str], account_id: int, batch_size: int = 5000,
+                      progress: Optional[Callable[[ImportResult], None]] = None) -> ImportResult:
+    """Validate and insert trades from a broker statement CSV into an account.
+
+    Rows are read one at a time and inserted in batches of batch_size, each in its
+    own transaction, so memory use does not depend on the file size. Rows that
+    fail TradeForm validation are skipped and reported by line number.
+    progress is called with the result so far after each batch is committed.
+    """
+    reader = csv.DictReader(lines)
+    missing = [name for name in REQUIRED_COLUMNS if name not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)}")
+
+    result = ImportResult()
+    batch = []
+    # Binding the form's fields is the expensive part, so one form is re-processed per row
+    form = TradeImportForm(formdata=None)
+    for row in reader:
+        form.process(formdata=normalize_row(row))
+        if not form.validate():
+            result.add_error(reader.line_num, form_errors(form))
+            continue
+
+        batch.append(trade_values_from_form(form))
+        if len(batch) >= batch_size:
+            _insert_batch(batch, account_id, result)
+            batch = []
+            if progress:
+                progress(result)
+
+    if batch:
+        _insert_batch(batch, account_id, result)
+    if progress:
+        progress(result)
+
+    return result
@@ -0,0 +1,286 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+from flask import Flask, current_app
+from sqlalchemy import func, select, update
+from werkzeug.datastructures import FileStorage
+from app import db
+from db_models import Job, JobStatus
+import aggregates
+import cache
+import importer
+import journal
+import sqlite_storage
+import stats_engines
+
+logger = logging.getLogger(__name__)
+
+# Only one executor per process, however many requests submit at once
+_executor_lock = threading.Lock()
+
+class JobCancelled(Exception):
+    """Raised by JobContext.progress once the job has been cancelled"""
+
+class JobContext:
+    """What a running job gets: its account and params, and a way to report progress"""
+
+    def __init__(self, job_id: int, account_id: int, params: Dict):
+        self.job_id = job_id
+        self.account_id = account_id
+        self.params = params
+
+    def progress(self, done: int, total: Optional[int] = None, message: Optional[str] = None):
+        """Record progress in a transaction of its own and raise JobCancelled if the job was cancelled.
+
+        Call it between the job's own transactions: on SQLite it waits for the write lock.
+        """
+        values = {'progress_done': done, 'updated_at': datetime.utcnow()}
+        if total is not None:
+            values['progress_total'] = total
+        if message is not None:
+            values['message'] = message[:255]
+        with db.engine.begin() as connection:
+            result = connection.execute(update(Job)
+                                        .where(Job.id == self.job_id, Job.cancel_requested == False)  # noqa: E712
+                                        .values(**values))
+        if result.rowcount == 0:
+            raise JobCancelled()
+
+@dataclass
+class JobKind:
+    run: Callable[[JobContext], Any]
+    # Takes the SQLite write lock when each transaction begins (sqlite_storage.writes_ahead)
+    writes: bool = False
+    # Reads an uploaded file, kept in JOB_FILES_DIR until the job finishes
+    upload: bool = False
+
+JOB_KINDS: Dict[str, JobKind] = {}
+
+def job_kind(name: str, writes: bool = False, upload: bool = False):
+    """Register a function taking a JobContext as a job kind; it returns the job's JSON result"""
+    def register(run: Callable[[JobContext], Any]):
+        JOB_KINDS[name] = JobKind(run, writes, upload)
+        return run
+    return register
+
+@job_kind('rebuild_aggregates', writes=True)
+def rebuild_aggregates_job(context: JobContext) -> Dict:
+    """Recompute the account's aggregate tables. It is one transaction, so a cancel only
+    stops it before it starts."""
+    context.progress(0, 1, 'Rebuilding aggregates')
+    count = aggregates.rebuild_aggregates(account_id=context.account_id)
+    cache.bump_data_version(context.account_id)
+    db.session.commit()
+    return {'trades': count}
+
+def stats_result(stats: Dict) -> Dict:
+    """Portfolio statistics as JSON: options_positions becomes the option trade count per symbol"""
+    return dict(stats,
+                stock_positions=dict(stats['stock_positions']),
+                options_positions={symbol: len(trades) for symbol, trades in stats['options_positions'].items()})
+
+@job_kind('portfolio_stats')
+def portfolio_stats_job(context: JobContext) -> Dict:
+    """Recompute the account's portfolio statistics from every trade (params: engine, default python)"""
+    engine = context.params.get('engine', 'python')
+    context.progress(0, 1, f'Computing portfolio statistics ({engine})')
+    return stats_result(stats_engines.load_portfolio_stats(context.account_id, engine))
+
+@job_kind('import_trades', writes=True, upload=True)
+def import_trades_job(context: JobContext) -> Dict:
+    """Import a broker statement CSV. Every batch commits on its own, so a cancel keeps the
+    batches already imported."""
+    with open(context.params['upload'], encoding='utf-8-sig', newline='') as f:
+        # Lines rather than rows, which is close enough for a progress bar
+        total = max(sum(1 for _ in f) - 1, 0)
+        f.seek(0)
+        context.progress(0, total, 'Importing trades')
+        result = importer.import_trades_csv(
+            f, context.account_id, batch_size=current_app.config['IMPORT_BATCH_SIZE'],
+            progress=lambda result: context.progress(result.imported + result.failed, total,
+                                                     f'{result.imported} imported, {result.failed} failed'))
+    return {
+        'imported': result.imported,
+        'failed': result.failed,
+        'errors': result.errors,
+        'errors_truncated': result.errors_truncated,
+    }
+
+@job_kind('journal_snapshot')
+def journal_snapshot_job(context: JobContext) -> Dict:
+    """Snapshot the account's trades for point-in-time reconstruction, unless a snapshot
+    taken since the job was queued already covers the events"""
+    context.progress(0, 1, 'Taking a portfolio snapshot')
+    if not journal.snapshot_due(context.account_id, current_app.config['JOURNAL_SNAPSHOT_INTERVAL']):
+        return {'skipped': True}
+    snapshot = journal.take_snapshot(context.account_id)
+    return {'last_event_id': snapshot.last_event_id, 'trades': snapshot.trade_count}
+
+def get_executor() -> ThreadPoolExecutor:
+    """This process's JOB_WORKERS job threads, started by the first job it submits (so after
+    gunicorn forks)"""
+    with _executor_lock:
+        if 'job_executor' not in current_app.extensions:
+            current_app.extensions['job_executor'] = ThreadPoolExecutor(current_app.config['JOB_WORKERS'],
+                                                                        thread_name_prefix='job')
+    return current_app.extensions['job_executor']
+
+def submit_job(kind: str, account_id: int, params: Optional[Dict] = None,
+               upload: Optional[FileStorage] = None) -> Job:
+    """Queue a job for an account and commit, without waiting for it.
+
+    It runs on this process's job threads, or in `flask run-jobs` when JOB_WORKERS is 0.
+    """
+    if kind not in JOB_KINDS:
+        raise ValueError(f'Unknown job kind: {kind}')
+    # The upload path is only ever set here, never taken from the caller
+    params = {name: value for name, value in (params or {}).items() if name != 'upload'}
+    if JOB_KINDS[kind].upload:
+        if upload is None:
+            raise ValueError(f'{kind} needs an uploaded file')
+        directory = current_app.config['JOB_FILES_DIR']
+        os.makedirs(directory, exist_ok=True)
+        params['upload'] = os.path.join(directory, f'{kind}-{uuid.uuid4().hex}')
+        upload.save(params['upload'])
+
+    job = Job(account_id=account_id, kind=kind, params=params)
+    db.session.add(job)
+    db.session.commit()
+    if current_app.config['JOB_WORKERS']:
+        get_executor().submit(run_job, current_app._get_current_object(), job.id)
+    return job
+
+def queue_snapshot_if_due(account_id: int):
+    """Call after a write to the account's trades has committed: queue a journal_snapshot job once
+    JOURNAL_SNAPSHOT_INTERVAL events have been written since the last snapshot, unless one is waiting.
+
+    Ends the transaction it starts, so the caller's next one can write (inside a job that
+    writes ahead, any transaction holds the SQLite write lock).
+    """
+    if journal.snapshot_due(account_id, current_app.config['JOURNAL_SNAPSHOT_INTERVAL']):
+        pending = db.session.execute(select(Job.id)
+                                     .where(Job.account_id == account_id, Job.kind == 'journal_snapshot',
+                                            Job.status.in_([JobStatus.QUEUED, JobStatus.RUNNING]))
+                                     .limit(1)).first()
+        if pending is None:
+            submit_job('journal_snapshot', account_id)
+    db.session.commit()
+
+def get_job(account_id: int, job_id: int) -> Optional[Job]:
+    """The job, if it is the account's"""
+    job = db.session.get(Job, job_id)
+    return job if job is not None and job.account_id == account_id else None
+
+def list_jobs(account_id: int, limit: int = 20) -> List[Job]:
+    """An account's most recent jobs, newest first"""
+    return db.session.execute(select(Job)
+                              .where(Job.account_id == account_id)
+                              .order_by(Job.id.desc())
+                              .limit(limit)).scalars().all()
+
+def _discard_upload(params: Dict):
+    path = params.get('upload')
+    if path and os.path.exists(path):
+        os.remove(path)
+
+def cancel_job(job: Job) -> bool:
+    """Cancel a queued job, or ask a running one to stop at its next progress report, and
+    commit; False if the job had already finished"""
+    now = datetime.utcnow()
+    result = db.session.execute(update(Job)
+                                .where(Job.id == job.id, Job.status == JobStatus.QUEUED)
+                                .values(status=JobStatus.CANCELLED, message='Cancelled',
+                                        updated_at=now, finished_at=now)
+                                .execution_options(synchronize_session=False))
+    queued = result.rowcount == 1
+    if not queued:
+        result = db.session.execute(update(Job)
+                                    .where(Job.id == job.id, Job.status == JobStatus.RUNNING)
+                                    .values(cancel_requested=True, updated_at=now)
+                                    .execution_options(synchronize_session=False))
+    db.session.commit()
+    if queued:
+        _discard_upload(job.params or {})
+    return result.rowcount == 1
+
+def _claim(job_id: int) -> bool:
+    # Whoever moves the job out of queued runs it; another process or thread may have got there first
+    now = datetime.utcnow()
+    result = db.session.execute(update(Job)
+                                .where(Job.id == job_id, Job.status == JobStatus.QUEUED)
+                                .values(status=JobStatus.RUNNING, started_at=now, updated_at=now)
+                                .execution_options(synchronize_session=False))
+    db.session.commit()
+    return result.rowcount == 1
+
+def _finish(job_id: int, status: JobStatus, result: Any = None, error: Optional[str] = None):
+    now = datetime.utcnow()
+    values = {'status': status, 'result': result, 'error': error, 'updated_at': now, 'finished_at': now}
+    if status == JobStatus.SUCCEEDED:
+        values['progress_done'] = func.coalesce(Job.progress_total, Job.progress_done)
+    db.session.execute(update(Job).where(Job.id == job_id).values(**values)
+                       .execution_options(synchronize_session=False))
+    db.session.commit()
+
+def run_job(app: Flask, job_id: int) -> bool:
+    """Claim a queued job and run it to the end in an app context of its own; False if it
+    was no longer queued"""
+    with app.app_context():
+        if not _claim(job_id):
+            return False
+        job = db.session.get(Job, job_id)
+        name, context = job.kind, JobContext(job.id, job.account_id, job.params or {})
+        db.session.commit()
+        try:
+            kind = JOB_KINDS.get(name)
+            if kind is None:
+                raise ValueError(f'Unknown job kind: {name}')
+            if kind.writes:
+                sqlite_storage.writes_ahead()
+            result = kind.run(context)
+        except JobCancelled:
+            db.session.rollback()
+            _finish(job_id, JobStatus.CANCELLED)
+        except Exception as e:
+            db.session.rollback()
+            logger.exception(f'Job {job_id} ({name}) failed')
+            _finish(job_id, JobStatus.FAILED, error=str(e))
+        else:
+            # A read the job left open can't be turned into a write on SQLite, so it ends first
+            db.session.commit()
+            _finish(job_id, JobStatus.SUCCEEDED, result=result)
+        finally:
+            _discard_upload(context.params)
+    return True
+
+def next_queued_job() -> Optional[int]:
+    """Id of the oldest queued job, from ix_jobs_status_id"""
+    return db.session.execute(select(Job.id)
+                              .where(Job.status == JobStatus.QUEUED)
+                              .order_by(Job.id)
+                              .limit(1)).scalar()
+
+def work(app: Flask, poll_interval: float, once: bool = False) -> int:
+    """Run queued jobs one at a time, checking for new ones every poll_interval seconds; with
+    once, return when the queue is empty. Returns the number of jobs run."""
+    count = 0
+    while True:
+        with app.app_context():
+            job_id = next_queued_job()
+        if job_id is None:
+            if once:
+                return count
+            time.sleep(poll_interval)
+            continue
+        try:
+            count += run_job(app, job_id)
+        except Exception as e:
+            # The job stays running if its status couldn't be written; the next one is tried
+            logger.warning(f'Job {job_id} could not be run: {e}')
+            time.sleep(poll_interval)
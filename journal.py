@@ -0,0 +1,223 @@
+import enum
+import json
+import zlib
+from bisect import bisect_right
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import Date, Enum, func, insert, select
+from app import db
+from db_models import Trade, TradeEvent, PortfolioSnapshot
+import accounts
+
+CREATED = 'created'
+UPDATED = 'updated'
+DELETED = 'deleted'
+
+# The trade columns the journal keeps; the id and account are the event's own
+JOURNAL_COLUMNS = ['symbol', 'trade_type', 'action', 'quantity', 'price', 'date', 'strike_price',
+                   'expiration_date', 'premium', 'fees', 'is_closed', 'closed_date', 'close_price',
+                   'close_quantity', 'notes']
+
+# An account's trades by id, each as its journal columns in JSON form
+State = Dict[int, Dict]
+
+@dataclass
+class PointInTime:
+    """An account's trades as they were at a point in time, and what it took to rebuild them"""
+    at: datetime
+    trades: List[Trade]
+    snapshot_taken_at: Optional[datetime]
+    events_replayed: int
+
+def encode_values(values: Dict) -> Dict:
+    """Journal columns of trade values in JSON form (enums by value, ISO dates); other keys are dropped"""
+    encoded = {}
+    for name in JOURNAL_COLUMNS:
+        if name in values:
+            value = values[name]
+            if isinstance(value, enum.Enum):
+                value = value.value
+            elif isinstance(value, date):
+                value = value.isoformat()
+            encoded[name] = value
+    return encoded
+
+def decode_values(values: Dict) -> Dict:
+    """Trade column values back from encode_values"""
+    decoded = {}
+    for name, value in values.items():
+        column_type = Trade.__table__.c[name].type
+        if value is not None and isinstance(column_type, Date):
+            value = date.fromisoformat(value)
+        elif value is not None and isinstance(column_type, Enum):
+            value = column_type.enum_class(value)
+        decoded[name] = value
+    return decoded
+
+def trade_values(trade: Trade) -> Dict:
+    return {name: getattr(trade, name) for name in JOURNAL_COLUMNS}
+
+def record(account_id: int, kind: str, events: Iterable[Tuple[int, Optional[Dict]]]):
+    """Append events to the journal: (trade id, column values) for each trade, values None
+    for deletes. Call in the same transaction as the writes; does not commit.
+
+    The account stays locked until the transaction ends, so its events get their ids in
+    commit order and a snapshot never sees a later id commit before an earlier one.
+    """
+    now = datetime.utcnow()
+    rows = [{'account_id': account_id, 'trade_id': trade_id, 'kind': kind, 'created_at': now,
+             'data': encode_values(values) if values is not None else None}
+            for trade_id, values in events]
+    if rows:
+        accounts.lock_account(account_id)
+        db.session.execute(insert(TradeEvent), rows)
+
+def apply_event(state: State, kind: str, trade_id: int, data: Optional[Dict]):
+    if kind == DELETED:
+        state.pop(trade_id, None)
+    elif kind == CREATED:
+        state[trade_id] = dict(data)
+    elif trade_id in state:
+        state[trade_id] = dict(state[trade_id], **data)
+
+def pack_state(state: State) -> bytes:
+    """A state as compressed JSON rows, column names once"""
+    rows = [[trade_id] + [values.get(name) for name in JOURNAL_COLUMNS] for trade_id, values in state.items()]
+    return zlib.compress(json.dumps({'columns': JOURNAL_COLUMNS, 'trades': rows}, separators=(',', ':')).encode())
+
+def unpack_state(packed: bytes) -> State:
+    data = json.loads(zlib.decompress(packed))
+    return {row[0]: dict(zip(data['columns'], row[1:])) for row in data['trades']}
+
+def state_trades(account_id: int, state: State) -> List[Trade]:
+    """Detached Trade objects for a state, for calculate_portfolio_stats"""
+    return [Trade(id=trade_id, account_id=account_id, **decode_values(values)) for trade_id, values in state.items()]
+
+def current_state(account_id: int) -> State:
+    """An account's trades as they are now, read from the trades table"""
+    table = Trade.__table__
+    rows = db.session.execute(select(table.c.id, *[table.c[name] for name in JOURNAL_COLUMNS])
+                              .where(table.c.account_id == account_id))
+    return {row[0]: encode_values(dict(zip(JOURNAL_COLUMNS, row[1:]))) for row in rows}
+
+def snapshot_due(account_id: int, interval: int) -> bool:
+    """True once an account has interval events since its latest snapshot"""
+    last = db.session.execute(select(func.coalesce(func.max(PortfolioSnapshot.last_event_id), 0))
+                              .where(PortfolioSnapshot.account_id == account_id)).scalar()
+    newest = db.session.execute(select(func.coalesce(func.max(TradeEvent.id), 0))
+                                .where(TradeEvent.account_id == account_id)).scalar()
+    # Event ids are shared by every account, so the gap bounds this account's count from above
+    if newest - last < interval:
+        return False
+    tail = (select(TradeEvent.id)
+            .where(TradeEvent.account_id == account_id, TradeEvent.id > last)
+            .limit(interval)
+            .subquery())
+    return db.session.execute(select(func.count()).select_from(tail)).scalar() >= interval
+
+def take_snapshot(account_id: int, baseline: bool = False) -> PortfolioSnapshot:
+    """Snapshot an account's trades and commit.
+
+    The trades and the latest event id are read in one transaction holding the account's
+    lock, which every writer takes before adding its events. No event of the account can
+    commit between the two reads, so the snapshot is exactly the state those events leave.
+    It is written in a transaction of its own, so writers only wait for the reads.
+    """
+    taken_at = datetime.utcnow()
+    accounts.lock_account(account_id)
+    last_event_id = db.session.execute(select(func.coalesce(func.max(TradeEvent.id), 0))
+                                       .where(TradeEvent.account_id == account_id)).scalar()
+    state = current_state(account_id)
+    db.session.rollback()
+    snapshot = PortfolioSnapshot(account_id=account_id, last_event_id=last_event_id, taken_at=taken_at,
+                                 trade_count=len(state), baseline=baseline, state=pack_state(state))
+    db.session.add(snapshot)
+    db.session.commit()
+    return snapshot
+
+def needs_baseline(changes: List[str]) -> bool:
+    """True if a schema.migrate run created the journal, which then knows nothing of the
+    trades already in the database"""
+    return f'create table {TradeEvent.__tablename__}' in changes
+
+def take_baselines() -> int:
+    """Snapshot every account that has trades as its baseline, the start of its history; returns
+    the number of trades they hold"""
+    count = 0
+    for account_id in accounts.account_ids():
+        if db.session.execute(select(Trade.id).where(Trade.account_id == account_id).limit(1)).first():
+            count += take_snapshot(account_id, baseline=True).trade_count
+    return count
+
+def portfolio_at(account_id: int, at: datetime) -> Optional[PointInTime]:
+    """An account's trades at a point in time (UTC): the latest snapshot taken by then, plus
+    the events after it up to then. None if at is before the account's baseline snapshot.
+
+    An account's event ids follow commit order (record holds the account's lock until
+    commit), so the events after the snapshot's last id are exactly the ones it lacks.
+    """
+    snapshot = db.session.execute(select(PortfolioSnapshot)
+                                  .where(PortfolioSnapshot.account_id == account_id,
+                                         PortfolioSnapshot.taken_at <= at)
+                                  .order_by(PortfolioSnapshot.taken_at.desc(), PortfolioSnapshot.id.desc())
+                                  .limit(1)).scalar()
+    if snapshot is None:
+        baseline = db.session.execute(select(PortfolioSnapshot.id)
+                                      .where(PortfolioSnapshot.account_id == account_id,
+                                             PortfolioSnapshot.baseline == True)  # noqa: E712
+                                      .limit(1)).first()
+        if baseline:
+            return None
+        state, after = {}, 0
+    else:
+        state, after = unpack_state(snapshot.state), snapshot.last_event_id
+
+    events = db.session.execute(select(TradeEvent.kind, TradeEvent.trade_id, TradeEvent.data)
+                                .where(TradeEvent.account_id == account_id,
+                                       TradeEvent.id > after,
+                                       TradeEvent.created_at <= at)
+                                .order_by(TradeEvent.id))
+    replayed = 0
+    for kind, trade_id, data in events:
+        apply_event(state, kind, trade_id, data)
+        replayed += 1
+    return PointInTime(at, state_trades(account_id, state), snapshot.taken_at if snapshot else None, replayed)
+
+class MemoryJournal:
+    """The journal of a MemoryTradeStore: each account's events in a list, with a copy of
+    its state every interval events"""
+
+    def __init__(self):
+        self._events: Dict[int, List[Tuple[datetime, str, int, Optional[Dict]]]] = {}
+        # (taken at, number of events included, state) per account, oldest first
+        self._snapshots: Dict[int, List[Tuple[datetime, int, State]]] = {}
+        self._states: Dict[int, State] = {}
+
+    def record(self, account_id: int, kind: str, events: Iterable[Tuple[int, Optional[Dict]]], interval: int):
+        log = self._events.setdefault(account_id, [])
+        state = self._states.setdefault(account_id, {})
+        now = datetime.utcnow()
+        for trade_id, values in events:
+            data = encode_values(values) if values is not None else None
+            log.append((now, kind, trade_id, data))
+            apply_event(state, kind, trade_id, data)
+        snapshots = self._snapshots.setdefault(account_id, [])
+        if len(log) - (snapshots[-1][1] if snapshots else 0) >= interval:
+            snapshots.append((now, len(log), {trade_id: dict(values) for trade_id, values in state.items()}))
+
+    def portfolio_at(self, account_id: int, at: datetime) -> PointInTime:
+        snapshots = self._snapshots.get(account_id, [])
+        found = bisect_right([taken_at for taken_at, _, _ in snapshots], at)
+        if found:
+            taken_at, start, snapshot = snapshots[found - 1]
+            state = {trade_id: dict(values) for trade_id, values in snapshot.items()}
+        else:
+            taken_at, start, state = None, 0, {}
+        replayed = 0
+        for created_at, kind, trade_id, data in self._events.get(account_id, [])[start:]:
+            if created_at > at:
+                break
+            apply_event(state, kind, trade_id, data)
+            replayed += 1
+        return PointInTime(at, state_trades(account_id, state), taken_at, replayed)
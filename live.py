@@ -0,0 +1,93 @@
+import json
+import time
+from typing import Dict, Iterator, List, Optional
+from flask import current_app
+from forms import FilterForm
+import cache
+import changes
+
+# How long the browser waits before reconnecting once a stream ends
+RECONNECT_MILLISECONDS = 2000
+
+def sse(event: str, data, event_id: Optional[int] = None) -> str:
+    """One server-sent event; the id is what the browser sends back as Last-Event-ID"""
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data, separators=(",", ":"))}')
+    return '\n'.join(lines) + '\n\n'
+
+def stats_summary(stats: Dict) -> Dict:
+    """The numeric fields of the portfolio statistics, which the summary cards show"""
+    return {name: value for name, value in stats.items() if isinstance(value, (int, float))}
+
+def trade_events(store, account_id: int, filter_form: FilterForm, changed: List) -> List[Dict]:
+    """What a dashboard needs to patch its table for some changes: each changed trade's new
+    row if it passes the page's filters, else its removal"""
+    if any(change.change == changes.RESET for change in changed):
+        return [{'change': changes.RESET}]
+    # Only the last change to a trade matters
+    latest = {change.trade_id: change.change for change in changed}
+    live_ids = [trade_id for trade_id, change in latest.items() if change != changes.DELETED]
+    shown = {trade.id: trade for trade in store.changed_trades(account_id, filter_form, live_ids)} if live_ids else {}
+    events = []
+    for trade_id in latest:
+        trade = shown.get(trade_id)
+        if trade is None:
+            events.append({'change': 'remove', 'trade_id': trade_id})
+        else:
+            events.append({'change': 'upsert', 'trade_id': trade_id, 'date': trade.date.isoformat(),
+                           'html': str(cache.trade_row(trade))})
+    return events
+
+def dashboard_events(store, account_id: int, filter_form: FilterForm, since: Optional[int],
+                     version: Optional[int]) -> Iterator[str]:
+    """Server-sent events for one open dashboard until STREAM_MAX_SECONDS have passed.
+
+    since is the last change the page has seen and version the data version its
+    stats were computed at. Every STREAM_POLL_INTERVAL seconds the data version is
+    read; when it has moved, the account's changes since the last one sent go out
+    as trade events, followed by the summary fields that changed. The stats come
+    from the same cache entry as the dashboard, so open dashboards add one
+    computation per write per worker, not one per page.
+    """
+    config = current_app.config
+    engine = config['PORTFOLIO_STATS_ENGINE']
+    started = last_sent = time.monotonic()
+    yield f'retry: {RECONNECT_MILLISECONDS}\n\n'
+
+    def summary():
+        return stats_summary(cache.cached('portfolio_stats', lambda: store.portfolio_stats(account_id), engine))
+
+    last_id = store.last_change_id(account_id) if since is None else since
+    current = cache.reload_data_version()
+    # Stats the page already shows, so the first write only sends the fields it changed
+    sent = summary() if version == current else None
+    while True:
+        if current != version:
+            changed = store.changes_since(account_id, last_id)
+            if changed is None:
+                last_id = store.last_change_id(account_id)
+                yield sse('trade', {'change': changes.RESET}, last_id)
+            elif changed:
+                last_id = changed[-1].id
+                for event in trade_events(store, account_id, filter_form, changed):
+                    yield sse('trade', event, last_id)
+            stats = summary()
+            delta = {name: value for name, value in stats.items() if sent is None or sent.get(name) != value}
+            if delta:
+                yield sse('stats', {'version': current, 'stats': delta}, last_id)
+            sent, version = stats, current
+            last_sent = time.monotonic()
+        # Ends the read, so the next check sees new writes and the connection goes back to the pool
+        store.rollback()
+
+        now = time.monotonic()
+        if now - started >= config['STREAM_MAX_SECONDS']:
+            return
+        if now - last_sent >= config['STREAM_HEARTBEAT_SECONDS']:
+            # A comment line keeps proxies from closing an idle stream
+            yield ': keepalive\n\n'
+            last_sent = now
+        time.sleep(config['STREAM_POLL_INTERVAL'])
+        current = cache.reload_data_version()
@@ -0,0 +1,337 @@
+import heapq
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from sqlalchemy import select
+from app import db
+from db_models import Trade, TradeType, TradeAction
+
+MATCH_METHODS = ['fifo', 'lifo']
+
+# Lots chosen for closing trades: close trade id -> lot ids (opening trade ids), taken in order
+Selections = Dict[int, List[int]]
+
+# Side of a lot: bought to open or sold to open
+LONG = 1
+SHORT = -1
+
+# (symbol, trade type, strike, expiration); stocks have no strike or expiration
+ContractKey = Tuple[str, str, Optional[float], Optional[date]]
+
+@dataclass(slots=True)
+class Execution:
+    """One fill: opens a lot on `side`, or closes lots on `side`"""
+    trade_id: int
+    contract: ContractKey
+    date: date
+    opening: bool
+    side: int
+    quantity: int
+    price: float
+    fees: float = 0.0
+    multiplier: int = 1
+    # Close these lots first, in order (specific-lot matching)
+    lot_ids: Optional[List[int]] = None
+
+@dataclass(slots=True)
+class Lot:
+    lot_id: int
+    contract: ContractKey
+    side: int
+    open_date: date
+    open_price: float
+    quantity: int
+    original_quantity: int
+    fees_per_unit: float
+    multiplier: int
+
+    def to_dict(self) -> Dict:
+        return {
+            'lot_id': self.lot_id,
+            'contract': contract_dict(self.contract),
+            'side': 'long' if self.side == LONG else 'short',
+            'open_date': self.open_date.isoformat(),
+            'open_price': self.open_price,
+            'quantity': self.quantity,
+            'original_quantity': self.original_quantity,
+        }
+
+@dataclass(slots=True)
+class Match:
+    """Part of a lot closed by one execution"""
+    lot_id: int
+    close_trade_id: int
+    contract: ContractKey
+    side: int
+    quantity: int
+    open_date: date
+    close_date: date
+    open_price: float
+    close_price: float
+    realized_pnl: float
+
+    def to_dict(self) -> Dict:
+        return {
+            'lot_id': self.lot_id,
+            'close_trade_id': self.close_trade_id,
+            'contract': contract_dict(self.contract),
+            'side': 'long' if self.side == LONG else 'short',
+            'quantity': self.quantity,
+            'open_date': self.open_date.isoformat(),
+            'close_date': self.close_date.isoformat(),
+            'open_price': self.open_price,
+            'close_price': self.close_price,
+            'realized_pnl': self.realized_pnl,
+        }
+
+def contract_dict(contract: ContractKey) -> Dict:
+    symbol, trade_type, strike_price, expiration_date = contract
+    return {
+        'symbol': symbol,
+        'trade_type': trade_type,
+        'strike_price': strike_price,
+        'expiration_date': expiration_date.isoformat() if expiration_date else None,
+    }
+
+class LotBook:
+    """Open lots per contract and side, matched FIFO or LIFO unless specific lots are given.
+
+    Each (contract, side) keeps its lots in a heap ordered by the matching
+    method, so opening a lot or closing against the next one is O(log n).
+    Lots emptied by a specific-lot close stay in the heap with zero quantity
+    and are skipped when they reach the top.
+
+    selections names the lots a closing trade takes first; whatever they don't
+    cover is matched by the method. A selected lot that isn't open for that
+    contract and side when the trade closes raises ValueError.
+    """
+
+    def __init__(self, method: str = 'fifo', keep_matches: bool = True, selections: Optional[Selections] = None):
+        if method not in MATCH_METHODS:
+            raise ValueError(f'Unknown lot matching method: {method}')
+        self.method = method
+        self.keep_matches = keep_matches
+        self.selections = selections or {}
+        # Selections not yet applied, and the lots closed so far (only tracked with selections)
+        self._unapplied = set(self.selections)
+        self._exhausted = set()
+        self.matches: List[Match] = []
+        self.realized_pnl: Dict[ContractKey, float] = defaultdict(float)
+        # (trade id, quantity) of closes that found no open lot
+        self.unmatched: List[Tuple[int, int]] = []
+        self.executions = 0
+        self._heaps: Dict[Tuple[ContractKey, int], list] = {}
+        self._lots: Dict[int, Lot] = {}
+        self._seq = 0
+
+    def apply(self, execution: Execution) -> List[Match]:
+        """Apply one execution; returns the matches it produced"""
+        self.executions += 1
+        if execution.opening:
+            self._open(execution)
+            return []
+        return self._close(execution)
+
+    def apply_all(self, executions: Iterable[Execution]) -> 'LotBook':
+        for execution in executions:
+            self.apply(execution)
+        if self._unapplied:
+            raise ValueError(f'Lots were selected for trades that close nothing here: '
+                             f'{", ".join(str(trade_id) for trade_id in sorted(self._unapplied))}')
+        return self
+
+    def _selected_lots(self, execution: Execution) -> List[int]:
+        """The lots selected for a closing trade, checked against the book as it closes"""
+        self._unapplied.discard(execution.trade_id)
+        lot_ids = self.selections[execution.trade_id]
+        if len(set(lot_ids)) != len(lot_ids):
+            raise ValueError(f'Trade {execution.trade_id}: a lot is selected more than once')
+        for lot_id in lot_ids:
+            lot = self._lots.get(lot_id)
+            if lot_id in self._exhausted:
+                raise ValueError(f'Trade {execution.trade_id}: lot {lot_id} is already closed')
+            if lot is None:
+                raise ValueError(f'Trade {execution.trade_id}: lot {lot_id} is not an open lot')
+            if lot.contract != execution.contract or lot.side != execution.side:
+                raise ValueError(f'Trade {execution.trade_id}: lot {lot_id} is another contract or side')
+        return lot_ids
+
+    def _open(self, execution: Execution):
+        lot = Lot(lot_id=execution.trade_id,
+                  contract=execution.contract,
+                  side=execution.side,
+                  open_date=execution.date,
+                  open_price=execution.price,
+                  quantity=execution.quantity,
+                  original_quantity=execution.quantity,
+                  fees_per_unit=execution.fees / execution.quantity if execution.quantity else 0.0,
+                  multiplier=execution.multiplier)
+        self._lots[lot.lot_id] = lot
+
+        self._seq += 1
+        day = execution.date.toordinal()
+        entry = (day, self._seq, lot) if self.method == 'fifo' else (-day, -self._seq, lot)
+        heapq.heappush(self._heaps.setdefault((execution.contract, execution.side), []), entry)
+
+    def _close(self, execution: Execution) -> List[Match]:
+        remaining = execution.quantity
+        fees_per_unit = execution.fees / execution.quantity if execution.quantity else 0.0
+        matches = []
+
+        # A close recorded on its opening row names its own lot; other closes may have selections
+        lot_ids = execution.lot_ids
+        if lot_ids is None and execution.trade_id in self.selections:
+            lot_ids = self._selected_lots(execution)
+        for lot_id in lot_ids or []:
+            lot = self._lots.get(lot_id)
+            if remaining and lot and lot.contract == execution.contract and lot.side == execution.side:
+                matches.append(self._take(lot, execution, min(remaining, lot.quantity), fees_per_unit))
+                remaining -= matches[-1].quantity
+
+        heap = self._heaps.get((execution.contract, execution.side))
+        while remaining and heap:
+            lot = heap[0][2]
+            if lot.quantity:
+                matches.append(self._take(lot, execution, min(remaining, lot.quantity), fees_per_unit))
+                remaining -= matches[-1].quantity
+            if not lot.quantity:
+                heapq.heappop(heap)
+
+        if remaining:
+            self.unmatched.append((execution.trade_id, remaining))
+        if self.keep_matches:
+            self.matches.extend(matches)
+        return matches
+
+    def _take(self, lot: Lot, execution: Execution, quantity: int, close_fees_per_unit: float) -> Match:
+        """Close quantity units of a lot"""
+        gross = (execution.price - lot.open_price) * quantity * lot.multiplier * lot.side
+        pnl = gross - (lot.fees_per_unit + close_fees_per_unit) * quantity
+        lot.quantity -= quantity
+        if not lot.quantity:
+            del self._lots[lot.lot_id]
+            if self.selections:
+                self._exhausted.add(lot.lot_id)
+        self.realized_pnl[lot.contract] += pnl
+        return Match(lot_id=lot.lot_id,
+                     close_trade_id=execution.trade_id,
+                     contract=lot.contract,
+                     side=lot.side,
+                     quantity=quantity,
+                     open_date=lot.open_date,
+                     close_date=execution.date,
+                     open_price=lot.open_price,
+                     close_price=execution.price,
+                     realized_pnl=pnl)
+
+    def open_lots(self, contract: Optional[ContractKey] = None) -> List[Lot]:
+        """Open lots in matching order, for one contract or all of them"""
+        lots = []
+        for (key, side), heap in self._heaps.items():
+            if contract is None or key == contract:
+                lots.extend(entry[2] for entry in sorted(heap) if entry[2].quantity)
+        return lots
+
+    @property
+    def total_realized_pnl(self) -> float:
+        return sum(self.realized_pnl.values())
+
+def _execution_side(action: TradeAction) -> Tuple[bool, int]:
+    """(opening, side of the lots affected) for a trade action"""
+    if action == TradeAction.BUY_TO_OPEN:
+        return True, LONG
+    if action == TradeAction.SELL_TO_OPEN:
+        return True, SHORT
+    if action == TradeAction.SELL_TO_CLOSE:
+        return False, LONG
+    return False, SHORT
+
+def executions_from_trade(trade) -> List[Execution]:
+    """Executions for a trade row (a Trade or a row with the same columns).
+
+    A row that opens a position and carries its own close fields also yields a
+    closing execution for that specific lot on its closed date.
+    """
+    is_option = trade.trade_type != TradeType.STOCK
+    if is_option:
+        contract = (trade.symbol, trade.trade_type.value, trade.strike_price, trade.expiration_date)
+    else:
+        contract = (trade.symbol, TradeType.STOCK.value, None, None)
+    multiplier = 100 if is_option else 1
+    opening, side = _execution_side(trade.action)
+
+    executions = [Execution(trade_id=trade.id,
+                            contract=contract,
+                            date=trade.date,
+                            opening=opening,
+                            side=side,
+                            quantity=abs(trade.quantity),
+                            price=trade.price,
+                            fees=trade.fees or 0.0,
+                            multiplier=multiplier)]
+
+    if opening and trade.is_closed and trade.close_price is not None and trade.close_quantity:
+        executions.append(Execution(trade_id=trade.id,
+                                    contract=contract,
+                                    date=trade.closed_date or trade.date,
+                                    opening=False,
+                                    side=side,
+                                    quantity=abs(trade.close_quantity),
+                                    price=trade.close_price,
+                                    multiplier=multiplier,
+                                    lot_ids=[trade.id]))
+    return executions
+
+def executions_in_order(trades: Iterable) -> Iterator[Execution]:
+    """Executions in (date, trade id) order from trades (or trade rows) in that order.
+
+    Closes recorded on an opening row are held back until the stream reaches
+    their closed date, so only those pending closes are kept in memory.
+    """
+    pending = []
+    for trade in trades:
+        opening, *closes = executions_from_trade(trade)
+        while pending and (pending[0][0], pending[0][1]) < (opening.date, opening.trade_id):
+            yield heapq.heappop(pending)[2]
+        yield opening
+        for close in closes:
+            heapq.heappush(pending, (close.date, close.trade_id, close))
+
+    while pending:
+        yield heapq.heappop(pending)[2]
+
+def iter_executions(query=None, batch_size: int = 10000) -> Iterator[Execution]:
+    """Executions in (date, trade id) order, streamed from the trades table"""
+    if query is None:
+        query = select(Trade.id, Trade.symbol, Trade.trade_type, Trade.action, Trade.quantity,
+                       Trade.price, Trade.date, Trade.strike_price, Trade.expiration_date, Trade.fees,
+                       Trade.is_closed, Trade.closed_date, Trade.close_price, Trade.close_quantity)
+    query = query.order_by(Trade.date, Trade.id).execution_options(yield_per=batch_size)
+    return executions_in_order(db.session.execute(query))
+
+def parse_selections(specs: Iterable[str]) -> Selections:
+    """Selections from CLOSE:LOT[,LOT...] strings, e.g. "105:12,14" (trade 105 closes lots 12 then 14)"""
+    selections = {}
+    for spec in specs:
+        try:
+            close_id, lot_ids = spec.split(':')
+            close_id = int(close_id)
+            lot_ids = [int(lot_id) for lot_id in lot_ids.split(',')]
+        except ValueError:
+            raise ValueError(f'Lot selection must be CLOSE_TRADE_ID:LOT_ID[,LOT_ID...], not {spec!r}')
+        if close_id in selections:
+            raise ValueError(f'Lots are selected twice for trade {close_id}')
+        selections[close_id] = lot_ids
+    return selections
+
+def build_lot_book(account_id: int, method: str = 'fifo', symbol: Optional[str] = None,
+                   keep_matches: bool = True, selections: Optional[Selections] = None) -> LotBook:
+    """LotBook for all of an account's trades, or for one symbol, with any specific lots selected"""
+    query = select(Trade.id, Trade.symbol, Trade.trade_type, Trade.action, Trade.quantity,
+                   Trade.price, Trade.date, Trade.strike_price, Trade.expiration_date, Trade.fees,
+                   Trade.is_closed, Trade.closed_date, Trade.close_price, Trade.close_quantity) \
+        .where(Trade.account_id == account_id)
+    if symbol:
+        query = query.where(Trade.symbol == symbol.upper())
+    return LotBook(method, keep_matches=keep_matches, selections=selections).apply_all(iter_executions(query))
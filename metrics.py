@@ -0,0 +1,193 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+from flask import Flask, g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PREFIX = 'tradingtracker'
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+SQL_COUNT_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100, 200]
+
+# Open for minutes by design (the dashboard stream): counted, but kept out of latency and slow logs
+UNTIMED_ENDPOINTS = {'main.stream'}
+
+logger = logging.getLogger(__name__)
+
+class Histogram:
+    """Prometheus-style histogram: observation counts per upper bound, plus sum and count"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        # Counts are per bucket here and made cumulative when rendered
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class MetricsRegistry:
+    """Per-process request metrics, labelled by endpoint and method"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        self.sql_statements: Dict[Tuple[str, str], Histogram] = {}
+        self.requests: Dict[Tuple[str, str, int], int] = {}
+        self.sql_seconds: Dict[Tuple[str, str], float] = {}
+        self.template_seconds: Dict[Tuple[str, str], float] = {}
+        self.rows_hydrated: Dict[Tuple[str, str], int] = {}
+
+    def record(self, endpoint: str, method: str, status: int, state: 'RequestMetrics',
+               duration: Optional[float]):
+        key = (endpoint, method)
+        with self._lock:
+            if duration is not None:
+                self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(duration)
+            self.sql_statements.setdefault(key, Histogram(SQL_COUNT_BUCKETS)).observe(state.sql_count)
+            self.requests[key + (status,)] = self.requests.get(key + (status,), 0) + 1
+            self.sql_seconds[key] = self.sql_seconds.get(key, 0.0) + state.sql_seconds
+            self.template_seconds[key] = self.template_seconds.get(key, 0.0) + state.template_seconds
+            self.rows_hydrated[key] = self.rows_hydrated.get(key, 0) + state.rows_hydrated
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            _histogram_lines(lines, 'request_duration_seconds', 'Request latency', self.latency)
+            _histogram_lines(lines, 'request_sql_statements', 'SQL statements per request', self.sql_statements)
+            _counter_lines(lines, 'requests_total', 'Requests by endpoint, method and status', self.requests,
+                           ['endpoint', 'method', 'status'])
+            _counter_lines(lines, 'sql_seconds_total', 'Time spent executing SQL', self.sql_seconds)
+            _counter_lines(lines, 'template_seconds_total', 'Time spent rendering templates, excluding SQL',
+                           self.template_seconds)
+            _counter_lines(lines, 'rows_hydrated_total', 'ORM objects loaded from query results',
+                           self.rows_hydrated)
+        return '\n'.join(lines) + '\n'
+
+def _labels(names: Sequence[str], values: Sequence) -> str:
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return ','.join(pairs)
+
+def _histogram_lines(lines: List[str], name: str, help_text: str, histograms: Dict):
+    name = f'{PREFIX}_{name}'
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for key, histogram in sorted(histograms.items()):
+        labels = _labels(['endpoint', 'method'], key)
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + ['+Inf'], histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+        lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+def _counter_lines(lines: List[str], name: str, help_text: str, values: Dict,
+                   label_names: Sequence[str] = ('endpoint', 'method')):
+    name = f'{PREFIX}_{name}'
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} counter')
+    for key, value in sorted(values.items()):
+        lines.append(f'{name}{{{_labels(label_names, key)}}} {value}')
+
+class RequestMetrics:
+    """Counters for the current request, kept in g"""
+
+    __slots__ = ['started', 'sql_count', 'sql_seconds', 'template_seconds', 'rows_hydrated',
+                 '_template_starts']
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.rows_hydrated = 0
+        self._template_starts = []
+
+def _current() -> Optional[RequestMetrics]:
+    if has_request_context():
+        return g.get('request_metrics')
+    return None
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the statement's own context, so one that fails (with no after event) leaves nothing behind
+    context.metrics_query_start = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    state = _current()
+    if state is not None:
+        state.sql_count += 1
+        state.sql_seconds += time.perf_counter() - context.metrics_query_start
+
+def _on_load(target, context):
+    state = _current()
+    if state is not None:
+        state.rows_hydrated += 1
+
+def _before_render(sender, template, context, **extra):
+    state = _current()
+    if state is not None:
+        # SQL run while rendering (lazy trade pages) is counted as SQL, not template time
+        state._template_starts.append((time.perf_counter(), state.sql_seconds))
+
+def _after_render(sender, template, context, **extra):
+    state = _current()
+    if state is not None and state._template_starts:
+        started, sql_before = state._template_starts.pop()
+        state.template_seconds += time.perf_counter() - started - (state.sql_seconds - sql_before)
+
+def get_registry(app: Flask) -> MetricsRegistry:
+    return app.extensions['metrics']
+
+def init_app(app: Flask, model_base):
+    """Record request metrics if METRICS_ENABLED; model_base is the declarative base of the ORM models"""
+    if not app.config['METRICS_ENABLED']:
+        return
+    registry = app.extensions['metrics'] = MetricsRegistry()
+    slow_seconds = app.config['SLOW_REQUEST_SECONDS']
+
+    # Global listeners, shared by every app in the process; they only count inside a request
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(model_base, 'load', _on_load, propagate=True)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+    @app.before_request
+    def start_request_metrics():
+        g.request_metrics = RequestMetrics()
+
+    @app.after_request
+    def record_on_close(response):
+        state = _current()
+        if state is None:
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        method = request.method
+        path = request.full_path.rstrip('?')
+        status = response.status_code
+
+        # Closing happens after the last byte is sent, so streamed pages are timed to the end
+        def record():
+            if endpoint in UNTIMED_ENDPOINTS:
+                registry.record(endpoint, method, status, state, None)
+                return
+            duration = time.perf_counter() - state.started
+            registry.record(endpoint, method, status, state, duration)
+            if slow_seconds and duration >= slow_seconds:
+                logger.warning(f'Slow request {method} {path} {status} {duration:.3f}s: '
+                               f'{state.sql_count} SQL statements ({state.sql_seconds:.3f}s), '
+                               f'template {state.template_seconds:.3f}s, {state.rows_hydrated} rows hydrated')
+
+        response.call_on_close(record)
+        return response
@@ -1,5 +1,7 @@
+from bisect import bisect_left, insort
 from datetime import datetime
-from typing import Dict, List, Optional
+from heapq import merge
+from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass, field
 from enum import Enum
 
@@ -80,100 +82,274 @@ class Trade:
             'is_expired': self.is_expired
         }
 
+class SortedKeys:
+    """Sorted list of (date, id) keys split into buckets of at most 2 * BUCKET_SIZE.
+
+    Inserting or removing a key bisects the bucket maxima and then one bucket,
+    so it never shifts more than one bucket's worth of keys.
+    """
+    
+    BUCKET_SIZE = 1000
+    
+    def __init__(self):
+        self._buckets: List[List[Tuple]] = []
+        self._maxes: List[Tuple] = []
+        self._len = 0
+    
+    def __len__(self) -> int:
+        return self._len
+    
+    def add(self, key: Tuple):
+        self._len += 1
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            return
+        index = min(bisect_left(self._maxes, key), len(self._buckets) - 1)
+        bucket = self._buckets[index]
+        insort(bucket, key)
+        self._maxes[index] = bucket[-1]
+        if len(bucket) > 2 * self.BUCKET_SIZE:
+            self._buckets[index:index + 1] = [bucket[:self.BUCKET_SIZE], bucket[self.BUCKET_SIZE:]]
+            self._maxes[index:index + 1] = [bucket[self.BUCKET_SIZE - 1], bucket[-1]]
+    
+    def remove(self, key: Tuple):
+        index = bisect_left(self._maxes, key)
+        bucket = self._buckets[index]
+        del bucket[bisect_left(bucket, key)]
+        self._len -= 1
+        if bucket:
+            self._maxes[index] = bucket[-1]
+        else:
+            del self._buckets[index]
+            del self._maxes[index]
+    
+    def first(self) -> Optional[Tuple]:
+        return self._buckets[0][0] if self._buckets else None
+    
+    def descending(self, low: Optional[Tuple] = None, high: Optional[Tuple] = None):
+        """Keys with low <= key < high, largest first"""
+        if not self._buckets:
+            return
+        last = len(self._buckets) - 1 if high is None else min(bisect_left(self._maxes, high), len(self._buckets) - 1)
+        for index in range(last, -1, -1):
+            bucket = self._buckets[index]
+            end = len(bucket) if high is None else bisect_left(bucket, high)
+            start = 0 if low is None else bisect_left(bucket, low)
+            for position in range(end - 1, start - 1, -1):
+                yield bucket[position]
+            if start > 0:
+                return
+    
+    def __iter__(self):
+        for bucket in self._buckets:
+            yield from bucket
+
+class MergedKeys:
+    """Several SortedKeys read as one, without copying their keys.
+
+    descending merges the parts' walks lazily, so a caller that stops after
+    a page reads about a page of keys (plus one per part), not every part.
+    """
+    
+    def __init__(self, parts: List[SortedKeys]):
+        self._parts = parts
+    
+    def __len__(self) -> int:
+        return sum(len(keys) for keys in self._parts)
+    
+    def first(self) -> Optional[Tuple]:
+        return min((keys.first() for keys in self._parts if keys), default=None)
+    
+    def descending(self, low: Optional[Tuple] = None, high: Optional[Tuple] = None):
+        """Keys with low <= key < high, largest first"""
+        return merge(*[keys.descending(low, high) for keys in self._parts], reverse=True)
+
 class TradeManager:
-    """In-memory storage manager for trades"""
+    """In-memory storage manager for trades.
+
+    Trades are kept in a dict by id, plus sorted (date, id) keys: one
+    SortedKeys for all trades and one per symbol, trade type and action.
+    Filters start from the smallest matching index and walk its date range
+    newest first, so they run in time proportional to that range rather than
+    the table.
+    Any object with id, symbol, trade_type, action and date attributes can be
+    stored; change indexed fields through update_trade or update_fields.
+    """
     
     def __init__(self):
-        self.trades: List[Trade] = []
+        self._trades: Dict[int, Trade] = {}
+        self._by_date = SortedKeys()
+        self._by_symbol: Dict[str, SortedKeys] = {}
+        self._by_type: Dict[str, SortedKeys] = {}
+        self._by_action: Dict[str, SortedKeys] = {}
         self.next_id = 1
     
-    def add_trade(self, trade_data: Dict) -> Trade:
-        """Add a new trade"""
-        # Convert string enums back to enum objects
+    @property
+    def trades(self) -> List[Trade]:
+        """All trades in insertion order"""
+        return list(self._trades.values())
+    
+    def __len__(self) -> int:
+        return len(self._trades)
+    
+    @staticmethod
+    def _key(trade) -> Tuple:
+        return (trade.date, trade.id)
+    
+    def _indexes(self, trade) -> List[SortedKeys]:
+        """The indexes a trade belongs in, created if missing"""
+        return [self._by_date,
+                self._by_symbol.setdefault(trade.symbol.upper(), SortedKeys()),
+                self._by_type.setdefault(trade.trade_type.value, SortedKeys()),
+                self._by_action.setdefault(trade.action.value, SortedKeys())]
+    
+    def _index(self, trade):
+        key = self._key(trade)
+        for keys in self._indexes(trade):
+            keys.add(key)
+    
+    def _unindex(self, trade):
+        key = self._key(trade)
+        for keys in self._indexes(trade):
+            keys.remove(key)
+    
+    def insert(self, trade) -> Trade:
+        """Store a trade object, giving it the next id if it has none"""
+        if trade.id is None:
+            trade.id = self.next_id
+        self.next_id = max(self.next_id, trade.id + 1)
+        self._trades[trade.id] = trade
+        self._index(trade)
+        return trade
+    
+    def update_fields(self, trade_id: int, values: Dict) -> Optional[Trade]:
+        """Set attributes on a stored trade and move it in the indexes"""
+        trade = self._trades.get(trade_id)
+        if not trade:
+            return None
+        self._unindex(trade)
+        for key, value in values.items():
+            if hasattr(trade, key):
+                setattr(trade, key, value)
+        self._index(trade)
+        return trade
+    
+    def _convert(self, trade_data: Dict):
+        """Convert string enums and dates in trade data to objects"""
         trade_data['trade_type'] = TradeType(trade_data['trade_type'])
         trade_data['action'] = TradeAction(trade_data['action'])
         
-        # Convert date strings to datetime objects
         if isinstance(trade_data['date'], str):
             trade_data['date'] = datetime.fromisoformat(trade_data['date'])
         if trade_data.get('expiration_date') and isinstance(trade_data['expiration_date'], str):
             trade_data['expiration_date'] = datetime.fromisoformat(trade_data['expiration_date'])
-        
-        # Set ID
+    
+    def add_trade(self, trade_data: Dict) -> Trade:
+        """Add a new trade"""
+        self._convert(trade_data)
         trade_data['id'] = self.next_id
-        self.next_id += 1
-        
-        trade = Trade(**trade_data)
-        self.trades.append(trade)
-        return trade
+        return self.insert(Trade(**trade_data))
     
     def get_trade(self, trade_id: int) -> Optional[Trade]:
         """Get a trade by ID"""
-        for trade in self.trades:
-            if trade.id == trade_id:
-                return trade
-        return None
+        return self._trades.get(trade_id)
     
     def update_trade(self, trade_id: int, trade_data: Dict) -> Optional[Trade]:
         """Update an existing trade"""
-        trade = self.get_trade(trade_id)
-        if not trade:
+        if trade_id not in self._trades:
             return None
-        
-        # Convert string enums back to enum objects
-        trade_data['trade_type'] = TradeType(trade_data['trade_type'])
-        trade_data['action'] = TradeAction(trade_data['action'])
-        
-        # Convert date strings to datetime objects
-        if isinstance(trade_data['date'], str):
-            trade_data['date'] = datetime.fromisoformat(trade_data['date'])
-        if trade_data.get('expiration_date') and isinstance(trade_data['expiration_date'], str):
-            trade_data['expiration_date'] = datetime.fromisoformat(trade_data['expiration_date'])
-        
-        # Update trade fields
-        for key, value in trade_data.items():
-            if hasattr(trade, key):
-                setattr(trade, key, value)
-        
-        return trade
+        self._convert(trade_data)
+        return self.update_fields(trade_id, trade_data)
     
     def delete_trade(self, trade_id: int) -> bool:
         """Delete a trade"""
-        trade = self.get_trade(trade_id)
+        trade = self._trades.pop(trade_id, None)
         if trade:
-            self.trades.remove(trade)
+            self._unindex(trade)
             return True
         return False
     
     def get_all_trades(self) -> List[Trade]:
         """Get all trades"""
-        return sorted(self.trades, key=lambda x: x.date, reverse=True)
+        return [self._trades[trade_id] for _, trade_id in self._by_date.descending()]
+    
+    def _symbol_keys(self, symbol: str, match: str):
+        """Index keys for a symbol filter; prefix and contains walk every matching symbol's keys together"""
+        if match not in ['prefix', 'contains']:
+            return self._by_symbol.get(symbol, SortedKeys())
+        matching = [keys for name, keys in self._by_symbol.items()
+                    if (name.startswith(symbol) if match == 'prefix' else symbol in name)]
+        if len(matching) == 1:
+            return matching[0]
+        return MergedKeys(matching)
+    
+    @staticmethod
+    def _bound(value, like):
+        """A date filter value (ISO string, date or datetime) as the same type as the stored dates"""
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        if isinstance(like, datetime) and not isinstance(value, datetime):
+            return datetime.combine(value, datetime.min.time())
+        if not isinstance(like, datetime) and isinstance(value, datetime):
+            return value.date()
+        return value
     
-    def filter_trades(self, filters: Dict) -> List[Trade]:
-        """Filter trades based on criteria"""
-        filtered_trades = self.trades.copy()
+    def filter_trades(self, filters: Dict, limit: Optional[int] = None,
+                      before: Optional[Tuple] = None) -> List[Trade]:
+        """Filter trades based on criteria, newest first.
         
-        if filters.get('trade_type'):
-            trade_type = TradeType(filters['trade_type'])
-            filtered_trades = [t for t in filtered_trades if t.trade_type == trade_type]
+        filters takes trade_type, action, symbol (with symbol_match 'exact',
+        'prefix' or 'contains'; exact by default), date_from and date_to.
+        before is a (date, id) key to continue from, for keyset pagination.
+        """
+        candidates = [self._by_date]
+        predicates = []
         
-        if filters.get('action'):
-            action = TradeAction(filters['action'])
-            filtered_trades = [t for t in filtered_trades if t.action == action]
+        trade_type = filters.get('trade_type')
+        if trade_type and trade_type != 'all':
+            candidates.append(self._by_type.get(trade_type, SortedKeys()))
+            predicates.append(lambda t: t.trade_type.value == trade_type)
         
-        if filters.get('symbol'):
-            symbol = filters['symbol'].upper()
-            filtered_trades = [t for t in filtered_trades if t.symbol.upper() == symbol]
+        action = filters.get('action')
+        if action and action != 'all':
+            candidates.append(self._by_action.get(action, SortedKeys()))
+            predicates.append(lambda t: t.action.value == action)
         
-        if filters.get('date_from'):
-            date_from = datetime.fromisoformat(filters['date_from'])
-            filtered_trades = [t for t in filtered_trades if t.date >= date_from]
+        symbol = (filters.get('symbol') or '').strip().upper()
+        if symbol:
+            match = filters.get('symbol_match', 'exact')
+            candidates.append(self._symbol_keys(symbol, match))
+            if match == 'prefix':
+                predicates.append(lambda t: t.symbol.upper().startswith(symbol))
+            elif match == 'contains':
+                predicates.append(lambda t: symbol in t.symbol.upper())
+            else:
+                predicates.append(lambda t: t.symbol.upper() == symbol)
+        
+        # Walk the smallest index; the other filters are checked per trade
+        keys = min(candidates, key=len)
+        if not keys:
+            return []
+        like = keys.first()[0]
         
+        low = high = None
+        if filters.get('date_from'):
+            low = (self._bound(filters['date_from'], like),)
         if filters.get('date_to'):
-            date_to = datetime.fromisoformat(filters['date_to'])
-            filtered_trades = [t for t in filtered_trades if t.date <= date_to]
+            high = (self._bound(filters['date_to'], like), float('inf'))
+        if before:
+            before = (self._bound(before[0], like), before[1])
+            high = before if high is None else min(high, before)
         
-        return sorted(filtered_trades, key=lambda x: x.date, reverse=True)
+        result = []
+        for _, trade_id in keys.descending(low, high):
+            trade = self._trades[trade_id]
+            if all(predicate(trade) for predicate in predicates):
+                result.append(trade)
+                if limit is not None and len(result) == limit:
+                    break
+        return result
 
 # Global trade manager instance
 trade_manager = TradeManager()
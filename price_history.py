@@ -0,0 +1,187 @@
+import csv
+import json
+import os
+import uuid
+from datetime import date, datetime
+from typing import Dict, Optional, Sequence, TextIO, Tuple
+import numpy as np
+from flask import current_app
+
+INDEX_FILE = 'index.json'
+
+# Row keys are symbol number << 32 | date ordinal, so one sorted array orders rows by
+# symbol and then date, and any (symbol, date) pair is a single binary search
+DAY_BITS = 32
+DAY_MASK = (1 << DAY_BITS) - 1
+
+class PriceHistory:
+    """End-of-day closes for every symbol, memory-mapped from a directory written by write_history.
+
+    keys and closes hold one row per symbol and day; the index maps each symbol
+    to its [start, end) rows, in symbol order.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        try:
+            self._open()
+        except FileNotFoundError:
+            # Two writes since the index was read removed the arrays it names; the new index is complete
+            self._open()
+
+    def _open(self):
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        with open(index_path) as f:
+            index = json.load(f)
+        self.key = _file_key(index_path)
+        self.version = index['version']
+        # The version this one replaced, whose arrays are kept until the next write
+        self.previous = index.get('previous')
+        self.offsets: Dict[str, Tuple[int, int]] = {symbol: (start, end) for symbol, start, end in index['symbols']}
+        self.numbers: Dict[str, int] = {symbol: number for number, symbol in enumerate(self.offsets)}
+        self.keys = _load(self.directory, 'keys', self.version)
+        self.closes = _load(self.directory, 'closes', self.version)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def symbols(self) -> Sequence[str]:
+        return list(self.offsets)
+
+    def close_on(self, symbol: str, day: date) -> Optional[Tuple[date, float]]:
+        """(date, close) of the last close on or before day; a binary search of the symbol's rows"""
+        if symbol not in self.offsets:
+            return None
+        start, end = self.offsets[symbol]
+        target = (self.numbers[symbol] << DAY_BITS) | day.toordinal()
+        position = int(np.searchsorted(self.keys[start:end], target, side='right')) - 1
+        if position < 0:
+            return None
+        return date.fromordinal(int(self.keys[start + position]) & DAY_MASK), float(self.closes[start + position])
+
+    def closes_on(self, symbols: Sequence[str], day: date) -> Tuple[np.ndarray, np.ndarray]:
+        """Last close on or before day for every symbol in one vectorized search.
+
+        Returns (closes, date ordinals); NaN and 0 where a symbol has no close by then.
+        """
+        numbers = np.array([self.numbers.get(symbol, -1) for symbol in symbols], dtype=np.int64)
+        targets = (numbers << DAY_BITS) | day.toordinal()
+        positions = np.searchsorted(self.keys, targets, side='right') - 1
+        # The row found must belong to the same symbol, not the end of the previous one
+        found = (numbers >= 0) & (positions >= 0)
+        found[found] = (self.keys[positions[found]] >> DAY_BITS) == numbers[found]
+        closes = np.full(len(numbers), np.nan)
+        days = np.zeros(len(numbers), dtype=np.int64)
+        closes[found] = self.closes[positions[found]]
+        days[found] = self.keys[positions[found]] & DAY_MASK
+        return closes, days
+
+def _file_key(path: str) -> Tuple:
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+def _array_path(directory: str, name: str, version: str) -> str:
+    return os.path.join(directory, f'{name}-{version}.npy')
+
+def _load(directory: str, name: str, version: str) -> np.ndarray:
+    return np.load(_array_path(directory, name, version), mmap_mode='r')
+
+def read_price_csv(f: TextIO) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """symbol, date (YYYY-MM-DD) and close columns as (symbols, date ordinals, closes) arrays"""
+    symbols, days, closes = [], [], []
+    for line, row in enumerate(csv.DictReader(f), start=2):
+        try:
+            symbols.append(row['symbol'].strip().upper())
+            days.append(date.fromisoformat(row['date'].strip()).toordinal())
+            closes.append(float(row['close']))
+        except (KeyError, AttributeError, ValueError) as e:
+            raise ValueError(f'line {line}: symbol, date and close are required ({e})')
+    return (np.array(symbols, dtype=object), np.array(days, dtype=np.int64),
+            np.array(closes, dtype=np.float64))
+
+def write_history(directory: str, symbols: np.ndarray, days: np.ndarray, closes: np.ndarray,
+                  replace: bool = False) -> PriceHistory:
+    """Merge closes into the history in directory (or replace it) and write a new version.
+
+    A later close for the same symbol and day wins. The arrays are written
+    first and the index last, with a rename, so readers see the old version or
+    the new one, never a mix. The old version's arrays stay until the next write,
+    for readers that read the old index just before the rename.
+    """
+    os.makedirs(directory, exist_ok=True)
+    old = PriceHistory(directory) if os.path.exists(os.path.join(directory, INDEX_FILE)) else None
+    if old is not None and not replace:
+        old_symbols = np.array(old.symbols, dtype=object)[np.asarray(old.keys) >> DAY_BITS]
+        symbols = np.concatenate([old_symbols, symbols])
+        days = np.concatenate([np.asarray(old.keys) & DAY_MASK, days])
+        closes = np.concatenate([np.asarray(old.closes), closes])
+
+    names, numbers = np.unique(symbols, return_inverse=True) if len(symbols) \
+        else (np.array([], dtype=object), np.array([], dtype=np.int64))
+    keys = (numbers.astype(np.int64) << DAY_BITS) | days
+    # Stable, so of several closes for one key the last one loaded comes last and is kept
+    order = np.argsort(keys, kind='stable')
+    keys, closes = keys[order], closes[order]
+    last = np.ones(len(keys), dtype=bool)
+    last[:-1] = keys[1:] != keys[:-1]
+    keys, closes = keys[last], closes[last]
+
+    starts = np.searchsorted(keys, np.arange(len(names), dtype=np.int64) << DAY_BITS)
+    ends = np.append(starts[1:], len(keys))
+    version = uuid.uuid4().hex[:12]
+    np.save(_array_path(directory, 'keys', version), keys)
+    np.save(_array_path(directory, 'closes', version), closes)
+    index = {
+        'version': version,
+        'previous': old.version if old is not None else None,
+        'written_at': datetime.now().isoformat(timespec='seconds'),
+        'rows': int(len(keys)),
+        'symbols': [[name, int(start), int(end)] for name, start, end in zip(names, starts, ends)],
+    }
+    temporary = os.path.join(directory, f'{INDEX_FILE}.{version}')
+    with open(temporary, 'w') as f:
+        json.dump(index, f)
+    os.replace(temporary, os.path.join(directory, INDEX_FILE))
+
+    # Processes still reading older arrays keep their mappings after the files are removed
+    if old is not None and old.previous:
+        for name in ['keys', 'closes']:
+            try:
+                os.remove(_array_path(directory, name, old.previous))
+            except FileNotFoundError:
+                pass
+    return PriceHistory(directory)
+
+def get_price_history() -> Optional[PriceHistory]:
+    """The PRICE_HISTORY_DIR store, reopened when a load writes a new version; None if there is none"""
+    directory = current_app.config['PRICE_HISTORY_DIR']
+    if not directory or not os.path.exists(os.path.join(directory, INDEX_FILE)):
+        return None
+    history = current_app.extensions.get('price_history')
+    if history is None or history.key != _file_key(os.path.join(directory, INDEX_FILE)):
+        history = current_app.extensions['price_history'] = PriceHistory(directory)
+    return history
+
+def mark_stock_positions(stock_positions: Dict, history: PriceHistory, day: Optional[date] = None) -> Dict:
+    """Close, market value and unrealized P&L against avg_cost for every long stock position,
+    from one closes_on call"""
+    day = day or date.today()
+    symbols = [symbol for symbol, position in stock_positions.items() if position['quantity'] > 0]
+    closes, days = history.closes_on(symbols, day)
+    marks = {}
+    for symbol, close, ordinal in zip(symbols, closes.tolist(), days.tolist()):
+        if ordinal:
+            position = stock_positions[symbol]
+            market_value = position['quantity'] * close
+            marks[symbol] = {
+                'close': close,
+                'close_date': date.fromordinal(ordinal),
+                'market_value': market_value,
+                'unrealized_pnl': market_value - position['quantity'] * position['avg_cost'],
+            }
+    return marks
+
+def load_price_csv(directory: str, f: TextIO, replace: bool = False) -> PriceHistory:
+    """Bulk load a CSV of closes into the history in directory"""
+    return write_history(directory, *read_price_csv(f), replace=replace)
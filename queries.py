@@ -0,0 +1,162 @@
+import re
+from typing import List, NamedTuple, Optional, Tuple
+from datetime import date
+from flask import current_app, request
+from sqlalchemy import or_, and_, text
+from app import db
+from db_models import Trade, TradeType, TradeAction
+from forms import FilterForm
+
+def symbol_filter(symbol: str, match: str = 'contains'):
+    """Symbol filter clause. Symbols are stored upper-case, so exact and prefix
+    matches are plain comparisons that can use the symbol index; contains needs
+    the Postgres trigram index and, on SQLite, checks every row of the account's
+    date index."""
+    symbol = symbol.strip().upper()
+    if match == 'exact':
+        return Trade.symbol == symbol
+    if match == 'contains':
+        return Trade.symbol.ilike(f'%{symbol}%')
+    # Prefix as a range, e.g. 'AA' -> 'AA' <= symbol < 'AB'
+    upper_bound = symbol[:-1] + chr(ord(symbol[-1]) + 1)
+    return and_(Trade.symbol >= symbol, Trade.symbol < upper_bound)
+
+def filter_trades_query(account_id: int, filter_form: FilterForm, query=None):
+    """An account's trades with the dashboard filters applied (only the account filter if the
+    form is invalid)"""
+    if query is None:
+        query = Trade.query
+    query = query.filter(Trade.account_id == account_id)
+
+    if filter_form.validate():
+        if filter_form.trade_type.data and filter_form.trade_type.data != 'all':
+            query = query.filter(Trade.trade_type == TradeType(filter_form.trade_type.data))
+        if filter_form.action.data and filter_form.action.data != 'all':
+            query = query.filter(Trade.action == TradeAction(filter_form.action.data))
+        if filter_form.symbol.data and filter_form.symbol.data.strip():
+            query = query.filter(symbol_filter(filter_form.symbol.data, filter_form.symbol_match.data))
+        if filter_form.date_from.data:
+            query = query.filter(Trade.date >= filter_form.date_from.data)
+        if filter_form.date_to.data:
+            query = query.filter(Trade.date <= filter_form.date_to.data)
+
+    return query
+
+def format_cursor(trade: Trade) -> str:
+    """Cursor pointing just past a trade in (date, id) descending order"""
+    return f'{trade.date.isoformat()}_{trade.id}'
+
+def parse_cursor(cursor: Optional[str]) -> Optional[Tuple[date, int]]:
+    """Parse a cursor made by format_cursor; returns None for missing or malformed cursors"""
+    if not cursor:
+        return None
+    try:
+        cursor_date, cursor_id = cursor.split('_', 1)
+        return date.fromisoformat(cursor_date), int(cursor_id)
+    except ValueError:
+        return None
+
+class KeysetPage:
+    """One page of trades ordered by (date, id) descending, fetched lazily.
+
+    Iterating runs the query and yields trades as rows arrive, so the page can
+    be fed straight into a streamed template. Once iteration has finished,
+    next_cursor is set if there are more trades after this page.
+    """
+
+    def __init__(self, query, page_size: int, cursor: Optional[str] = None, batch_size: int = 100):
+        self.page_size = page_size
+        self.cursor = cursor
+        self.batch_size = batch_size
+        self.next_cursor = None
+        self.count = 0
+
+        position = parse_cursor(cursor)
+        if position:
+            cursor_date, cursor_id = position
+            query = query.filter(or_(Trade.date < cursor_date,
+                                     and_(Trade.date == cursor_date, Trade.id < cursor_id)))
+        self.query = query.order_by(Trade.date.desc(), Trade.id.desc()).limit(page_size + 1)
+
+    def __iter__(self):
+        last = None
+        self.count = 0
+        self.next_cursor = None
+        # A streamed page is read after the view's teardown has removed the session the query
+        # was built with; the current scoped session is the one the next teardown closes
+        for trade in self.query.with_session(db.session()).yield_per(self.batch_size):
+            if self.count == self.page_size:
+                # The extra row only tells us another page exists
+                self.next_cursor = format_cursor(last)
+                continue
+            last = trade
+            self.count += 1
+            yield trade
+
+def explain_query(query) -> List[str]:
+    """Query plan for an ORM query, one line per step (SQLite and Postgres)"""
+    session = query.session
+    dialect = session.get_bind().dialect
+    sql = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+
+    if dialect.name == 'sqlite':
+        rows = session.execute(text(f'EXPLAIN QUERY PLAN {sql}')).all()
+        return [row[-1] for row in rows]
+
+    # Ask whether an index *can* be used; on small tables Postgres prefers a seq scan anyway
+    session.execute(text('SET LOCAL enable_seqscan = off'))
+    try:
+        return [row[0] for row in session.execute(text(f'EXPLAIN {sql}')).all()]
+    finally:
+        session.rollback()
+
+def is_table_scan(plan: List[str], table: str = 'trades') -> bool:
+    """True if the plan reads the whole table instead of going through an index"""
+    for line in plan:
+        if line.startswith(f'SCAN {table}') and 'USING' not in line:
+            return True
+        if f'Seq Scan on {table}' in line:
+            return True
+    return False
+
+def uses_index(plan: List[str], index: str) -> bool:
+    """True if the plan reads through the named index (SQLite and Postgres)"""
+    return any(re.search(rf'\b{index}\b', line) for line in plan)
+
+# Filter combinations the dashboard can produce, as query strings, with the indexes their page
+# query may use; contains can't use the symbol index, so it walks the account's date index
+# (Postgres can use the trigram index instead)
+DASHBOARD_FILTERS = [
+    ('', ['ix_trades_account_date_id']),
+    ('trade_type=call', ['ix_trades_account_type_date_id']),
+    ('action=sell_to_open', ['ix_trades_account_action_date_id']),
+    ('symbol=AAPL&symbol_match=exact', ['ix_trades_account_symbol_date_id']),
+    ('symbol=AA&symbol_match=prefix', ['ix_trades_account_symbol_date_id']),
+    ('symbol=SPY', ['ix_trades_account_date_id', 'ix_trades_symbol_trgm']),
+    ('date_from=2024-01-01&date_to=2024-12-31', ['ix_trades_account_date_id']),
+    ('trade_type=put&date_from=2024-01-01', ['ix_trades_account_type_date_id']),
+    ('symbol=AAPL&symbol_match=exact&date_from=2024-01-01&date_to=2024-06-30', ['ix_trades_account_symbol_date_id']),
+    ('trade_type=stock&action=buy_to_open&symbol=MS&symbol_match=prefix', ['ix_trades_account_symbol_date_id']),
+    ('cursor=2024-06-01_1000', ['ix_trades_account_date_id']),
+    ('symbol=AAPL&symbol_match=exact&cursor=2024-06-01_1000', ['ix_trades_account_symbol_date_id']),
+]
+
+class PlanCheck(NamedTuple):
+    query_string: str
+    indexes: List[str]
+    plan: List[str]
+
+    @property
+    def ok(self) -> bool:
+        return not is_table_scan(self.plan) and any(uses_index(self.plan, index) for index in self.indexes)
+
+def check_dashboard_plans(account_id: int) -> List[PlanCheck]:
+    """The query plan of each DASHBOARD_FILTERS page; a check fails if its plan scans the
+    trades table or doesn't go through one of the expected indexes"""
+    checks = []
+    for query_string, indexes in DASHBOARD_FILTERS:
+        with current_app.test_request_context(query_string=query_string):
+            query = filter_trades_query(account_id, FilterForm(request.args))
+            page = KeysetPage(query, current_app.config['TRADES_PAGE_SIZE'], request.args.get('cursor'))
+            checks.append(PlanCheck(query_string, indexes, explain_query(page.query)))
+    return checks
@@ -1,97 +1,131 @@
-from flask import render_template, request, redirect, url_for, flash, jsonify
-from app import app, db
-from db_models import Trade, TradeType, TradeAction
-from forms import TradeForm, FilterForm
-from utils import calculate_portfolio_stats
-from datetime import datetime
+from flask import Blueprint, current_app, render_template, stream_template, stream_with_context, request, redirect, url_for, flash, jsonify, make_response, Response, abort
+from werkzeug.datastructures import MultiDict
+from forms import TradeForm, FilterForm, ImportForm
+from utils import calculate_portfolio_stats, trade_values_from_form
+import accounts
+import bulk
+import cache
+import exporter
+import importer
+import jobs
+import live
+import lots
+import metrics
+import trade_store
+from datetime import date, datetime, timezone
+import io
 import logging
 
-@app.route('/')
+bp = Blueprint('main', __name__)
+
+def _not_modified(etag):
+    """304 response for a client that already has the current page"""
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+def _with_etag(response, etag):
+    """Let the browser revalidate the page with If-None-Match on every view"""
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _page_size():
+    """per_page from the query string, within TRADES_MAX_PAGE_SIZE"""
+    page_size = request.args.get('per_page', current_app.config['TRADES_PAGE_SIZE'], type=int)
+    return max(1, min(page_size, current_app.config['TRADES_MAX_PAGE_SIZE']))
+
+# Dashboard rows come from the row cache
+bp.add_app_template_global(cache.trade_row, 'trade_row')
+
+@bp.app_context_processor
+def account_context():
+    """The navbar's account switcher; the account list is only read when a page shows it"""
+    return {'current_account_id': accounts.current_account_id(),
+            'list_accounts': trade_store.get_trade_store().accounts}
+
+@bp.route('/')
 def index():
     """Main dashboard showing recent trades and portfolio summary"""
+    # Unchanged data and arguments: answer from the client's copy without querying trades
+    etag = cache.page_etag()
+    if etag and etag in request.if_none_match:
+        return _not_modified(etag)
+    
+    store = trade_store.get_trade_store()
+    account_id = accounts.current_account_id()
+    
     # Get filter parameters
     filter_form = FilterForm(request.args)
     
-    # Build query
-    query = Trade.query
-    
-    if filter_form.validate():
-        if filter_form.trade_type.data and filter_form.trade_type.data != 'all':
-            query = query.filter(Trade.trade_type == TradeType(filter_form.trade_type.data))
-        if filter_form.action.data and filter_form.action.data != 'all':
-            query = query.filter(Trade.action == TradeAction(filter_form.action.data))
-        if filter_form.symbol.data:
-            query = query.filter(Trade.symbol.ilike(f'%{filter_form.symbol.data}%'))
-        if filter_form.date_from.data:
-            query = query.filter(Trade.date >= filter_form.date_from.data)
-        if filter_form.date_to.data:
-            query = query.filter(Trade.date <= filter_form.date_to.data)
-    
-    trades = query.order_by(Trade.date.desc()).all()
-    
-    # Calculate portfolio statistics
-    all_trades = Trade.query.all()
-    portfolio_stats = calculate_portfolio_stats(all_trades)
-    
-    return render_template('index.html', 
-                         trades=trades, 
-                         filter_form=filter_form,
-                         portfolio_stats=portfolio_stats)
-
-@app.route('/add_trade', methods=['GET', 'POST'])
+    # Keyset pagination on (date, id); the filter arguments are carried to every page
+    trades = store.page(account_id, filter_form, _page_size(), request.args.get('cursor'))
+    page_args = {key: value for key, value in request.args.items() if key != 'cursor'}
+    
+    portfolio_stats = cache.cached('portfolio_stats', lambda: store.portfolio_stats(account_id),
+                                   current_app.config['PORTFOLIO_STATS_ENGINE'])
+    
+    context = dict(trades=trades,
+                   filter_form=filter_form,
+                   portfolio_stats=portfolio_stats,
+                   page_args=page_args)
+    if current_app.config['LIVE_DASHBOARD']:
+        # The stream starts from what this page shows: its last change and its stats' version
+        context['stream_url'] = url_for('main.stream', since=store.last_change_id(account_id),
+                                        version=cache.get_data_version(), **page_args)
+    
+    if request.args.get('stream', current_app.config['STREAM_TRADE_TABLE'], type=int):
+        # Rows are rendered as they are fetched; stream_template keeps the request context alive
+        return _with_etag(Response(stream_template('index.html', **context)), etag)
+    
+    return _with_etag(make_response(render_template('index.html', **context)), etag)
+
+@bp.route('/stream')
+def stream():
+    """Server-sent events that patch an open dashboard after each write to its account"""
+    if not current_app.config['LIVE_DASHBOARD']:
+        abort(404)
+    # A reconnecting browser resumes from the last event it received
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+    events = live.dashboard_events(trade_store.get_trade_store(), accounts.current_account_id(),
+                                   FilterForm(request.args), since, request.args.get('version', type=int))
+    response = Response(stream_with_context(events), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Tells nginx not to buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@bp.route('/add_trade', methods=['GET', 'POST'])
 def add_trade():
     """Add a new trade"""
     form = TradeForm()
+    store = trade_store.get_trade_store()
     
     if form.validate_on_submit():
         try:
-            # Handle quantity based on action for options
-            quantity = form.quantity.data
-            if form.trade_type.data in ['call', 'put'] and form.action.data in ['sell_to_open', 'sell_to_close']:
-                # Sell options should have negative quantity
-                quantity = -abs(quantity)
-            else:
-                # Buy options and all stock trades should have positive quantity
-                quantity = abs(quantity)
-            
-            trade = Trade(
-                symbol=form.symbol.data.upper(),
-                trade_type=TradeType(form.trade_type.data),
-                action=TradeAction(form.action.data),
-                quantity=quantity,
-                price=form.price.data,
-                date=form.date.data,
-                fees=form.fees.data or 0.0,
-                is_closed=form.is_closed.data,
-                closed_date=form.closed_date.data if form.is_closed.data else None,
-                close_price=form.close_price.data if form.is_closed.data else None,
-                close_quantity=form.close_quantity.data if form.is_closed.data else None,
-                notes=form.notes.data or ""
-            )
-            
-            # Add options-specific fields if it's an options trade
-            if form.trade_type.data in ['call', 'put']:
-                trade.strike_price = form.strike_price.data
-                trade.expiration_date = form.expiration_date.data
-                trade.premium = form.price.data  # Use price field as premium for options
-            
-            db.session.add(trade)
-            db.session.commit()
+            # Quantity sign and options fields are normalized by trade_values_from_form
+            trade = store.add(accounts.current_account_id(), trade_values_from_form(form))
             
             flash(f'Trade added successfully: {trade.action.value.title()} {trade.quantity} {trade.symbol} {trade.trade_type.value.title()}', 'success')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
             
         except Exception as e:
-            db.session.rollback()
+            store.rollback()
             logging.error(f"Error adding trade: {e}")
             flash(f'Error adding trade: {str(e)}', 'danger')
     
     return render_template('add_trade.html', form=form)
 
-@app.route('/edit_trade/<int:trade_id>', methods=['GET', 'POST'])
+@bp.route('/edit_trade/<int:trade_id>', methods=['GET', 'POST'])
 def edit_trade(trade_id):
     """Edit an existing trade"""
-    trade = Trade.query.get_or_404(trade_id)
+    store = trade_store.get_trade_store()
+    trade = store.get(accounts.current_account_id(), trade_id)
+    if trade is None:
+        abort(404)
     
     form = TradeForm()
     
@@ -113,104 +147,406 @@ def edit_trade(trade_id):
         if trade.is_option:
             form.strike_price.data = trade.strike_price
             form.expiration_date.data = trade.expiration_date
-    
+
+    # An expired (or swept) option can still be edited; only a new expiration date has to be in the future
+    form.require_future_expiration = form.expiration_date.data != trade.expiration_date
+
     if form.validate_on_submit():
         try:
-            # Handle quantity based on action for options
-            quantity = form.quantity.data
-            if form.trade_type.data in ['call', 'put'] and form.action.data in ['sell_to_open', 'sell_to_close']:
-                # Sell options should have negative quantity
-                quantity = -abs(quantity)
-            else:
-                # Buy options and all stock trades should have positive quantity
-                quantity = abs(quantity)
-            
-            trade.symbol = form.symbol.data.upper()
-            trade.trade_type = TradeType(form.trade_type.data)
-            trade.action = TradeAction(form.action.data)
-            trade.quantity = quantity
-            trade.price = form.price.data
-            trade.date = form.date.data
-            trade.fees = form.fees.data or 0.0
-            trade.is_closed = form.is_closed.data
-            trade.closed_date = form.closed_date.data if form.is_closed.data else None
-            trade.close_price = form.close_price.data if form.is_closed.data else None
-            trade.close_quantity = form.close_quantity.data if form.is_closed.data else None
-            trade.notes = form.notes.data or ""
-            
-            # Add options-specific fields if it's an options trade
-            if form.trade_type.data in ['call', 'put']:
-                trade.strike_price = form.strike_price.data
-                trade.expiration_date = form.expiration_date.data
-                trade.premium = form.price.data  # Use price field as premium for options
-            else:
-                trade.strike_price = None
-                trade.expiration_date = None
-                trade.premium = None
-            
-            db.session.commit()
+            store.update(trade, trade_values_from_form(form))
             flash('Trade updated successfully', 'success')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
                 
         except Exception as e:
-            db.session.rollback()
+            store.rollback()
             logging.error(f"Error updating trade: {e}")
             flash(f'Error updating trade: {str(e)}', 'danger')
     
     return render_template('edit_trade.html', form=form, trade=trade)
 
-@app.route('/delete_trade/<int:trade_id>', methods=['POST'])
+@bp.route('/delete_trade/<int:trade_id>', methods=['POST'])
 def delete_trade(trade_id):
     """Delete a trade"""
+    store = trade_store.get_trade_store()
     try:
-        trade = Trade.query.get_or_404(trade_id)
-        db.session.delete(trade)
-        db.session.commit()
+        trade = store.get(accounts.current_account_id(), trade_id)
+        if trade is None:
+            abort(404)
+        store.delete(trade)
         flash('Trade deleted successfully', 'success')
     except Exception as e:
-        db.session.rollback()
+        store.rollback()
         logging.error(f"Error deleting trade: {e}")
         flash('Error deleting trade', 'danger')
     
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
+
+@bp.route('/import_trades', methods=['GET', 'POST'])
+def import_trades():
+    """Import trades from a broker statement CSV"""
+    form = ImportForm()
+    result = None
+    
+    if form.validate_on_submit():
+        if form.background.data:
+            # The request returns at once and the page polls the job for its progress
+            job = jobs.submit_job('import_trades', accounts.current_account_id(), upload=form.file.data)
+            return render_template('import_trades.html', form=form, result=None, job=job)
+        
+        # The upload is read line by line, never loaded whole
+        stream = io.TextIOWrapper(form.file.data.stream, encoding='utf-8-sig', newline='')
+        try:
+            result = importer.import_trades_csv(stream, accounts.current_account_id(),
+                                                batch_size=current_app.config['IMPORT_BATCH_SIZE'])
+            category = 'success' if not result.failed else 'warning'
+            flash(f'Imported {result.imported} trades, {result.failed} rows failed', category)
+        except ValueError as e:
+            flash(f'Error importing trades: {str(e)}', 'danger')
+        except Exception as e:
+            trade_store.get_trade_store().rollback()
+            logging.error(f"Error importing trades: {e}")
+            flash(f'Error importing trades: {str(e)}', 'danger')
+    
+    return render_template('import_trades.html', form=form, result=result)
 
-@app.route('/portfolio')
+@bp.route('/export.csv')
+def export_csv():
+    """Stream the filtered trades as CSV"""
+    trades = trade_store.get_trade_store().iter_trades(accounts.current_account_id(), FilterForm(request.args))
+    return Response(stream_with_context(exporter.generate_csv(trades)),
+                    mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=trades.csv'})
+
+@bp.route('/export.ndjson')
+def export_ndjson():
+    """Stream the filtered trades as newline-delimited JSON"""
+    trades = trade_store.get_trade_store().iter_trades(accounts.current_account_id(), FilterForm(request.args))
+    return Response(stream_with_context(exporter.generate_ndjson(trades)),
+                    mimetype='application/x-ndjson',
+                    headers={'Content-Disposition': 'attachment; filename=trades.ndjson'})
+
+def _price_snapshot():
+    """The current PRICE_FILE snapshot, or None without one"""
+    if not current_app.config['PRICE_FILE']:
+        return None
+    # NumPy is only imported when a price file is configured
+    import valuation
+    try:
+        return valuation.get_price_snapshot()
+    except (OSError, ValueError) as e:
+        # A bad price file drops the valuation, not the page
+        logging.warning(f'Price file not loaded: {e}')
+        return None
+
+def _price_history():
+    """The PRICE_HISTORY_DIR store, or None without one"""
+    if not current_app.config['PRICE_HISTORY_DIR']:
+        return None
+    import price_history
+    try:
+        return price_history.get_price_history()
+    except (OSError, ValueError) as e:
+        logging.warning(f'Price history not loaded: {e}')
+        return None
+
+@bp.route('/portfolio')
 def portfolio():
     """Portfolio summary page"""
-    trades = Trade.query.order_by(Trade.date.desc()).all()
-    portfolio_stats = calculate_portfolio_stats(trades)
-    
-    # Group trades by symbol for position tracking
-    positions = {}
-    for trade in trades:
-        symbol = trade.symbol
-        if symbol not in positions:
-            positions[symbol] = {
-                'symbol': symbol,
-                'stock_trades': [],
-                'options_trades': [],
-                'total_cost': 0,
-                'total_proceeds': 0
-            }
-        
-        if trade.is_option:
-            positions[symbol]['options_trades'].append(trade)
-        else:
-            positions[symbol]['stock_trades'].append(trade)
-        
-        if trade.action in [TradeAction.BUY_TO_OPEN, TradeAction.BUY_TO_CLOSE]:
-            positions[symbol]['total_cost'] += trade.total_cost
-        else:
-            positions[symbol]['total_proceeds'] += trade.total_cost
+    snapshot = _price_snapshot()
+    history = _price_history()
+    etag = cache.page_etag(*[source.key for source in [snapshot, history] if source])
+    if etag and etag in request.if_none_match:
+        return _not_modified(etag)
+    
+    store = trade_store.get_trade_store()
+    account_id = accounts.current_account_id()
+    portfolio_stats, positions = cache.cached('portfolio_page', lambda: store.portfolio_page_data(account_id),
+                                              current_app.config['PORTFOLIO_STATS_ENGINE'])
+    option_valuation = None
+    if snapshot:
+        option_valuation = cache.cached('option_valuation', lambda: store.option_valuation(account_id, snapshot),
+                                        snapshot.key)
+    stock_marks = {}
+    if history:
+        import price_history
+        stock_marks = cache.cached('stock_marks',
+                                   lambda: price_history.mark_stock_positions(portfolio_stats['stock_positions'], history),
+                                   current_app.config['PORTFOLIO_STATS_ENGINE'], history.key)
     
-    return render_template('portfolio.html', 
-                         portfolio_stats=portfolio_stats, 
-                         positions=positions)
+    response = make_response(render_template('portfolio.html',
+                                              portfolio_stats=portfolio_stats,
+                                              positions=positions,
+                                              option_valuation=option_valuation,
+                                              stock_marks=stock_marks))
+    return _with_etag(response, etag)
+
+@bp.route('/api/positions/<symbol>/trades')
+def api_position_trades(symbol):
+    """One page of a symbol's trades as JSON, newest first, for the portfolio drill-down"""
+    etag = cache.page_etag()
+    if etag and etag in request.if_none_match:
+        return _not_modified(etag)
+    
+    # The dashboard filters narrow the page further, e.g. ?trade_type=call
+    args = MultiDict(request.args)
+    args['symbol'] = symbol
+    args['symbol_match'] = 'exact'
+    filter_form = FilterForm(args)
+    # An invalid form would leave the query unfiltered, i.e. every symbol's trades
+    if not filter_form.validate():
+        return jsonify({'error': 'invalid filters', 'fields': filter_form.errors}), 400
+    
+    page = trade_store.get_trade_store().page(accounts.current_account_id(), filter_form, _page_size(),
+                                              request.args.get('cursor'))
+    trades = [trade.to_dict() for trade in page]
+    return _with_etag(jsonify({'symbol': symbol.strip().upper(),
+                               'trades': trades,
+                               'next_cursor': page.next_cursor}), etag)
+
+def _lots_data(account_id, symbol, method, selections):
+    """Open lots, matches and realized P&L per contract for one symbol of an account"""
+    book = trade_store.get_trade_store().lot_book(account_id, method, symbol, selections)
+    realized = [dict(lots.contract_dict(contract), realized_pnl=pnl)
+                for contract, pnl in book.realized_pnl.items()]
+    return {
+        'symbol': symbol,
+        'method': method,
+        'selections': {str(trade_id): lot_ids for trade_id, lot_ids in selections.items()},
+        'open_lots': [lot.to_dict() for lot in book.open_lots()],
+        'matches': [match.to_dict() for match in book.matches],
+        'realized_pnl': realized,
+        'total_realized_pnl': book.total_realized_pnl,
+        'unmatched': [{'trade_id': trade_id, 'quantity': quantity} for trade_id, quantity in book.unmatched],
+    }
+
+@bp.route('/api/lots')
+def api_lots():
+    """Lot matching for one symbol as JSON.
+
+    Each lots=CLOSE:LOT[,LOT...] argument names the lots (opening trade ids) a closing
+    trade takes first; the rest of its quantity is matched by method.
+    """
+    symbol = request.args.get('symbol', '').strip()
+    method = request.args.get('method', 'fifo')
+    if not symbol:
+        return jsonify({'error': 'symbol is required'}), 400
+    if method not in lots.MATCH_METHODS:
+        return jsonify({'error': f'method must be one of {", ".join(lots.MATCH_METHODS)}'}), 400
+    
+    symbol = symbol.upper()
+    account_id = accounts.current_account_id()
+    try:
+        selections = lots.parse_selections(request.args.getlist('lots'))
+        selected = tuple((trade_id, tuple(lot_ids)) for trade_id, lot_ids in sorted(selections.items()))
+        return jsonify(cache.cached('lots', lambda: _lots_data(account_id, symbol, method, selections),
+                                    symbol, method, selected))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@bp.route('/api/timeseries')
+def api_timeseries():
+    """Daily cash flow, realized P&L and open exposure for a date range as JSON"""
+    try:
+        start = date.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = date.fromisoformat(request.args['end']) if request.args.get('end') else None
+    except ValueError:
+        return jsonify({'error': 'start and end must be YYYY-MM-DD dates'}), 400
+    symbol = request.args.get('symbol', '').strip().upper()
+    account_id = accounts.current_account_id()
+    store = trade_store.get_trade_store()
+    
+    if symbol:
+        points = cache.cached('symbol_timeseries',
+                              lambda: store.daily_timeseries(account_id, symbol, start, end),
+                              symbol, start, end)
+    else:
+        points = cache.cached('portfolio_timeseries',
+                              lambda: store.daily_timeseries(account_id, None, start, end),
+                              start, end)
+    
+    return jsonify({'symbol': symbol or None,
+                    'start': start.isoformat() if start else None,
+                    'end': end.isoformat() if end else None,
+                    'points': points})
+
+@bp.route('/api/portfolio/at')
+def api_portfolio_at():
+    """Portfolio statistics as they were at a point in time, rebuilt from the trade journal"""
+    try:
+        # A date alone means the end of that day; times are UTC
+        at = datetime.fromisoformat(request.args['at'])
+        if 'T' not in request.args['at'] and ' ' not in request.args['at']:
+            at = datetime.combine(at.date(), datetime.max.time())
+    except (KeyError, ValueError):
+        return jsonify({'error': 'at must be a YYYY-MM-DD date or YYYY-MM-DDTHH:MM[:SS] time'}), 400
+    if at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    
+    point = trade_store.get_trade_store().portfolio_at(accounts.current_account_id(), at)
+    if point is None:
+        return jsonify({'error': f'The trade journal starts after {at.isoformat()}'}), 404
+    return jsonify({'at': at.isoformat(),
+                    'snapshot_taken_at': point.snapshot_taken_at.isoformat() if point.snapshot_taken_at else None,
+                    'events_replayed': point.events_replayed,
+                    'stats': jobs.stats_result(calculate_portfolio_stats(point.trades))})
+
+def _bulk_request():
+    """The JSON object of a bulk request"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise ValueError('expected a JSON object')
+    return data
+
+def _bulk_trades(store, account_id, trade_ids):
+    """The account's trades with these ids in order, or a 404 response naming the missing ones"""
+    found = store.get_many(account_id, trade_ids)
+    missing = [trade_id for trade_id in trade_ids if trade_id not in found]
+    if missing:
+        return None, (jsonify({'error': 'trades not found', 'ids': missing}), 404)
+    return [found[trade_id] for trade_id in trade_ids], None
+
+@bp.route('/api/trades/bulk/create', methods=['POST'])
+def api_bulk_create():
+    """Create trades from JSON {"trades": [...]} in one transaction; nothing is written if any fails validation"""
+    store = trade_store.get_trade_store()
+    try:
+        values, errors = bulk.parse_creates(_bulk_request(), current_app.config['BULK_MAX_TRADES'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if errors:
+        return jsonify({'error': 'invalid trades', 'trades': errors}), 400
+    try:
+        ids = store.bulk_add(accounts.current_account_id(), values)
+    except Exception as e:
+        store.rollback()
+        logging.error(f"Error adding trades: {e}")
+        return jsonify({'error': f'Error adding trades: {e}'}), 500
+    return jsonify({'created': len(ids), 'ids': ids}), 201
+
+def _bulk_change(fields, close):
+    """Validate and apply a bulk close or edit; trades the request leaves as they are don't count as updated"""
+    store = trade_store.get_trade_store()
+    account_id = accounts.current_account_id()
+    try:
+        requested = bulk.parse_changes(_bulk_request(), fields, current_app.config['BULK_MAX_TRADES'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    trades, not_found = _bulk_trades(store, account_id, [trade_id for trade_id, _ in requested])
+    if not_found:
+        return not_found
+    edits, errors = bulk.validate_changes(trades, [changed for _, changed in requested], close)
+    if errors:
+        store.rollback()
+        return jsonify({'error': 'invalid trades', 'trades': errors}), 400
+    if not edits:
+        store.rollback()
+        return jsonify({'updated': 0})
+    try:
+        store.bulk_update(account_id, edits)
+    except Exception as e:
+        store.rollback()
+        logging.error(f"Error updating trades: {e}")
+        return jsonify({'error': f'Error updating trades: {e}'}), 500
+    return jsonify({'updated': len(edits)})
+
+@bp.route('/api/trades/bulk/close', methods=['POST'])
+def api_bulk_close():
+    """Close trades in one transaction: {"ids": [...], "closed_date": ..., "close_price": ...}, or
+    {"trades": [{"id": ..., ...}, ...]} for per-trade values; close_quantity defaults to the whole position"""
+    return _bulk_change(bulk.CLOSE_FIELDS, close=True)
+
+@bp.route('/api/trades/bulk/edit', methods=['POST'])
+def api_bulk_edit():
+    """Edit trades in one transaction, as /api/trades/bulk/close with any trade field"""
+    return _bulk_change(bulk.TRADE_FIELDS, close=False)
+
+@bp.route('/api/trades/bulk/delete', methods=['POST'])
+def api_bulk_delete():
+    """Delete the trades of JSON {"ids": [...]} in one transaction"""
+    store = trade_store.get_trade_store()
+    account_id = accounts.current_account_id()
+    try:
+        trade_ids = bulk.parse_ids(_bulk_request(), current_app.config['BULK_MAX_TRADES'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    trades, not_found = _bulk_trades(store, account_id, trade_ids)
+    if not_found:
+        return not_found
+    try:
+        store.bulk_delete(account_id, trades)
+    except Exception as e:
+        store.rollback()
+        logging.error(f"Error deleting trades: {e}")
+        return jsonify({'error': f'Error deleting trades: {e}'}), 500
+    return jsonify({'deleted': len(trades)})
+
+@bp.route('/api/jobs')
+def api_jobs():
+    """The account's recent background jobs as JSON, newest first"""
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    return jsonify({'jobs': [job.to_dict() for job in jobs.list_jobs(accounts.current_account_id(), limit)]})
+
+@bp.route('/api/jobs', methods=['POST'])
+def api_submit_job():
+    """Queue a background job and answer 202 at once with the job to poll.
+
+    JSON {"kind": ..., "params": {...}} only: a cross-site form can't send JSON, and a form post
+    here would skip the CSRF check. Jobs that take an upload are started from the import page.
+    """
+    data = request.get_json(silent=True) if request.is_json else None
+    if not isinstance(data, dict):
+        return jsonify({'error': 'expected a JSON object'}), 400
+    params = data.get('params') or {}
+    if not isinstance(params, dict):
+        return jsonify({'error': 'params must be an object'}), 400
+    try:
+        job = jobs.submit_job(data.get('kind', ''), accounts.current_account_id(), params)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    response = jsonify(job.to_dict())
+    response.status_code = 202
+    response.headers['Location'] = url_for('main.api_job', job_id=job.id)
+    return response
+
+@bp.route('/api/jobs/<int:job_id>')
+def api_job(job_id):
+    """One job's status, progress and result as JSON"""
+    job = jobs.get_job(accounts.current_account_id(), job_id)
+    if job is None:
+        return jsonify({'error': 'job not found'}), 404
+    return jsonify(job.to_dict())
+
+@bp.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+def api_cancel_job(job_id):
+    """Cancel a queued job, or ask a running one to stop"""
+    job = jobs.get_job(accounts.current_account_id(), job_id)
+    if job is None:
+        return jsonify({'error': 'job not found'}), 404
+    if not jobs.cancel_job(job):
+        return jsonify(dict(job.to_dict(), error='job already finished')), 409
+    return jsonify(job.to_dict())
+
+@bp.route('/accounts/<int:account_id>/select', methods=['POST'])
+def select_account(account_id):
+    """Switch the session to another account"""
+    names = dict(trade_store.get_trade_store().accounts())
+    if account_id not in names:
+        abort(404)
+    accounts.select_account(account_id)
+    flash(f'Switched to account {names[account_id]}', 'info')
+    return redirect(url_for('main.index'))
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """Request metrics for this process in the Prometheus text format"""
+    if not current_app.config['METRICS_ENABLED']:
+        abort(404)
+    return Response(metrics.get_registry(current_app).render(), mimetype='text/plain; version=0.0.4')
 
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def not_found_error(error):
     return render_template('404.html'), 404
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def internal_error(error):
     return render_template('500.html'), 500
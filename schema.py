@@ -0,0 +1,78 @@
+from typing import List, Tuple
+from sqlalchemy import MetaData, inspect, literal, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.schema import CreateColumn, CreateIndex
+
+OBSOLETE_INDEX_PREFIX = 'ix_'
+
+class MigrationError(Exception):
+    """A schema change that can't be made automatically"""
+
+def _column_default(column, dialect) -> str:
+    """DEFAULT clause for a NOT NULL column added to a table that may already have rows"""
+    if column.server_default is not None:
+        return ''
+    if column.default is None or not column.default.is_scalar:
+        raise MigrationError(f'{column.table.name}.{column.name} is NOT NULL without a constant default; '
+                             f'add it by hand')
+    value = literal(column.default.arg, column.type).compile(dialect=dialect,
+                                                             compile_kwargs={'literal_binds': True})
+    return f' DEFAULT {value}'
+
+def pending_changes(connection: Connection, metadata: MetaData) -> List[Tuple[str, object]]:
+    """(description, schema item) for every table, column and index the database is missing,
+    and for indexes the models no longer define.
+
+    Otherwise only additions are found; changed or removed columns need a manual migration.
+    """
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+    changes = []
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            changes.append((f'create table {table.name}', table))
+            continue
+
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                changes.append((f'add column {table.name}.{column.name}', column))
+
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)
+                            if not index.get('duplicates_constraint')}
+        # Only indexes named as the models name theirs; anything else was made by hand
+        for name in sorted(existing_indexes - {index.name for index in table.indexes}):
+            if name.startswith(OBSOLETE_INDEX_PREFIX):
+                changes.append((f'drop index {name}', name))
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name in existing_indexes:
+                continue
+            # Dialect-specific indexes (ddl_if) only count where they would be created
+            if not CreateIndex(index)._should_execute(index, connection):
+                continue
+            changes.append((f'create index {index.name}', index))
+    return changes
+
+def migrate(connection: Connection, metadata: MetaData, dry_run: bool = False) -> List[str]:
+    """Create missing tables, columns and indexes and drop obsolete indexes; returns what
+    was (or would be) done"""
+    changes = pending_changes(connection, metadata)
+    if dry_run:
+        return [description for description, _ in changes]
+
+    dialect = connection.dialect
+    for description, item in changes:
+        if description.startswith('create table'):
+            # create_all also creates the table's indexes and runs its DDL events
+            metadata.create_all(connection, tables=[item])
+        elif description.startswith('drop index'):
+            connection.execute(text(f'DROP INDEX {dialect.identifier_preparer.quote(item)}'))
+        elif description.startswith('add column'):
+            spec = CreateColumn(item).compile(dialect=dialect)
+            if not item.nullable:
+                spec = f'{spec}{_column_default(item, dialect)}'
+            connection.execute(text(f'ALTER TABLE {dialect.identifier_preparer.format_table(item.table)} '
+                                    f'ADD COLUMN {spec}'))
+        else:
+            item.create(connection)
+    return [description for description, _ in changes]
@@ -0,0 +1,134 @@
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime
+from sqlalchemy import select, func, case, and_
+from app import db
+from db_models import Trade, TradeAction, expiry_cutoff
+from utils import calculate_portfolio_stats
+
+def _count(condition):
+    return func.sum(case((condition, 1), else_=0))
+
+def _total(value, condition=None):
+    if condition is not None:
+        value = case((condition, value), else_=0.0)
+    return func.coalesce(func.sum(value), 0.0)
+
+def symbol_summary_rows(account_id: int, now: Optional[datetime] = None) -> List:
+    """One row per symbol of an account with the calculate_portfolio_stats sums, computed in the database"""
+    expired_before = expiry_cutoff(now)
+
+    total_cost = Trade.total_cost
+    trade_value = func.abs(total_cost)
+    is_debit = total_cost > 0
+    is_stock = ~Trade.is_option
+    is_buy = Trade.action.in_([TradeAction.BUY_TO_OPEN, TradeAction.BUY_TO_CLOSE])
+
+    stmt = select(
+        Trade.symbol,
+        func.min(Trade.id).label('first_id'),
+        func.min(case((is_stock, Trade.id))).label('first_stock_id'),
+        func.count().label('trade_count'),
+        _count(Trade.is_option).label('options_trades'),
+        _count(and_(Trade.is_option, Trade.expiration_date < expired_before)).label('expired_options'),
+        _count(Trade.is_closed == True).label('closed_positions'),  # noqa: E712
+        _total(func.coalesce(Trade.fees, 0.0)).label('total_fees'),
+        _total(Trade.realized_pnl).label('realized_pnl'),
+        _total(trade_value, is_debit).label('total_invested'),
+        _total(trade_value, ~is_debit).label('total_proceeds'),
+        _total(trade_value, and_(is_debit, Trade.is_option)).label('options_premium_paid'),
+        _total(trade_value, and_(~is_debit, Trade.is_option)).label('options_premium_received'),
+        _total(trade_value, and_(is_debit, is_stock)).label('stock_cost'),
+        func.coalesce(func.sum(case((and_(is_stock, is_debit), func.abs(Trade.quantity)),
+                                    (is_stock, -func.abs(Trade.quantity)),
+                                    else_=0)), 0).label('stock_quantity'),
+        # Portfolio positions table: cost of buys and of sells, fees included
+        _total(total_cost, is_buy).label('buy_cost'),
+        _total(total_cost, ~is_buy).label('sell_cost'),
+    ).where(Trade.account_id == account_id).group_by(Trade.symbol).order_by(func.min(Trade.id))
+    return db.session.execute(stmt).all()
+
+def stock_average_costs(account_id: int) -> Dict[str, float]:
+    """avg_cost per stock symbol of an account as calculate_portfolio_stats leaves it: the running
+    cost over the running quantity after the last buy that left a positive quantity"""
+    trade_value = func.abs(Trade.total_cost)
+    is_debit = Trade.total_cost > 0
+    window = {'partition_by': Trade.symbol, 'order_by': Trade.id}
+    running = select(
+        Trade.symbol,
+        Trade.id,
+        is_debit.label('is_debit'),
+        func.sum(case((is_debit, func.abs(Trade.quantity)), else_=-func.abs(Trade.quantity)))
+            .over(**window).label('running_quantity'),
+        func.sum(case((is_debit, trade_value), else_=0.0)).over(**window).label('running_cost'),
+    ).where(Trade.account_id == account_id, ~Trade.is_option).subquery()
+
+    updates = select(
+        running.c.symbol,
+        running.c.running_cost,
+        running.c.running_quantity,
+        func.row_number().over(partition_by=running.c.symbol, order_by=running.c.id.desc()).label('n'),
+    ).where(running.c.is_debit, running.c.running_quantity > 0).subquery()
+
+    rows = db.session.execute(select(updates.c.symbol, updates.c.running_cost, updates.c.running_quantity)
+                              .where(updates.c.n == 1))
+    return {symbol: cost / quantity for symbol, cost, quantity in rows}
+
+def portfolio_stats_from_rows(rows: List, average_costs: Dict[str, float]) -> Dict:
+    """Build the calculate_portfolio_stats dict from symbol_summary_rows.
+
+    options_positions is left empty because no trades are loaded.
+    """
+    stats = calculate_portfolio_stats([])
+    symbol_pnl = []
+
+    for row in rows:
+        for name in ['options_trades', 'expired_options', 'closed_positions', 'total_fees',
+                     'realized_pnl', 'total_invested', 'total_proceeds', 'options_premium_paid',
+                     'options_premium_received']:
+            stats[name] += row._mapping[name]
+        stats['total_trades'] += row.trade_count
+        symbol_pnl.append((row.symbol, row.total_proceeds - row.total_invested))
+
+    stats['stock_trades'] = stats['total_trades'] - stats['options_trades']
+    stats['active_options'] = stats['options_trades'] - stats['expired_options']
+    stats['open_positions'] = stats['total_trades'] - stats['closed_positions']
+    stats['net_pnl'] = stats['total_proceeds'] - stats['total_invested']
+
+    # Positions in order of each symbol's first stock trade, as the per-trade loop adds them
+    stock_rows = sorted((row for row in rows if row.first_stock_id is not None), key=lambda row: row.first_stock_id)
+    for row in stock_rows:
+        stats['stock_positions'][row.symbol] = {
+            'quantity': row.stock_quantity,
+            'avg_cost': average_costs.get(row.symbol, 0),
+            'total_cost': row.stock_cost,
+        }
+
+    # Rows come in order of first trade, which breaks ties as the per-trade loop does
+    symbol_pnl.sort(key=lambda x: x[1], reverse=True)
+    if symbol_pnl:
+        stats['top_performers'] = symbol_pnl[:5]
+        stats['worst_performers'] = symbol_pnl[-5:]
+
+    return stats
+
+def positions_from_rows(rows: List) -> Dict:
+    """Per-symbol summary rows for the portfolio positions table"""
+    return {
+        row.symbol: {
+            'symbol': row.symbol,
+            'stock_trades': row.trade_count - row.options_trades,
+            'options_trades': row.options_trades,
+            'total_cost': row.buy_cost,
+            'total_proceeds': row.sell_cost,
+        }
+        for row in sorted(rows, key=lambda row: row.symbol)
+    }
+
+def load_portfolio_stats(account_id: int) -> Dict:
+    """An account's portfolio statistics aggregated by the database"""
+    return portfolio_stats_from_rows(symbol_summary_rows(account_id), stock_average_costs(account_id))
+
+def load_portfolio_page_data(account_id: int) -> Tuple[Dict, Dict]:
+    """Stats and per-symbol positions for an account's portfolio page from one grouped query"""
+    rows = symbol_summary_rows(account_id)
+    return portfolio_stats_from_rows(rows, stock_average_costs(account_id)), positions_from_rows(rows)
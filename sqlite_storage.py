@@ -0,0 +1,106 @@
+import logging
+import threading
+import time
+from typing import Dict
+from flask import Flask, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+
+logger = logging.getLogger(__name__)
+
+# Requests that only read; anything else takes the write lock when its transaction begins
+READ_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+def is_sqlite_file(uri: str) -> bool:
+    """True for an on-disk SQLite database (not :memory:)"""
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+def engine_options(config) -> Dict:
+    """Engine options for a SQLite file: a pool of connections kept open, since each one
+    runs the pragmas once, and no pre-ping or recycling, which only matter for servers"""
+    return {
+        'pool_size': config['SQLITE_POOL_SIZE'],
+        'max_overflow': config['SQLITE_POOL_OVERFLOW'],
+    }
+
+def connection_pragmas(config) -> Dict[str, object]:
+    """PRAGMA name -> value run on every new connection"""
+    return {
+        'journal_mode': config['SQLITE_JOURNAL_MODE'],
+        'synchronous': config['SQLITE_SYNCHRONOUS'],
+        'busy_timeout': config['SQLITE_BUSY_TIMEOUT'],
+        'cache_size': config['SQLITE_CACHE_SIZE'],
+        'mmap_size': config['SQLITE_MMAP_SIZE'],
+        'temp_store': config['SQLITE_TEMP_STORE'],
+    }
+
+def _begin_statement() -> str:
+    # A deferred transaction that reads and then writes cannot wait for the write lock
+    # (SQLITE_BUSY comes back at once), so write requests take it up front and queue
+    # on busy_timeout instead. Readers never block or get blocked in WAL mode.
+    if has_request_context() and request.method not in READ_METHODS:
+        return 'BEGIN IMMEDIATE'
+    # Background work that writes marks its app context with writes_ahead()
+    if has_app_context() and g.get('sqlite_writes_ahead'):
+        return 'BEGIN IMMEDIATE'
+    return 'BEGIN'
+
+def writes_ahead():
+    """Take the write lock when each transaction of the current app context begins, as
+    write requests do; for background jobs that read and then write"""
+    g.sqlite_writes_ahead = True
+
+def optimize(connection):
+    """Refresh the query planner statistics that have gone stale (cheap when none have)"""
+    connection.execute('PRAGMA optimize')
+
+def analyze(connection):
+    """Gather planner statistics for every table and index, then checkpoint the WAL"""
+    connection.execute('ANALYZE')
+    connection.execute('PRAGMA optimize')
+    return connection.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+
+def init_engine(engine: Engine, config):
+    """Set the pragmas on each new connection, take the transaction control from pysqlite,
+    and run PRAGMA optimize on a returned connection every SQLITE_OPTIMIZE_INTERVAL seconds"""
+    pragmas = connection_pragmas(config)
+    interval = config['SQLITE_OPTIMIZE_INTERVAL']
+    # The first returned connection optimizes, so a new process starts with fresh statistics
+    state = {'last_optimize': None}
+    lock = threading.Lock()
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        # pysqlite's own BEGIN handling is turned off so the begin hook below decides the mode
+        dbapi_connection.isolation_level = None
+        for name, value in pragmas.items():
+            dbapi_connection.execute(f'PRAGMA {name} = {value}')
+
+    @event.listens_for(engine, 'begin')
+    def begin(connection):
+        connection.exec_driver_sql(_begin_statement())
+
+    if interval:
+        @event.listens_for(engine, 'checkin')
+        def optimize_periodically(dbapi_connection, connection_record):
+            last = state['last_optimize']
+            if dbapi_connection is None or (last is not None and time.monotonic() - last < interval):
+                return
+            # One connection per process does it; the others carry on
+            if not lock.acquire(blocking=False):
+                return
+            try:
+                state['last_optimize'] = time.monotonic()
+                optimize(dbapi_connection)
+            except Exception as e:
+                logger.warning(f'PRAGMA optimize failed: {e}')
+            finally:
+                lock.release()
+
+def init_app(app: Flask, db):
+    """Apply the SQLite tuning to the app's engine when it is a SQLite file and SQLITE_TUNED is set"""
+    if not app.config['SQLITE_TUNED'] or not is_sqlite_file(app.config['SQLALCHEMY_DATABASE_URI']):
+        return
+    with app.app_context():
+        init_engine(db.engine, app.config)
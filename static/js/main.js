@@ -7,6 +7,9 @@ document.addEventListener('DOMContentLoaded', function() {
     initializeConfirmDialogs();
     initializeTableSorting();
     initializeNumberFormatting();
+    initializePositionDrillDown();
+    initializeJobProgress();
+    initializeLiveDashboard();
 });
 
 // Form validation and dynamic field handling
@@ -60,7 +63,15 @@ function initializeTableSorting() {
 // Sort table by column index
 function sortTable(table, columnIndex) {
     const tbody = table.querySelector('tbody');
-    const rows = Array.from(tbody.querySelectorAll('tr'));
+    // Direct rows only; expanded position details move with the row above them
+    const rows = Array.from(tbody.rows).filter(row => !row.classList.contains('position-detail'));
+    const details = new Map();
+    rows.forEach(row => {
+        const next = row.nextElementSibling;
+        if (next && next.classList.contains('position-detail')) {
+            details.set(row, next);
+        }
+    });
     const isNumeric = isColumnNumeric(rows, columnIndex);
     let ascending = true;
     
@@ -95,7 +106,12 @@ function sortTable(table, columnIndex) {
     
     // Rebuild table body
     tbody.innerHTML = '';
-    rows.forEach(row => tbody.appendChild(row));
+    rows.forEach(row => {
+        tbody.appendChild(row);
+        if (details.has(row)) {
+            tbody.appendChild(details.get(row));
+        }
+    });
 }
 
 // Get cell value for sorting
@@ -116,6 +132,126 @@ function isColumnNumeric(rows, columnIndex) {
     return false;
 }
 
+// Portfolio positions: a symbol's trades are fetched when its row is first expanded
+function initializePositionDrillDown() {
+    document.querySelectorAll('table[data-trades-url]').forEach(table => {
+        // Icons are added here rather than sent with every row of the page
+        table.querySelectorAll('td.position-toggle').forEach(cell => {
+            cell.insertAdjacentHTML('afterbegin', '<i class="fas fa-chevron-right me-2"></i>');
+            cell.setAttribute('role', 'button');
+            cell.setAttribute('aria-expanded', 'false');
+        });
+        table.addEventListener('click', event => {
+            const cell = event.target.closest('td.position-toggle');
+            if (cell) {
+                togglePositionTrades(table, cell);
+            }
+        });
+    });
+}
+
+// Show or hide the trades under a position row
+function togglePositionTrades(table, toggle) {
+    const row = toggle.closest('tr');
+    const icon = toggle.querySelector('i');
+    let detail = row.nextElementSibling;
+
+    if (detail && detail.classList.contains('position-detail')) {
+        const hidden = detail.classList.toggle('d-none');
+        icon.classList.toggle('fa-chevron-right', hidden);
+        icon.classList.toggle('fa-chevron-down', !hidden);
+        toggle.setAttribute('aria-expanded', String(!hidden));
+        return;
+    }
+
+    const url = table.dataset.tradesUrl.replace('SYMBOL', encodeURIComponent(toggle.textContent.trim()));
+    detail = document.createElement('tr');
+    detail.className = 'position-detail';
+    const cell = document.createElement('td');
+    cell.colSpan = row.cells.length;
+    cell.innerHTML = `
+        <table class="table table-sm mb-2">
+            <thead>
+                <tr>
+                    <th>Date</th><th>Type</th><th>Action</th><th>Quantity</th><th>Price/Premium</th>
+                    <th>Strike</th><th>Expiration</th><th>Total Cost</th><th>P&L</th><th>Status</th>
+                </tr>
+            </thead>
+            <tbody></tbody>
+        </table>
+        <div class="text-muted small position-status">Loading...</div>
+        <button type="button" class="btn btn-sm btn-outline-secondary d-none">Load more</button>
+    `;
+    detail.appendChild(cell);
+    row.after(detail);
+    icon.classList.replace('fa-chevron-right', 'fa-chevron-down');
+    toggle.setAttribute('aria-expanded', 'true');
+
+    const moreButton = cell.querySelector('button');
+    moreButton.addEventListener('click', () => loadPositionTrades(url, cell, moreButton.dataset.cursor));
+    loadPositionTrades(url, cell, null);
+}
+
+// Fetch one page of trades into an expanded position
+function loadPositionTrades(url, cell, cursor) {
+    const tbody = cell.querySelector('tbody');
+    const status = cell.querySelector('.position-status');
+    const moreButton = cell.querySelector('button');
+    moreButton.disabled = true;
+
+    fetch(cursor ? `${url}?cursor=${encodeURIComponent(cursor)}` : url)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            return response.json();
+        })
+        .then(data => {
+            data.trades.forEach(trade => tbody.appendChild(positionTradeRow(trade)));
+            status.textContent = tbody.rows.length ? '' : 'No trades';
+            moreButton.dataset.cursor = data.next_cursor || '';
+            moreButton.classList.toggle('d-none', !data.next_cursor);
+        })
+        .catch(error => {
+            status.textContent = `Could not load trades (${error.message})`;
+        })
+        .finally(() => {
+            moreButton.disabled = false;
+        });
+}
+
+// One trade as a table row; text is set with textContent, never as HTML
+function positionTradeRow(trade) {
+    const row = document.createElement('tr');
+    let status = 'Open';
+    if (trade.is_closed) {
+        status = 'Closed';
+    } else if (trade.is_expired) {
+        status = 'Expired';
+    }
+    const values = [
+        trade.date,
+        trade.trade_type.charAt(0).toUpperCase() + trade.trade_type.slice(1),
+        trade.action.split('_').map(word => word.charAt(0).toUpperCase() + word.slice(1)).join(' '),
+        trade.quantity,
+        formatCurrency(trade.price),
+        trade.strike_price !== null ? formatCurrency(trade.strike_price) : '-',
+        trade.expiration_date || '-',
+        formatCurrency(trade.total_cost),
+        trade.is_closed ? formatCurrency(trade.realized_pnl) : '-',
+        status,
+    ];
+    values.forEach(value => {
+        const cell = document.createElement('td');
+        cell.textContent = value;
+        row.appendChild(cell);
+    });
+    if (trade.is_closed) {
+        row.cells[8].className = trade.realized_pnl >= 0 ? 'text-success' : 'text-danger';
+    }
+    return row;
+}
+
 // Format numbers with proper currency formatting
 function initializeNumberFormatting() {
     const numberInputs = document.querySelectorAll('input[type="number"], input[step]');
@@ -218,3 +354,123 @@ document.addEventListener('DOMContentLoaded', function() {
     initializeAdvancedFeatures();
     addFormSubmissionFeedback();
 });
+
+// Poll a background job's status until it finishes
+function initializeJobProgress() {
+    document.querySelectorAll('[data-job-url]').forEach(card => {
+        const status = card.querySelector('.job-status');
+        const bar = card.querySelector('.job-progress');
+        const message = card.querySelector('.job-message');
+        const cancel = card.querySelector('.job-cancel');
+        const finished = ['succeeded', 'failed', 'cancelled'];
+
+        function show(job) {
+            status.textContent = job.status;
+            status.className = 'badge job-status ' + ({succeeded: 'bg-success', failed: 'bg-danger',
+                                                       cancelled: 'bg-warning', running: 'bg-info'}[job.status] || 'bg-secondary');
+            if (job.progress_total) {
+                bar.style.width = Math.min(100, 100 * job.progress_done / job.progress_total) + '%';
+            }
+            if (job.status === 'succeeded' && job.result) {
+                message.textContent = `Imported ${job.result.imported} trades, ${job.result.failed} rows failed`;
+            } else {
+                message.textContent = job.error || job.message || '';
+            }
+            cancel.classList.toggle('d-none', finished.includes(job.status));
+        }
+
+        function poll() {
+            fetch(card.dataset.jobUrl)
+                .then(response => response.json())
+                .then(job => {
+                    show(job);
+                    if (!finished.includes(job.status)) {
+                        setTimeout(poll, 1000);
+                    }
+                })
+                .catch(() => setTimeout(poll, 5000));
+        }
+
+        cancel.addEventListener('click', () => {
+            fetch(card.dataset.cancelUrl, {method: 'POST'})
+                .then(response => response.json())
+                .then(show);
+        });
+        poll();
+    });
+}
+
+// Patch the dashboard's summary cards and trade table from the /stream server-sent events
+function initializeLiveDashboard() {
+    const tbody = document.querySelector('tbody[data-stream-url]');
+    if (!tbody || !window.EventSource) {
+        return;
+    }
+    const pageSize = parseInt(tbody.dataset.pageSize, 10);
+    const source = new EventSource(tbody.dataset.streamUrl);
+
+    // Rows are ordered newest first, by (date, id) as in the keyset pagination
+    function isAfter(row, date, id) {
+        const rowDate = row.dataset.date;
+        return rowDate < date || (rowDate === date && parseInt(row.dataset.tradeId, 10) < id);
+    }
+
+    function highlight(row) {
+        row.classList.add('table-warning');
+        setTimeout(() => row.classList.remove('table-warning'), 2000);
+    }
+
+    function upsert(event) {
+        const template = document.createElement('template');
+        template.innerHTML = event.html.trim();
+        const row = template.content.firstElementChild;
+        const existing = tbody.querySelector(`tr[data-trade-id="${event.trade_id}"]`);
+        if (existing) {
+            existing.remove();
+        } else if (!tbody.dataset.insert) {
+            // Later pages only update the trades they show
+            return;
+        }
+        const rows = Array.from(tbody.querySelectorAll('tr[data-trade-id]'));
+        const next = rows.find(other => isAfter(other, event.date, event.trade_id));
+        if (!next && rows.length >= pageSize) {
+            // Belongs on a later page
+            return;
+        }
+        tbody.querySelectorAll('tr:not([data-trade-id])').forEach(empty => empty.remove());
+        tbody.insertBefore(row, next || null);
+        const shown = tbody.querySelectorAll('tr[data-trade-id]');
+        if (shown.length > pageSize) {
+            shown[shown.length - 1].remove();
+        }
+        highlight(row);
+    }
+
+    source.addEventListener('trade', message => {
+        const event = JSON.parse(message.data);
+        if (event.change === 'reset') {
+            document.querySelectorAll('.live-reset').forEach(alert => alert.classList.remove('d-none'));
+        } else if (event.change === 'remove') {
+            const row = tbody.querySelector(`tr[data-trade-id="${event.trade_id}"]`);
+            if (row) {
+                row.remove();
+            }
+        } else if (event.change === 'upsert') {
+            upsert(event);
+        }
+    });
+
+    source.addEventListener('stats', message => {
+        const stats = JSON.parse(message.data).stats;
+        Object.entries(stats).forEach(([name, value]) => {
+            document.querySelectorAll(`[data-stat="${name}"]`).forEach(element => {
+                // Same format as the template's "$%.2f"
+                element.textContent = element.dataset.format === 'money' ? '$' + value.toFixed(2) : value;
+            });
+            document.querySelectorAll(`[data-stat-sign="${name}"]`).forEach(card => {
+                card.classList.toggle('bg-success', value >= 0);
+                card.classList.toggle('bg-danger', value < 0);
+            });
+        });
+    });
+}
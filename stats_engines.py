@@ -0,0 +1,29 @@
+from typing import Dict
+from flask import current_app
+from db_models import Trade
+from utils import calculate_portfolio_stats
+import aggregates
+import sql_stats
+
+STATS_ENGINES = ['aggregates', 'sql', 'numpy', 'python']
+
+def load_portfolio_stats(account_id: int, engine: str = None) -> Dict:
+    """An account's portfolio statistics from the engine selected by PORTFOLIO_STATS_ENGINE.
+
+    Only the python engine fills options_positions (option Trade objects by
+    symbol); the aggregates, sql and numpy engines leave it empty.
+    """
+    engine = engine or current_app.config['PORTFOLIO_STATS_ENGINE']
+
+    if engine == 'aggregates':
+        return aggregates.load_portfolio_stats(account_id)
+    if engine == 'sql':
+        return sql_stats.load_portfolio_stats(account_id)
+    if engine == 'numpy':
+        # NumPy is only imported when the engine is used
+        import vector_stats
+        return vector_stats.load_portfolio_stats(account_id)
+    if engine == 'python':
+        return calculate_portfolio_stats(Trade.query.filter(Trade.account_id == account_id).order_by(Trade.id).all())
+
+    raise ValueError(f'Unknown portfolio stats engine: {engine}')
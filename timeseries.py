@@ -0,0 +1,67 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+from collections import defaultdict
+from datetime import date
+from db_models import DailySymbolAggregate, DailyAggregate, Trade
+from aggregates import DAILY_COLUMNS, CUMULATIVE_COLUMNS, daily_deltas
+
+def _point(day: date, changes: Dict[str, float], totals: Dict[str, float]) -> Dict:
+    return dict(changes, **totals, date=day.isoformat())
+
+def _stored_points(model, query, start: Optional[date], end: Optional[date]) -> List[Dict]:
+    """Points for the daily aggregate rows of query between start and end (inclusive),
+    with the running totals stored on each row"""
+    query = query.order_by(model.day)
+    if start:
+        query = query.filter(model.day >= start)
+    if end:
+        query = query.filter(model.day <= end)
+
+    return [_point(row.day,
+                   {name: getattr(row, name) for name in DAILY_COLUMNS},
+                   {name: getattr(row, name) for name in CUMULATIVE_COLUMNS.values()})
+            for row in query]
+
+def portfolio_timeseries(account_id: int, start: Optional[date] = None, end: Optional[date] = None) -> List[Dict]:
+    """Daily points for an account's whole portfolio between start and end (inclusive).
+
+    Running totals are stored on every day, so only the days in the range are
+    read, whatever the length of the history.
+    """
+    return _stored_points(DailyAggregate, DailyAggregate.query.filter(DailyAggregate.account_id == account_id),
+                          start, end)
+
+def symbol_timeseries(account_id: int, symbol: str, start: Optional[date] = None,
+                      end: Optional[date] = None) -> List[Dict]:
+    """Daily points for one symbol of an account between start and end (inclusive).
+
+    Like portfolio_timeseries, reads only the days in the range, since each
+    symbol's running totals are stored on its days.
+    """
+    return _stored_points(DailySymbolAggregate,
+                          DailySymbolAggregate.query.filter(DailySymbolAggregate.account_id == account_id,
+                                                            DailySymbolAggregate.symbol == symbol.upper()),
+                          start, end)
+
+def _running_points(days: Iterable[Tuple[date, Dict[str, float]]], totals: Dict[str, float],
+                    start: Optional[date] = None) -> List[Dict]:
+    """Points for (day, daily changes) in day order, adding each day to the running totals;
+    days before start only count towards the totals"""
+    points = []
+    for day, changes in days:
+        for change_name, total_name in CUMULATIVE_COLUMNS.items():
+            totals[total_name] += changes[change_name]
+        if start is None or day >= start:
+            points.append(_point(day, changes, totals))
+    return points
+
+def trades_timeseries(trades: Iterable[Trade], start: Optional[date] = None,
+                      end: Optional[date] = None) -> List[Dict]:
+    """Daily points between start and end (inclusive) summed from the trades themselves,
+    for trades kept outside the database and its daily aggregates"""
+    days = defaultdict(lambda: dict.fromkeys(DAILY_COLUMNS, 0))
+    for trade in trades:
+        for day, deltas in daily_deltas(trade).items():
+            for name, value in deltas.items():
+                days[day][name] += value
+    return _running_points(((day, days[day]) for day in sorted(days) if end is None or day <= end),
+                           dict.fromkeys(CUMULATIVE_COLUMNS.values(), 0.0), start)
@@ -0,0 +1,476 @@
+import threading
+import time
+from collections import deque
+from datetime import date, datetime
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from flask import current_app, g
+from sqlalchemy import bindparam, delete, select, update
+from sqlalchemy.orm.attributes import set_committed_value
+from app import db
+from db_models import Trade, DataVersion, DEFAULT_ACCOUNT_ID, expiry_cutoff
+from forms import FilterForm
+from models import TradeManager
+from queries import filter_trades_query, format_cursor, parse_cursor, KeysetPage
+from utils import calculate_portfolio_stats, calculate_positions
+import accounts
+import aggregates
+import cache
+import changes
+import expiry
+import exporter
+import importer
+import jobs
+import journal
+import lots
+import sql_stats
+import stats_engines
+import timeseries
+
+TRADE_STORES = ['sql', 'memory']
+
+class SqlTradeStore:
+    """Trades in the database; writes update the account's aggregates and data version in the same transaction"""
+
+    def data_version(self, account_id: int) -> int:
+        version = db.session.execute(select(DataVersion.version).where(DataVersion.id == account_id)).scalar()
+        return version or 0
+
+    def accounts(self) -> List[Tuple[int, str]]:
+        """(id, name) of every account"""
+        return [(account.id, account.name) for account in accounts.list_accounts()]
+
+    def create_account(self, name: str) -> int:
+        return accounts.create_account(name).id
+
+    def get(self, account_id: int, trade_id: int) -> Optional[Trade]:
+        """The trade, if it is in the account"""
+        trade = db.session.get(Trade, trade_id)
+        return trade if trade is not None and trade.account_id == account_id else None
+
+    def add(self, account_id: int, values: Dict) -> Trade:
+        trade = Trade(**values, account_id=account_id)
+        db.session.add(trade)
+        # The change log needs the new trade's id
+        db.session.flush()
+        aggregates.apply_trade(trade)
+        changes.record_change(account_id, changes.ADDED, trade.id)
+        journal.record(account_id, journal.CREATED, [(trade.id, journal.trade_values(trade))])
+        cache.bump_data_version(account_id)
+        db.session.commit()
+        jobs.queue_snapshot_if_due(account_id)
+        return trade
+
+    def update(self, trade: Trade, values: Dict) -> Trade:
+        # Take the old values out of the aggregates before overwriting them
+        aggregates.revert_trade(trade)
+        for key, value in values.items():
+            setattr(trade, key, value)
+        aggregates.apply_trade(trade)
+        changes.record_change(trade.account_id, changes.UPDATED, trade.id)
+        journal.record(trade.account_id, journal.UPDATED, [(trade.id, values)])
+        cache.bump_data_version(trade.account_id)
+        cache.forget_trade_rows([trade.id])
+        account_id = trade.account_id
+        db.session.commit()
+        jobs.queue_snapshot_if_due(account_id)
+        return trade
+
+    def delete(self, trade: Trade):
+        aggregates.revert_trade(trade)
+        db.session.delete(trade)
+        changes.record_change(trade.account_id, changes.DELETED, trade.id)
+        journal.record(trade.account_id, journal.DELETED, [(trade.id, None)])
+        cache.bump_data_version(trade.account_id)
+        cache.forget_trade_rows([trade.id])
+        account_id = trade.account_id
+        db.session.commit()
+        jobs.queue_snapshot_if_due(account_id)
+
+    def get_many(self, account_id: int, trade_ids: List[int], batch_size: int = 1000) -> Dict[int, Trade]:
+        """The trades among trade_ids that are in the account, by id"""
+        found = {}
+        for start in range(0, len(trade_ids), batch_size):
+            chunk = trade_ids[start:start + batch_size]
+            query = select(Trade).where(Trade.id.in_(chunk), Trade.account_id == account_id)
+            found.update((trade.id, trade) for trade in db.session.execute(query).scalars())
+        return found
+
+    def bulk_add(self, account_id: int, values: List[Dict]) -> List[int]:
+        """Add trades in one transaction; returns their ids in order"""
+        ids = importer.insert_trades(account_id, values)
+        db.session.commit()
+        jobs.queue_snapshot_if_due(account_id)
+        return ids
+
+    def bulk_update(self, account_id: int, edits: List[Tuple[Trade, Dict]], batch_size: int = 1000):
+        """Write (trade, changed values) pairs in one transaction.
+
+        Trades given the same changes share an UPDATE ... WHERE id IN (...); the rest
+        go through one executemany UPDATE per set of changed columns.
+        """
+        table = Trade.__table__
+        groups: Dict[Tuple, List[int]] = {}
+        for trade, values in edits:
+            groups.setdefault(tuple(sorted(values.items())), []).append(trade.id)
+        singles: Dict[Tuple[str, ...], List[Dict]] = {}
+        for key, ids in groups.items():
+            if len(ids) == 1:
+                singles.setdefault(tuple(name for name, _ in key), []).append(
+                    dict({f'new_{name}': value for name, value in key}, trade_id=ids[0]))
+                continue
+            for start in range(0, len(ids), batch_size):
+                db.session.execute(update(table)
+                                   .where(table.c.id.in_(ids[start:start + batch_size]), table.c.account_id == account_id)
+                                   .values(dict(key)))
+        for names, rows in singles.items():
+            stmt = (update(table)
+                    .where(table.c.id == bindparam('trade_id'), table.c.account_id == account_id)
+                    .values({name: bindparam(f'new_{name}') for name in names}))
+            db.session.execute(stmt, rows)
+
+        # The loaded trades still hold the old values, which come out of the aggregates first
+        trades = [trade for trade, _ in edits]
+        aggregates.apply_trades(trades, sign=-1)
+        for trade, values in edits:
+            for name, value in values.items():
+                set_committed_value(trade, name, value)
+        aggregates.apply_trades(trades)
+        changes.record_change(account_id, changes.RESET)
+        journal.record(account_id, journal.UPDATED, [(trade.id, values) for trade, values in edits])
+        cache.bump_data_version(account_id)
+        cache.forget_trade_rows(trade.id for trade in trades)
+        db.session.commit()
+        jobs.queue_snapshot_if_due(account_id)
+
+    def bulk_delete(self, account_id: int, trades: List[Trade], batch_size: int = 1000):
+        """Delete trades in one transaction"""
+        table = Trade.__table__
+        ids = [trade.id for trade in trades]
+        for start in range(0, len(ids), batch_size):
+            db.session.execute(delete(table).where(table.c.id.in_(ids[start:start + batch_size]),
+                                                   table.c.account_id == account_id))
+        aggregates.apply_trades(trades, sign=-1)
+        changes.record_change(account_id, changes.RESET)
+        journal.record(account_id, journal.DELETED, [(trade_id, None) for trade_id in ids])
+        cache.bump_data_version(account_id)
+        cache.forget_trade_rows(ids)
+        # The rows are gone; the loaded objects must not be flushed or refreshed
+        for trade in trades:
+            db.session.expunge(trade)
+        db.session.commit()
+        jobs.queue_snapshot_if_due(account_id)
+
+    def portfolio_at(self, account_id: int, at: datetime) -> Optional[journal.PointInTime]:
+        return journal.portfolio_at(account_id, at)
+
+    def last_change_id(self, account_id: int) -> int:
+        return changes.last_change_id(account_id)
+
+    def changes_since(self, account_id: int, after_id: int) -> Optional[List]:
+        """The account's changes after after_id for the dashboard stream; None if they are no
+        longer all kept"""
+        return changes.changes_since(account_id, after_id)
+
+    def changed_trades(self, account_id: int, filter_form: FilterForm, trade_ids: Iterable[int]) -> List[Trade]:
+        """The trades among trade_ids that are in the account and pass the dashboard's filters"""
+        return filter_trades_query(account_id, filter_form).filter(Trade.id.in_(list(trade_ids))).all()
+
+    def sweep_expired(self, now: Optional[datetime] = None) -> List[Trade]:
+        """Close expired option positions at zero value; returns the trades closed"""
+        return expiry.sweep_expired_options(now)
+
+    def option_valuation(self, account_id: int, snapshot) -> Dict:
+        """An account's open options marked to a valuation.PriceSnapshot"""
+        # NumPy is only imported when a price file is configured
+        import valuation
+        return valuation.value_positions(valuation.load_open_options(account_id), snapshot)
+
+    def rollback(self):
+        db.session.rollback()
+
+    def page(self, account_id: int, filter_form: FilterForm, page_size: int,
+             cursor: Optional[str] = None) -> KeysetPage:
+        return KeysetPage(filter_trades_query(account_id, filter_form), page_size, cursor)
+
+    def iter_trades(self, account_id: int, filter_form: FilterForm) -> Iterator[Trade]:
+        """Every trade that passes the dashboard's filters, in dashboard order, for the exports"""
+        return exporter.iter_trades(filter_trades_query(account_id, filter_form))
+
+    def lot_book(self, account_id: int, method: str, symbol: str, selections: lots.Selections) -> lots.LotBook:
+        """Lot matching for one symbol of an account"""
+        return lots.build_lot_book(account_id, method, symbol, selections=selections)
+
+    def daily_timeseries(self, account_id: int, symbol: Optional[str], start: Optional[date],
+                         end: Optional[date]) -> List[Dict]:
+        """Daily points for one symbol, or the whole portfolio, from the daily aggregates"""
+        if symbol:
+            return timeseries.symbol_timeseries(account_id, symbol, start, end)
+        return timeseries.portfolio_timeseries(account_id, start, end)
+
+    def portfolio_stats(self, account_id: int) -> Dict:
+        return stats_engines.load_portfolio_stats(account_id)
+
+    def portfolio_page_data(self, account_id: int) -> Tuple[Dict, Dict]:
+        """Stats and per-symbol positions for an account's portfolio page"""
+        if current_app.config['PORTFOLIO_STATS_ENGINE'] == 'sql':
+            return sql_stats.load_portfolio_page_data(account_id)
+        # One aggregate row per symbol instead of every trade
+        rows = aggregates.load_symbol_aggregates(account_id)
+        if current_app.config['PORTFOLIO_STATS_ENGINE'] == 'aggregates':
+            portfolio_stats = aggregates.portfolio_stats_from_aggregates(rows, account_id)
+        else:
+            portfolio_stats = stats_engines.load_portfolio_stats(account_id)
+        return portfolio_stats, aggregates.positions_from_aggregates(rows)
+
+class ListPage:
+    """A page of trades already fetched, with the same attributes as KeysetPage"""
+
+    def __init__(self, trades, page_size: int, cursor: Optional[str] = None):
+        self.page_size = page_size
+        self.cursor = cursor
+        self.trades = trades[:page_size]
+        self.count = len(self.trades)
+        # One trade beyond the page means there is a next page
+        self.next_cursor = format_cursor(self.trades[-1]) if len(trades) > page_size else None
+
+    def __iter__(self):
+        return iter(self.trades)
+
+class Change(NamedTuple):
+    """A memory store write, with the attributes of db_models.TradeChange the stream reads"""
+    id: int
+    change: str
+    trade_id: Optional[int]
+
+class MemoryTradeStore:
+    """Trades held in one indexed models.TradeManager per account, for tests and ephemeral deployments.
+
+    Nothing is written to the database; stats are recomputed from the account's
+    trades and cached under the store's own data version for the account.
+    """
+
+    def __init__(self):
+        self.managers: Dict[int, TradeManager] = {}
+        self.account_names: Dict[int, str] = {DEFAULT_ACCOUNT_ID: 'Default'}
+        self._lock = threading.Lock()
+        # Trade ids are unique across accounts, as in the database
+        self._next_id = 1
+        # Starts from the clock so ETags from an earlier process never match
+        self._started = time.time_ns()
+        self._versions: Dict[int, int] = {}
+        # The last changes of each account, for the dashboard stream
+        self._changes: Dict[int, deque] = {}
+        self._journal = journal.MemoryJournal()
+
+    def data_version(self, account_id: int) -> int:
+        return self._versions.get(account_id, self._started)
+
+    def _bump_data_version(self, account_id: int):
+        self._versions[account_id] = self.data_version(account_id) + 1
+        g.pop('data_version', None)
+
+    def _record_change(self, account_id: int, change: str, trade_id: Optional[int] = None):
+        log = self._changes.setdefault(account_id, deque(maxlen=changes.CHANGE_BACKLOG))
+        log.append(Change(log[-1].id + 1 if log else 1, change, trade_id))
+
+    def _record_events(self, account_id: int, kind: str, events: List[Tuple[int, Optional[Dict]]]):
+        self._journal.record(account_id, kind, events, current_app.config['JOURNAL_SNAPSHOT_INTERVAL'])
+
+    def portfolio_at(self, account_id: int, at: datetime) -> journal.PointInTime:
+        with self._lock:
+            return self._journal.portfolio_at(account_id, at)
+
+    def last_change_id(self, account_id: int) -> int:
+        log = self._changes.get(account_id)
+        return log[-1].id if log else 0
+
+    def changes_since(self, account_id: int, after_id: int) -> Optional[List[Change]]:
+        with self._lock:
+            log = list(self._changes.get(account_id, ()))
+        # Change ids count up by one per account, so a gap means some were dropped
+        if log and log[0].id > after_id + 1:
+            return None
+        return [change for change in log if change.id > after_id]
+
+    def accounts(self) -> List[Tuple[int, str]]:
+        return sorted(self.account_names.items())
+
+    def create_account(self, name: str) -> int:
+        name = name.strip()
+        if not name:
+            raise ValueError('Account name is required')
+        with self._lock:
+            if name in self.account_names.values():
+                raise ValueError(f'Account {name} already exists')
+            account_id = max(self.account_names) + 1
+            self.account_names[account_id] = name
+        return account_id
+
+    def _manager(self, account_id: int) -> TradeManager:
+        # An account without trades reads as an empty manager, which isn't kept
+        return self.managers.get(account_id) or TradeManager()
+
+    def get(self, account_id: int, trade_id: int) -> Optional[Trade]:
+        return self._manager(account_id).get_trade(trade_id)
+
+    def _new_trade(self, account_id: int, values: Dict) -> Trade:
+        """A trade with the next id, stored in the account; call with the lock held"""
+        # Column defaults are applied on INSERT, so set the ones the pages read
+        trade = Trade(**dict({'fees': 0.0, 'is_closed': False, 'notes': ''}, **values),
+                      account_id=account_id, created_at=datetime.utcnow(), id=self._next_id)
+        self._next_id += 1
+        return self.managers.setdefault(account_id, TradeManager()).insert(trade)
+
+    def get_many(self, account_id: int, trade_ids: List[int]) -> Dict[int, Trade]:
+        with self._lock:
+            manager = self._manager(account_id)
+            trades = [manager.get_trade(trade_id) for trade_id in trade_ids]
+        return {trade.id: trade for trade in trades if trade is not None}
+
+    def add(self, account_id: int, values: Dict) -> Trade:
+        with self._lock:
+            trade = self._new_trade(account_id, values)
+            self._record_change(account_id, changes.ADDED, trade.id)
+            self._record_events(account_id, journal.CREATED, [(trade.id, journal.trade_values(trade))])
+            self._bump_data_version(account_id)
+        return trade
+
+    def update(self, trade: Trade, values: Dict) -> Trade:
+        with self._lock:
+            self.managers[trade.account_id].update_fields(trade.id, dict(values, updated_at=datetime.utcnow()))
+            self._record_change(trade.account_id, changes.UPDATED, trade.id)
+            self._record_events(trade.account_id, journal.UPDATED, [(trade.id, values)])
+            self._bump_data_version(trade.account_id)
+        cache.forget_trade_rows([trade.id])
+        return trade
+
+    def delete(self, trade: Trade):
+        with self._lock:
+            self.managers[trade.account_id].delete_trade(trade.id)
+            self._record_change(trade.account_id, changes.DELETED, trade.id)
+            self._record_events(trade.account_id, journal.DELETED, [(trade.id, None)])
+            self._bump_data_version(trade.account_id)
+        cache.forget_trade_rows([trade.id])
+
+    def bulk_add(self, account_id: int, values: List[Dict]) -> List[int]:
+        with self._lock:
+            trades = [self._new_trade(account_id, trade_values) for trade_values in values]
+            self._record_change(account_id, changes.RESET)
+            self._record_events(account_id, journal.CREATED, [(trade.id, journal.trade_values(trade))
+                                                              for trade in trades])
+            self._bump_data_version(account_id)
+        return [trade.id for trade in trades]
+
+    def bulk_update(self, account_id: int, edits: List[Tuple[Trade, Dict]]):
+        now = datetime.utcnow()
+        with self._lock:
+            manager = self.managers[account_id]
+            for trade, values in edits:
+                manager.update_fields(trade.id, dict(values, updated_at=now))
+            self._record_change(account_id, changes.RESET)
+            self._record_events(account_id, journal.UPDATED, [(trade.id, values) for trade, values in edits])
+            self._bump_data_version(account_id)
+        cache.forget_trade_rows(trade.id for trade, _ in edits)
+
+    def bulk_delete(self, account_id: int, trades: List[Trade]):
+        with self._lock:
+            manager = self.managers[account_id]
+            for trade in trades:
+                manager.delete_trade(trade.id)
+            self._record_change(account_id, changes.RESET)
+            self._record_events(account_id, journal.DELETED, [(trade.id, None) for trade in trades])
+            self._bump_data_version(account_id)
+        cache.forget_trade_rows(trade.id for trade in trades)
+
+    def sweep_expired(self, now: Optional[datetime] = None) -> List[Trade]:
+        expired_before = expiry_cutoff(now)
+        swept = []
+        with self._lock:
+            for account_id, manager in self.managers.items():
+                trades = [trade for trade in manager.trades if expiry.is_sweepable(trade, expired_before)]
+                closes = [(trade.id, expiry.close_values(trade)) for trade in trades]
+                for trade_id, values in closes:
+                    manager.update_fields(trade_id, dict(values, updated_at=datetime.utcnow()))
+                if trades:
+                    self._record_change(account_id, changes.RESET)
+                    self._record_events(account_id, journal.UPDATED, closes)
+                    self._bump_data_version(account_id)
+                swept.extend(trades)
+        return swept
+
+    def rollback(self):
+        pass
+
+    @staticmethod
+    def _filters(filter_form: FilterForm) -> Dict:
+        if not filter_form.validate():
+            return {}
+        return {name: filter_form[name].data for name in
+                ['trade_type', 'action', 'symbol', 'symbol_match', 'date_from', 'date_to']}
+
+    def page(self, account_id: int, filter_form: FilterForm, page_size: int,
+             cursor: Optional[str] = None) -> ListPage:
+        filters = self._filters(filter_form)
+        with self._lock:
+            trades = self._manager(account_id).filter_trades(filters, limit=page_size + 1,
+                                                             before=parse_cursor(cursor))
+        return ListPage(trades, page_size, cursor)
+
+    def iter_trades(self, account_id: int, filter_form: FilterForm) -> Iterator[Trade]:
+        filters = self._filters(filter_form)
+        with self._lock:
+            return iter(self._manager(account_id).filter_trades(filters))
+
+    def _trades_by_date(self, account_id: int, symbol: Optional[str] = None) -> List[Trade]:
+        """An account's trades, or one symbol's, in (date, id) order"""
+        filters = {'symbol': symbol, 'symbol_match': 'exact'} if symbol else {}
+        with self._lock:
+            return self._manager(account_id).filter_trades(filters)[::-1]
+
+    def lot_book(self, account_id: int, method: str, symbol: str, selections: lots.Selections) -> lots.LotBook:
+        return lots.LotBook(method, selections=selections).apply_all(
+            lots.executions_in_order(self._trades_by_date(account_id, symbol)))
+
+    def daily_timeseries(self, account_id: int, symbol: Optional[str], start: Optional[date],
+                         end: Optional[date]) -> List[Dict]:
+        # There are no daily aggregates, so the days are summed from the trades
+        return timeseries.trades_timeseries(self._trades_by_date(account_id, symbol), start, end)
+
+    def changed_trades(self, account_id: int, filter_form: FilterForm, trade_ids: Iterable[int]) -> List[Trade]:
+        # The same filters as the page, run over just these trades
+        changed = TradeManager()
+        with self._lock:
+            manager = self._manager(account_id)
+            for trade_id in trade_ids:
+                trade = manager.get_trade(trade_id)
+                if trade is not None:
+                    changed.insert(trade)
+        return changed.filter_trades(self._filters(filter_form))
+
+    def _trades_by_id(self, account_id: int):
+        with self._lock:
+            return sorted(self._manager(account_id).trades, key=lambda t: t.id)
+
+    def portfolio_stats(self, account_id: int) -> Dict:
+        return calculate_portfolio_stats(self._trades_by_id(account_id))
+
+    def portfolio_page_data(self, account_id: int) -> Tuple[Dict, Dict]:
+        trades = self._trades_by_id(account_id)
+        return calculate_portfolio_stats(trades), calculate_positions(trades)
+
+    def option_valuation(self, account_id: int, snapshot) -> Dict:
+        import valuation
+        return valuation.value_positions(valuation.open_options_from_trades(self._trades_by_id(account_id)),
+                                         snapshot)
+
+def get_trade_store():
+    """The app's trade store, chosen by TRADE_STORE"""
+    if 'trade_store' not in current_app.extensions:
+        name = current_app.config['TRADE_STORE']
+        if name == 'sql':
+            current_app.extensions['trade_store'] = SqlTradeStore()
+        elif name == 'memory':
+            current_app.extensions['trade_store'] = MemoryTradeStore()
+        else:
+            raise ValueError(f'Unknown trade store: {name}')
+    return current_app.extensions['trade_store']
@@ -1,5 +1,5 @@
 from typing import List, Dict
-from db_models import Trade, TradeAction, TradeType
+from db_models import Trade, TradeAction, TradeType, expiry_cutoff
 from datetime import datetime
 from collections import defaultdict
 
@@ -31,12 +31,14 @@ def calculate_portfolio_stats(trades: List[Trade]) -> Dict:
     
     # Track positions by symbol
     symbol_pnl = defaultdict(float)
+    # Trade.is_expired, with the clock read once rather than per option
+    expired_before = expiry_cutoff()
     
     for trade in trades:
         # Basic counting
         if trade.is_option:
             stats['options_trades'] += 1
-            if trade.is_expired:
+            if trade.expiration_date and trade.expiration_date < expired_before:
                 stats['expired_options'] += 1
             else:
                 stats['active_options'] += 1
@@ -102,6 +104,58 @@ def calculate_portfolio_stats(trades: List[Trade]) -> Dict:
     
     return stats
 
+def calculate_positions(trades: List[Trade]) -> Dict:
+    """Per-symbol trade counts and buy/sell totals for the portfolio positions table"""
+    positions = {}
+    for trade in sorted(trades, key=lambda t: t.symbol):
+        position = positions.setdefault(trade.symbol, {
+            'symbol': trade.symbol,
+            'stock_trades': 0,
+            'options_trades': 0,
+            'total_cost': 0,
+            'total_proceeds': 0,
+        })
+        
+        if trade.is_option:
+            position['options_trades'] += 1
+        else:
+            position['stock_trades'] += 1
+        
+        if trade.action in [TradeAction.BUY_TO_OPEN, TradeAction.BUY_TO_CLOSE]:
+            position['total_cost'] += trade.total_cost
+        else:
+            position['total_proceeds'] += trade.total_cost
+    
+    return positions
+
+def signed_quantity(trade_type: str, action: str, quantity: int) -> int:
+    """Sell options are stored with a negative quantity; everything else is positive"""
+    if trade_type in ['call', 'put'] and action in ['sell_to_open', 'sell_to_close']:
+        return -abs(quantity)
+    return abs(quantity)
+
+def trade_values_from_form(form) -> Dict:
+    """Trade column values from a validated TradeForm"""
+    is_option = form.trade_type.data in ['call', 'put']
+    return {
+        'symbol': form.symbol.data.upper(),
+        'trade_type': TradeType(form.trade_type.data),
+        'action': TradeAction(form.action.data),
+        'quantity': signed_quantity(form.trade_type.data, form.action.data, form.quantity.data),
+        'price': form.price.data,
+        'date': form.date.data,
+        'fees': form.fees.data or 0.0,
+        'is_closed': form.is_closed.data,
+        'closed_date': form.closed_date.data if form.is_closed.data else None,
+        'close_price': form.close_price.data if form.is_closed.data else None,
+        'close_quantity': form.close_quantity.data if form.is_closed.data else None,
+        'notes': form.notes.data or "",
+        # Options-specific fields; the price field is the premium for options
+        'strike_price': form.strike_price.data if is_option else None,
+        'expiration_date': form.expiration_date.data if is_option else None,
+        'premium': form.price.data if is_option else None,
+    }
+
 def format_currency(amount: float) -> str:
     """Format amount as currency"""
     return f"${amount:,.2f}"
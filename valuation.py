@@ -0,0 +1,201 @@
+import csv
+import math
+import os
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Dict, Iterable, Optional, Tuple
+import numpy as np
+from flask import current_app
+from sqlalchemy import select
+from app import db
+from db_models import Trade, TradeType, TradeAction, expiry_cutoff
+import expiry
+
+# Value, then the Greeks per contract: delta and gamma in shares, theta in dollars per
+# calendar day, vega in dollars per volatility point
+MEASURES = ['market_value', 'unrealized_pnl', 'delta', 'gamma', 'theta', 'vega']
+
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+
+@dataclass
+class PriceSnapshot:
+    """Underlying prices (and optional volatilities) read from one version of the price file"""
+    key: Tuple
+    as_of: datetime
+    prices: Dict[str, float] = field(default_factory=dict)
+    volatilities: Dict[str, float] = field(default_factory=dict)
+
+def _file_key(path: str) -> Tuple:
+    """Changes whenever the file is replaced or rewritten"""
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+def _price_rows(path: str) -> Iterable[Dict]:
+    if path.lower().endswith(PARQUET_EXTENSIONS):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError('Reading a Parquet price file needs pyarrow; use a CSV file or install it')
+        return pyarrow.parquet.read_table(path).to_pylist()
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        return list(csv.DictReader(f))
+
+def read_price_file(path: str) -> PriceSnapshot:
+    """symbol and price columns, plus volatility (annualized, 0.25 for 25%) where known"""
+    key = _file_key(path)
+    snapshot = PriceSnapshot(key=key, as_of=datetime.fromtimestamp(key[1] / 1e9))
+    for line, row in enumerate(_price_rows(path), start=2):
+        symbol = str(row.get('symbol') or '').strip().upper()
+        if not symbol or row.get('price') in (None, ''):
+            raise ValueError(f'{path} line {line}: symbol and price are required')
+        snapshot.prices[symbol] = float(row['price'])
+        if row.get('volatility') not in (None, ''):
+            snapshot.volatilities[symbol] = float(row['volatility'])
+    return snapshot
+
+def get_price_snapshot() -> Optional[PriceSnapshot]:
+    """The current PRICE_FILE, re-read only when the file changes; None if there is none"""
+    path = current_app.config['PRICE_FILE']
+    if not path or not os.path.exists(path):
+        return None
+    snapshot = current_app.extensions.get('price_snapshot')
+    if snapshot is None or snapshot.key != _file_key(path):
+        snapshot = current_app.extensions['price_snapshot'] = read_price_file(path)
+    return snapshot
+
+def option_columns(rows: Iterable[Tuple]) -> Dict[str, np.ndarray]:
+    """(symbol, trade_type, action, quantity, strike_price, expiration_date, total_cost) rows as arrays.
+
+    Symbols are integer codes, as in vector_stats; 'symbols' maps them back to names.
+    """
+    rows = list(rows)
+    symbol, trade_type, action, quantity, strike, expiration, total_cost = zip(*rows) if rows else [()] * 7
+    symbol_codes = {}
+    return {
+        'symbol_code': np.array([symbol_codes.setdefault(s, len(symbol_codes)) for s in symbol], dtype=np.int64),
+        'symbols': np.array(list(symbol_codes), dtype=object),
+        'is_call': np.array([t is TradeType.CALL for t in trade_type], dtype=bool),
+        'is_short': np.array([a is TradeAction.SELL_TO_OPEN for a in action], dtype=bool),
+        'quantity': np.abs(np.array(quantity, dtype=np.float64)),
+        'strike': np.array(strike, dtype=np.float64),
+        'expiration': np.array([d.toordinal() for d in expiration], dtype=np.int64),
+        'total_cost': np.array(total_cost, dtype=np.float64),
+    }
+
+def load_open_options(account_id: int, expired_before: Optional[date] = None) -> Dict[str, np.ndarray]:
+    """An account's open option positions that have not expired, read from the database as arrays"""
+    expired_before = expired_before or expiry_cutoff()
+    stmt = select(Trade.symbol, Trade.trade_type, Trade.action, Trade.quantity, Trade.strike_price,
+                  Trade.expiration_date, Trade.total_cost) \
+        .where(Trade.account_id == account_id,
+               Trade.is_closed == False,  # noqa: E712
+               Trade.expiration_date >= expired_before,
+               Trade.is_option,
+               Trade.action.in_(expiry.OPENING_ACTIONS),
+               Trade.strike_price.isnot(None))
+    return option_columns(db.session.execute(stmt))
+
+def open_options_from_trades(trades: Iterable[Trade], expired_before: Optional[date] = None) -> Dict[str, np.ndarray]:
+    """load_open_options for trades already in memory"""
+    expired_before = expired_before or expiry_cutoff()
+    return option_columns((t.symbol, t.trade_type, t.action, t.quantity, t.strike_price, t.expiration_date,
+                           t.total_cost)
+                          for t in trades
+                          if t.is_option and not t.is_closed and t.action in expiry.OPENING_ACTIONS
+                          and t.strike_price is not None and t.expiration_date is not None
+                          and t.expiration_date >= expired_before)
+
+def _erf(x: np.ndarray) -> np.ndarray:
+    # Abramowitz & Stegun 7.1.26, absolute error below 1.5e-7
+    sign = np.sign(x)
+    x = np.abs(x)
+    t = 1.0 / (1.0 + 0.3275911 * x)
+    poly = ((((1.061405429 * t - 1.453152027) * t + 1.421413741) * t - 0.284496736) * t + 0.254829592) * t
+    return sign * (1.0 - poly * np.exp(-x * x))
+
+def norm_cdf(x: np.ndarray) -> np.ndarray:
+    return 0.5 * (1.0 + _erf(x / math.sqrt(2.0)))
+
+def norm_pdf(x: np.ndarray) -> np.ndarray:
+    return np.exp(-0.5 * x * x) / math.sqrt(2.0 * math.pi)
+
+def black_scholes(spot: np.ndarray, strike: np.ndarray, years: np.ndarray, volatility: np.ndarray,
+                  rate: float, is_call: np.ndarray) -> Dict[str, np.ndarray]:
+    """European option value and Greeks per share, no dividends.
+
+    theta is per calendar day and vega per volatility point (0.01).
+    """
+    sqrt_years = np.sqrt(years)
+    vol_sqrt_years = volatility * sqrt_years
+    d1 = (np.log(spot / strike) + (rate + 0.5 * volatility * volatility) * years) / vol_sqrt_years
+    d2 = d1 - vol_sqrt_years
+    cdf_d1 = norm_cdf(d1)
+    cdf_d2 = norm_cdf(d2)
+    pdf_d1 = norm_pdf(d1)
+    discounted_strike = strike * np.exp(-rate * years)
+
+    call_value = spot * cdf_d1 - discounted_strike * cdf_d2
+    # Put-call parity
+    put_value = call_value - spot + discounted_strike
+    time_decay = -spot * pdf_d1 * volatility / (2.0 * sqrt_years)
+    return {
+        'value': np.where(is_call, call_value, put_value),
+        'delta': np.where(is_call, cdf_d1, cdf_d1 - 1.0),
+        'gamma': pdf_d1 / (spot * vol_sqrt_years),
+        'theta': np.where(is_call,
+                          time_decay - rate * discounted_strike * cdf_d2,
+                          time_decay + rate * discounted_strike * (1.0 - cdf_d2)) / 365.0,
+        'vega': spot * pdf_d1 * sqrt_years / 100.0,
+    }
+
+def value_options(options: Dict[str, np.ndarray], snapshot: PriceSnapshot, rate: float,
+                  default_volatility: float, today: Optional[date] = None) -> Dict:
+    """Mark every open option to its underlying's price in one pass.
+
+    Returns totals and per-symbol sums of MEASURES for the positions, counting
+    contracts whose underlying has no price as unpriced.
+    """
+    today = today or date.today()
+    symbols = options['symbols']
+    codes = options['symbol_code']
+    spot = np.array([snapshot.prices.get(symbol, np.nan) for symbol in symbols], dtype=np.float64)[codes]
+    volatility = np.array([snapshot.volatilities.get(symbol, default_volatility) for symbol in symbols],
+                          dtype=np.float64)[codes]
+    years = (options['expiration'] - today.toordinal()) / 365.0
+    priced = (spot > 0) & (options['strike'] > 0) & (volatility > 0) & (years > 0)
+
+    greeks = black_scholes(spot[priced], options['strike'][priced], years[priced], volatility[priced],
+                           rate, options['is_call'][priced])
+    # Shares per position, negative when short
+    shares = np.where(options['is_short'][priced], -100.0, 100.0) * options['quantity'][priced]
+    market_value = greeks['value'] * shares
+    values = {
+        'market_value': market_value,
+        'unrealized_pnl': market_value - options['total_cost'][priced],
+        'delta': greeks['delta'] * shares,
+        'gamma': greeks['gamma'] * shares,
+        'theta': greeks['theta'] * shares,
+        'vega': greeks['vega'] * shares,
+    }
+
+    priced_codes = codes[priced]
+    sums = {name: np.bincount(priced_codes, weights=values[name], minlength=len(symbols)) for name in MEASURES}
+    counts = np.bincount(priced_codes, minlength=len(symbols))
+    by_symbol = {}
+    for code, symbol in sorted(enumerate(symbols), key=lambda item: item[1]):
+        if counts[code]:
+            by_symbol[symbol] = dict({name: float(sums[name][code]) for name in MEASURES},
+                                     positions=int(counts[code]),
+                                     underlying_price=snapshot.prices[symbol])
+    return {
+        'as_of': snapshot.as_of,
+        'positions': int(priced.sum()),
+        'unpriced': int((~priced).sum()),
+        'totals': {name: float(values[name].sum()) for name in MEASURES},
+        'symbols': by_symbol,
+    }
+
+def value_positions(options: Dict[str, np.ndarray], snapshot: PriceSnapshot) -> Dict:
+    """value_options with the app's RISK_FREE_RATE and DEFAULT_VOLATILITY"""
+    return value_options(options, snapshot, current_app.config['RISK_FREE_RATE'],
+                         current_app.config['DEFAULT_VOLATILITY'])
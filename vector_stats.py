@@ -0,0 +1,178 @@
+from typing import Dict, Optional
+from datetime import date, datetime
+import numpy as np
+from sqlalchemy import Integer, cast, func, select
+from app import db
+from db_models import Trade, TradeAction, expiry_cutoff
+from utils import calculate_portfolio_stats
+
+COLUMN_DTYPES = {
+    'symbol_code': np.int64,
+    'is_option': bool,
+    'is_sell': bool,
+    'is_buy_to_open': bool,
+    'quantity': np.int64,
+    'price': np.float64,
+    'fees': np.float64,
+    'is_closed': bool,
+    'close_price': np.float64,
+    'has_close_price': bool,
+    'close_quantity': np.int64,
+    'expiration': np.int64,
+}
+
+def _date_ordinal(column):
+    """SQL for date.toordinal() of a date column (SQLite and Postgres)"""
+    if db.session.get_bind().dialect.name == 'sqlite':
+        # Julian day 1721424.5 is midnight before 0001-01-01, ordinal 1
+        return cast(func.julianday(column) - 1721424.5, Integer)
+    return column - date(1, 1, 1) + 1
+
+def load_trade_columns(account_id: int) -> Dict[str, np.ndarray]:
+    """Read an account's trades into one NumPy array per column, in id order.
+
+    The database turns every column into a plain number, so the rows go straight
+    from the DBAPI cursor into a structured array. Symbols are stored as integer
+    codes numbered in order of first appearance; 'symbols' maps the codes back
+    to symbol names.
+    """
+    codes = (select(Trade.symbol, (func.row_number().over(order_by=func.min(Trade.id)) - 1).label('code'))
+             .where(Trade.account_id == account_id).group_by(Trade.symbol).subquery())
+    stmt = (select(codes.c.code,
+                   Trade.is_option,
+                   Trade.action.in_([TradeAction.SELL_TO_OPEN, TradeAction.SELL_TO_CLOSE]),
+                   Trade.action == TradeAction.BUY_TO_OPEN,
+                   Trade.quantity,
+                   Trade.price,
+                   func.coalesce(Trade.fees, 0.0),
+                   Trade.is_closed,
+                   func.coalesce(Trade.close_price, 0.0),
+                   Trade.close_price.isnot(None),
+                   func.coalesce(Trade.close_quantity, 0),
+                   # Date ordinals, 0 when there is no expiration
+                   func.coalesce(_date_ordinal(Trade.expiration_date), 0))
+            .join(codes, codes.c.symbol == Trade.symbol)
+            .where(Trade.account_id == account_id).order_by(Trade.id))
+
+    rows = db.session.connection().execute(stmt).cursor
+    trades = np.fromiter(rows, dtype=np.dtype(list(COLUMN_DTYPES.items())))
+    columns = {name: trades[name] for name in COLUMN_DTYPES}
+    columns['symbols'] = np.array(db.session.execute(select(codes.c.symbol).order_by(codes.c.code)).scalars().all(),
+                                  dtype=object)
+    return columns
+
+def _running_sum(values: np.ndarray) -> float:
+    """Left-to-right sum, so the result matches adding the values one at a time in Python"""
+    if not len(values):
+        return 0
+    # + 0.0 turns a -0.0 total into 0.0, as starting from 0 does
+    return float(np.cumsum(values)[-1]) + 0.0
+
+def calculate_portfolio_stats_vectorized(columns: Dict[str, np.ndarray], now: Optional[datetime] = None) -> Dict:
+    """calculate_portfolio_stats over column arrays from load_trade_columns.
+
+    Produces the same numbers as the per-trade loop for trades in the same
+    order, except options_positions: it holds Trade objects, which the columns
+    do not, so it is left empty.
+    """
+    stats = calculate_portfolio_stats([])
+    n = len(columns['price'])
+    stats['total_trades'] = n
+    if not n:
+        return stats
+
+    is_option = columns['is_option']
+    is_closed = columns['is_closed']
+    quantity = np.abs(columns['quantity'])
+    close_quantity = np.abs(columns['close_quantity'])
+    price = columns['price']
+    close_price = columns['close_price']
+    fees = columns['fees']
+
+    # Trade.total_cost
+    base_cost = np.where(is_option, price * quantity * 100, price * quantity)
+    base_cost = np.where(columns['is_sell'], -base_cost, base_cost)
+    total_cost = base_cost + fees
+    trade_value = np.abs(total_cost)
+    is_debit = total_cost > 0
+
+    # Trade.realized_pnl
+    close_value = np.where(is_option, close_price * close_quantity * 100, close_price * close_quantity)
+    realized = np.where(columns['is_buy_to_open'], close_value - trade_value, trade_value - close_value)
+    has_close = is_closed & columns['has_close_price'] & (close_quantity != 0)
+    realized = np.where(has_close, realized, 0.0)
+
+    # Trade.is_expired
+    expiration = columns['expiration']
+    expired = is_option & (expiration != 0) & (expiration < expiry_cutoff(now).toordinal())
+
+    stats['options_trades'] = int(is_option.sum())
+    stats['stock_trades'] = n - stats['options_trades']
+    stats['expired_options'] = int(expired.sum())
+    stats['active_options'] = stats['options_trades'] - stats['expired_options']
+    stats['closed_positions'] = int(is_closed.sum())
+    stats['open_positions'] = n - stats['closed_positions']
+    stats['total_fees'] = _running_sum(fees)
+    stats['realized_pnl'] = _running_sum(realized)
+    stats['total_invested'] = _running_sum(np.where(is_debit, trade_value, 0.0))
+    stats['total_proceeds'] = _running_sum(np.where(is_debit, 0.0, trade_value))
+    stats['options_premium_paid'] = _running_sum(np.where(is_debit & is_option, trade_value, 0.0))
+    stats['options_premium_received'] = _running_sum(np.where(~is_debit & is_option, trade_value, 0.0))
+    stats['net_pnl'] = stats['total_proceeds'] - stats['total_invested']
+
+    # Group by symbol; np.bincount accumulates in input order, like the Python loop
+    symbols = columns['symbols']
+    symbol_codes = columns['symbol_code']
+    symbol_pnl = np.bincount(symbol_codes, weights=np.where(is_debit, -trade_value, trade_value),
+                             minlength=len(symbols))
+    # Codes follow order of first appearance, like the Python dict, which breaks ties in the sort
+    symbol_pnl_list = [(symbols[code], float(pnl)) for code, pnl in enumerate(symbol_pnl)]
+    symbol_pnl_list.sort(key=lambda x: x[1], reverse=True)
+    stats['top_performers'] = symbol_pnl_list[:5]
+    stats['worst_performers'] = symbol_pnl_list[-5:]
+
+    _stock_positions(stats, symbols, symbol_codes, ~is_option, is_debit, quantity, trade_value)
+
+    return stats
+
+def _stock_positions(stats: Dict, symbols, symbol_codes, is_stock, is_debit, quantity, trade_value):
+    """Fill stats['stock_positions'], including the running avg_cost of the Python loop"""
+    stock_rows = np.flatnonzero(is_stock)
+    if not len(stock_rows):
+        return
+
+    codes = symbol_codes[stock_rows]
+    debit = is_debit[stock_rows]
+    quantity_delta = np.where(debit, quantity[stock_rows], -quantity[stock_rows])
+    cost_delta = np.where(debit, trade_value[stock_rows], 0.0)
+
+    # Make each symbol's stock trades contiguous, keeping trade order within a symbol
+    order = np.argsort(codes, kind='stable')
+    codes, debit = codes[order], debit[order]
+    quantity_delta, cost_delta = quantity_delta[order], cost_delta[order]
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    ends = np.r_[starts[1:], len(codes)]
+
+    # First stock trade of each symbol, to insert positions in the same order
+    first_row = stock_rows[order][starts]
+    for i in np.argsort(first_row, kind='stable'):
+        start, end = starts[i], ends[i]
+        running_quantity = np.cumsum(quantity_delta[start:end])
+        running_cost = np.cumsum(cost_delta[start:end])
+
+        # avg_cost is only updated by buys that leave a positive quantity
+        updates = np.flatnonzero(debit[start:end] & (running_quantity > 0))
+        avg_cost = float(running_cost[updates[-1]] / running_quantity[updates[-1]]) if len(updates) else 0
+
+        stats['stock_positions'][symbols[codes[start]]] = {
+            'quantity': int(running_quantity[-1]),
+            'avg_cost': avg_cost,
+            'total_cost': float(running_cost[-1]) + 0.0 if debit[start:end].any() else 0,
+        }
+
+def load_portfolio_stats(account_id: int) -> Dict:
+    """An account's portfolio statistics computed from all its trades with NumPy.
+
+    As with the aggregates and sql engines, options_positions is empty.
+    """
+    return calculate_portfolio_stats_vectorized(load_trade_columns(account_id))